@@ -0,0 +1,154 @@
+"""
+Admission control for the chat endpoints of app.py and asgi_app.py.
+
+Every chat request passes two checks before any OpenAI call is made:
+
+- TokenBucketLimiter rate limits per client address and per session. A
+  request over either limit is answered 429 with Retry-After right away.
+- ChatTurnGate runs at most one turn per session at a time, so concurrent
+  requests cannot interleave their reads and writes of the session history
+  and counters. A request whose message is identical to one already running
+  or queued for the same session (a double submit, a retried POST) does not
+  start a turn of its own: it waits for that turn and gets the same answer.
+
+Both are shared by threads and coroutines. The gate hands out
+concurrent.futures.Future objects, which Flask threads wait on directly and
+coroutines through `await_future`.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+
+class TokenBucketLimiter:
+    """
+    One token bucket per key: up to `burst` requests at once, refilled at
+    `rate_per_second`. Only the `max_keys` most recently seen keys are kept;
+    a forgotten key starts again with a full bucket.
+    """
+
+    def __init__(self, rate_per_second, burst, max_keys=100_000):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, refilled_at), least recently seen first
+        self._lock = threading.Lock()
+        self.stats = {"allowed": 0, "rejected": 0}
+
+    def acquire(self, key):
+        """Takes a token for `key`. Returns 0.0 if the request may go ahead, otherwise the seconds until it could."""
+        with self._lock:
+            now = time.monotonic()
+            tokens, refilled_at = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - refilled_at) * self.rate_per_second)
+            if tokens >= 1:
+                tokens -= 1
+                wait_seconds = 0.0
+                self.stats["allowed"] += 1
+            else:
+                wait_seconds = (1 - tokens) / self.rate_per_second
+                self.stats["rejected"] += 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait_seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {"keys": len(self._buckets), **self.stats}
+
+
+class ChatTurn:
+    """One queued or running chat turn. `started` resolves when it may run, `outcome` when it has finished."""
+
+    def __init__(self, session_id, message):
+        self.session_id = session_id
+        self.message = message
+        self.started = Future()
+        self.outcome = Future()
+        self.started_at = None
+
+
+class ChatTurnGate:
+    """
+    Serializes chat turns per session and coalesces identical messages.
+
+    `enter` returns (turn, is_leader). A leader waits for `turn.started`,
+    answers the request and must call `leave` with the outcome, which is then
+    shared with every follower waiting on `turn.outcome`. An outcome of None
+    means the leader gave up without an answer. At most `max_waiting_turns`
+    distinct messages queue behind the running one; a turn running for longer
+    than `stale_turn_seconds` is presumed abandoned and releases the session.
+    """
+
+    def __init__(self, max_waiting_turns=2, stale_turn_seconds=120.0, logger=None):
+        self.max_waiting_turns = max_waiting_turns
+        self.stale_turn_seconds = stale_turn_seconds
+        self.logger = logger
+        self._queues = {}  # session_id -> deque of ChatTurn; the first one is running
+        self._lock = threading.Lock()
+        self.stats = {"turns": 0, "coalesced": 0, "waited": 0, "rejected": 0, "abandoned": 0}
+
+    def enter(self, session_id, message):
+        """Returns (turn, is_leader), or (None, False) when too many turns are already waiting."""
+        message = message.strip()
+        with self._lock:
+            queue = self._queues.get(session_id)
+            if queue and queue[0].started_at is not None and time.monotonic() - queue[0].started_at > self.stale_turn_seconds:
+                self.stats["abandoned"] += 1
+                if self.logger:
+                    self.logger.warning(f"Released the chat turn of session {session_id} after {self.stale_turn_seconds:.0f}s without an answer.")
+                self._release(queue[0], None)
+                queue = self._queues.get(session_id)
+            if queue is None:
+                queue = self._queues[session_id] = deque()
+
+            for turn in queue:
+                if turn.message == message:
+                    self.stats["coalesced"] += 1
+                    return turn, False
+            if len(queue) > self.max_waiting_turns:
+                self.stats["rejected"] += 1
+                return None, False
+
+            turn = ChatTurn(session_id, message)
+            queue.append(turn)
+            self.stats["turns"] += 1
+            if len(queue) == 1:
+                self._start(turn)
+            else:
+                self.stats["waited"] += 1
+            return turn, True
+
+    def leave(self, turn, outcome):
+        """Finishes a turn, hands its outcome to the followers and starts the next turn of the session. Idempotent."""
+        with self._lock:
+            self._release(turn, outcome)
+
+    def _start(self, turn):
+        turn.started_at = time.monotonic()
+        turn.started.set_result(None)
+
+    def _release(self, turn, outcome):
+        if turn.outcome.done():
+            return
+        turn.outcome.set_result(outcome)
+        queue = self._queues[turn.session_id]
+        was_running = queue[0] is turn
+        queue.remove(turn)
+        if not queue:
+            del self._queues[turn.session_id]
+        elif was_running:
+            self._start(queue[0])
+
+    def snapshot(self):
+        with self._lock:
+            return {"sessions_in_flight": len(self._queues), **self.stats}
+
+
+async def await_future(future, timeout):
+    """Awaits a gate future from a coroutine; raises asyncio.TimeoutError after `timeout` seconds."""
+    # Shielded: a waiter that times out or is cancelled must not cancel the future its turn shares.
+    return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
@@ -1,13 +1,42 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from ravendb import DocumentStore
+from werkzeug.middleware.proxy_fix import ProxyFix
+import contextvars
+import functools
+import json
 import logging
+import math
+import os
 import re
+import threading
+import time
+import types
 import uuid 
-from openai import OpenAI
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import numpy as np
+from openai import DefaultHttpxClient, OpenAI
+from admission import ChatTurnGate, TokenBucketLimiter
+from caching import CompletionResultCache, SemanticAnswerCache
+from embeddings import DEFAULT_MODELS, create_embedding_backend
+from prompt_assembly import PromptBudget, TokenCounter, assemble_prompt
+from resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    TimeoutHTTPAdapter,
+    call_with_deadline,
+    is_transient_openai_error,
+)
+from retrieval import drop_overlapping_chunks, reciprocal_rank_fusion
+from session_store import InMemorySessionStore, RavenDBSessionArchive, RavenDBSessionStore
+from telemetry import MetricsRegistry, RequestTrace, TraceLog, current_trace
+from vector_index import LocalVectorIndex
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["ETag"])
 
 # --- Logging Configuration ---
 # Configure the Flask app's logger directly to avoid duplicate logs.
@@ -28,31 +57,211 @@ else:
     app.logger.setLevel(logging.DEBUG)
 
 
+# --- Outbound Call Resilience ---
+# Deadlines bound a whole call, retries included; see resilience.py.
+OPENAI_CONNECT_TIMEOUT_SECONDS = 5.0
+OPENAI_MAX_CONNECTIONS = 64                # Pool shared by all threads; extra callers wait for a connection within their deadline
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 32
+OPENAI_HELPER_DEADLINE_SECONDS = 10.0      # Legality check, query enhancement, title and query embedding
+OPENAI_SUMMARY_DEADLINE_SECONDS = 30.0     # Background summary folds
+OPENAI_COMPLETION_DEADLINE_SECONDS = 60.0  # Final answer; for streams, the read timeout between chunks
+OPENAI_RETRY_ATTEMPTS = 3
+RAVENDB_CONNECT_TIMEOUT_SECONDS = 2.0
+RAVENDB_READ_TIMEOUT_SECONDS = 10.0        # Socket timeout; the client itself never times out a request
+RAVENDB_QUERY_DEADLINE_SECONDS = 3.0       # Context queries, retries included
+RAVENDB_RETRY_ATTEMPTS = 2
+RAVENDB_POOL_SIZE = 32                     # Keep-alive connections per DocumentStore (requests defaults to 10)
+RAVENDB_QUERY_WORKERS = 16                 # Threads that run context queries so callers can leave at the deadline
+RAVENDB_RECONNECT_INTERVAL_SECONDS = 15.0  # Minimum gap between attempts to create a missing DocumentStore
+RETRY_BASE_DELAY_SECONDS = 0.25            # Backoff before retry n is uniform in [0, base * 2^(n-1)]
+RETRY_MAX_DELAY_SECONDS = 4.0
+CIRCUIT_FAILURE_THRESHOLD = 5              # Consecutive transient failures that open a breaker
+CIRCUIT_RESET_SECONDS = 30.0               # Time an open breaker fails fast before letting a probe through
+
 # --- OpenAI Configuration ---
 # IMPORTANT: Replace "YOUR_OPENAI_API_KEY" with an actual OpenAI API key.
 # For production, consider using environment variables or a secure secret manager.
-OPENAI_API_KEY = "" # Your OpenAI API Key goes here
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "") # Your OpenAI API Key goes here
 OPENAI_MODEL = "gpt-4o-mini"
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+OPENAI_HTTP_LIMITS = httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS)
+
+def openai_timeout(seconds):
+    return httpx.Timeout(seconds, connect=min(seconds, OPENAI_CONNECT_TIMEOUT_SECONDS))
+
+# The SDK's own retries are off so that every retry shares the call's deadline and circuit breaker.
+openai_client = OpenAI(
+    api_key=OPENAI_API_KEY,
+    max_retries=0,
+    timeout=openai_timeout(OPENAI_COMPLETION_DEADLINE_SECONDS),
+    http_client=DefaultHttpxClient(limits=OPENAI_HTTP_LIMITS)
+)
+openai_breaker = CircuitBreaker("openai", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS, logger=app.logger)
+openai_policy = RetryPolicy(
+    openai_breaker, OPENAI_RETRY_ATTEMPTS, RETRY_BASE_DELAY_SECONDS, RETRY_MAX_DELAY_SECONDS,
+    is_transient=is_transient_openai_error, logger=app.logger
+)
+
+def openai_chat_completion(request_kwargs, deadline_seconds, call_name):
+    """
+    Sends a chat completion request with retries within `deadline_seconds` and
+    records its token usage; raises CircuitOpenError while OpenAI is failing.
+    """
+    response = count_upstream_errors(
+        "openai", call_name, openai_policy.call,
+        lambda timeout: openai_client.chat.completions.create(**request_kwargs, timeout=openai_timeout(timeout)),
+        deadline_seconds, call_name
+    )
+    record_openai_usage(call_name, getattr(response, "usage", None))
+    return response
+
+def openai_embedding(request_kwargs, deadline_seconds, call_name):
+    response = count_upstream_errors(
+        "openai", call_name, openai_policy.call,
+        lambda timeout: openai_client.embeddings.create(**request_kwargs, timeout=openai_timeout(timeout)),
+        deadline_seconds, call_name
+    )
+    record_openai_usage(call_name, getattr(response, "usage", None))
+    return response
 
 # --- RavenDB Configuration ---
 RAVENDB_URLS = ["http://localhost:8080"]
 RAVENDB_DATABASE_NAME = "RAG_Chatbot"
 RAVENDB_COLLECTION_NAME = "Context"
 RAVENDB_SEARCH_FIELD = "Content"
+RAVENDB_EMBEDDING_FIELD = "Embedding"  # Chunk vectors stored by rag_chunker_script.py
+RAVENDB_EMBEDDING_MODEL_FIELD = "EmbeddingModel"  # model_id of the backend that computed them
+
+def connect_document_store():
+    """Creates the DocumentStore with a sized, time-limited HTTP pool; returns None if it cannot be initialized."""
+    try:
+        document_store = DocumentStore(urls=RAVENDB_URLS, database=RAVENDB_DATABASE_NAME)
+        document_store.initialize()
+        adapter = TimeoutHTTPAdapter(RAVENDB_CONNECT_TIMEOUT_SECONDS, RAVENDB_READ_TIMEOUT_SECONDS, RAVENDB_POOL_SIZE)
+        http_session = document_store.get_request_executor().http_session
+        http_session.mount("http://", adapter)
+        http_session.mount("https://", adapter)
+        app.logger.info("Successfully connected to RavenDB.")
+        return document_store
+    except Exception as e:
+        app.logger.error(f"Could not connect to RavenDB: {e}", exc_info=True)
+        return None
 
-store = DocumentStore(urls=RAVENDB_URLS, database=RAVENDB_DATABASE_NAME)
-try:
-    store.initialize()
-    app.logger.info("Successfully connected to RavenDB.")
-except Exception as e:
-    app.logger.error(f"FATAL: Could not connect to RavenDB: {e}", exc_info=True)
-    store = None
+store = connect_document_store()
+store_reconnect_state = {"next_attempt_at": time.monotonic() + RAVENDB_RECONNECT_INTERVAL_SECONDS}
+store_reconnect_lock = threading.Lock()
+
+def get_document_store():
+    """
+    Returns the DocumentStore. While it is missing, one caller at a time tries
+    to create it again, at most once per RAVENDB_RECONNECT_INTERVAL_SECONDS,
+    so a RavenDB outage at startup does not disable retrieval for good.
+    """
+    global store
+    if store is not None or time.monotonic() < store_reconnect_state['next_attempt_at']:
+        return store
+    if store_reconnect_lock.acquire(blocking=False):
+        try:
+            store_reconnect_state['next_attempt_at'] = time.monotonic() + RAVENDB_RECONNECT_INTERVAL_SECONDS
+            store = connect_document_store()
+        finally:
+            store_reconnect_lock.release()
+    return store
+
+# Context queries are reads, so every failure is worth one more attempt.
+ravendb_breaker = CircuitBreaker("ravendb", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS, logger=app.logger)
+ravendb_policy = RetryPolicy(ravendb_breaker, RAVENDB_RETRY_ATTEMPTS, RETRY_BASE_DELAY_SECONDS, RETRY_MAX_DELAY_SECONDS, logger=app.logger)
+ravendb_query_executor = ThreadPoolExecutor(max_workers=RAVENDB_QUERY_WORKERS, thread_name_prefix="ravendb-query")
+
+def run_ravendb_query(func, call_name):
+    """Runs a blocking RavenDB read through ravendb_policy, giving up after RAVENDB_QUERY_DEADLINE_SECONDS."""
+    return count_upstream_errors(
+        "ravendb", call_name, ravendb_policy.call,
+        lambda timeout: call_with_deadline(ravendb_query_executor, func, timeout),
+        RAVENDB_QUERY_DEADLINE_SECONDS, call_name
+    )
 
 # --- Configuration Constants ---
-MAX_MESSAGES_BEFORE_SUMMARY = 7   # Number of messages before summarization
 ILLEGAL_PROMPT_THRESHOLD = 3      # Number of max consecutive illegal prompts before lockout
 K_RETRIEVAL_CHUNKS = 5            # Number of chunks to retrieve from RavenDB
+SERVER_THREADS = int(os.environ.get("GRIP_SERVER_THREADS", 8))  # Request threads per process (gunicorn --threads)
+PRE_RETRIEVAL_TASKS_PER_TURN = 4  # Legality check, query enhancement, title and speculative retrieval
+PRE_RETRIEVAL_WORKERS = SERVER_THREADS * PRE_RETRIEVAL_TASKS_PER_TURN  # No turn waits behind another's stages
+SPECULATION_MIN_REUSE_RATE = 0.5  # Share of messages the enhancement leaves unchanged below which speculation stops
+SPECULATION_REUSE_WEIGHT = 0.05   # Weight of the latest turn in that moving share
+
+# --- Retrieval ---
+RETRIEVAL_MODE = os.environ.get("GRIP_RETRIEVAL_MODE", "vector")  # "vector", "fulltext" or "hybrid" (both, fused with RRF)
+QUERY_ENHANCEMENT_ENABLED = os.environ.get("GRIP_QUERY_ENHANCEMENT", "on") != "off"  # Hybrid retrieval rarely needs the LLM rewrite
+VECTOR_SEARCH_MIN_SIMILARITY = 0.8  # Similarity floor when RavenDB embeds chunk text itself (GRIP_EMBEDDING_BACKEND=ravendb)
+STORED_VECTOR_MIN_SIMILARITY = float(os.environ.get("GRIP_VECTOR_MIN_SIMILARITY", 0.35))  # Floor for stored vectors; tune per embedding model
+HYBRID_CANDIDATES_PER_QUERY = 20    # Chunks each hybrid query contributes before fusion and deduplication
+SPARE_CANDIDATES = 3                # Extra chunks a vector or full-text query fetches to refill slots of dropped duplicates
+
+# --- Rolling Conversation Summary ---
+RECENT_HISTORY_MESSAGES = 4       # Latest messages that are always sent verbatim and never summarized
+SUMMARY_FOLD_BATCH_MESSAGES = 4   # Messages that must leave the recent window before a fold runs
+SUMMARY_MAX_TOKENS = 500          # Output cap of every summary call, which also bounds the summary size
+SUMMARY_WORKERS = 2               # Background threads that fold history into summaries
+
+# --- Prompt Token Budget ---
+# The system instruction and the user's message are always sent in full; the
+# other parts are cut to their allocation and context gets what is left of the total.
+PROMPT_TOTAL_TOKENS = 6000        # Cap for the whole final completion prompt
+PROMPT_SUMMARY_TOKENS = 600       # Allocation for the rolling conversation summary
+PROMPT_HISTORY_TOKENS = 1500      # Allocation for verbatim recent history
+PROMPT_CONTEXT_TOKENS = 3000      # Allocation for retrieved chunks; lowest-ranked are trimmed or dropped first
+
+# --- Session Store ---
+SESSION_STORE_BACKEND = os.environ.get("GRIP_SESSION_STORE", "ravendb")  # "ravendb" or "memory"
+SESSION_FLUSH_INTERVAL_SECONDS = 1.0  # Write-behind delay before session changes reach RavenDB
+SESSION_CACHE_TTL_SECONDS = 5.0       # Clean cached sessions older than this are reloaded from RavenDB
+MAX_SESSIONS_PAGE_SIZE = 500          # Upper bound for the `limit` of /get_sessions
+SESSION_MEMORY_LIMIT_BYTES = float(os.environ.get("GRIP_SESSION_MEMORY_MB", 256)) * 1_000_000  # Estimated resident session data
+SESSION_IDLE_TTL_SECONDS = float(os.environ.get("GRIP_SESSION_IDLE_TTL_SECONDS", 86400))  # In-memory store: idle sessions are evicted
+SESSION_MIN_RESIDENT_SECONDS = 60.0   # Sessions used this recently are never evicted for memory
+SESSION_MAX_HISTORY_MESSAGES = 200    # In-memory store: older messages already in the summary are compacted away
+SESSION_ARCHIVE_ENABLED = os.environ.get("GRIP_SESSION_ARCHIVE", "off") == "on"  # In-memory store: keep evicted sessions in RavenDB
+
+# --- Admission Control ---
+RATE_LIMITS_ENABLED = os.environ.get("GRIP_RATE_LIMITS", "on") != "off"
+CLIENT_RATE_LIMIT_PER_MINUTE = float(os.environ.get("GRIP_CLIENT_RATE_LIMIT_PER_MINUTE", 30))   # Chat requests per client address
+CLIENT_RATE_LIMIT_BURST = 10
+SESSION_RATE_LIMIT_PER_MINUTE = float(os.environ.get("GRIP_SESSION_RATE_LIMIT_PER_MINUTE", 12))  # Chat requests per session
+SESSION_RATE_LIMIT_BURST = 4          # Lets a double submit and a quick follow-up through
+RATE_LIMIT_MAX_KEYS = 100_000         # Client addresses and sessions remembered by each limiter
+TRUSTED_PROXY_HOPS = int(os.environ.get("GRIP_TRUSTED_PROXY_HOPS", 0))  # Reverse proxies whose X-Forwarded-For entry is trusted
+SESSION_MAX_WAITING_TURNS = 2         # Distinct messages that may queue behind the one being answered
+SESSION_TURN_TIMEOUT_SECONDS = 120.0  # Longer than every deadline of one turn; queued requests give up after it
+
+# --- Embeddings ---
+EMBEDDING_BACKEND = os.environ.get("GRIP_EMBEDDING_BACKEND", "openai")  # Must match rag_chunker_script.py; "ravendb" embeds at query time
+EMBEDDING_MODEL = os.environ.get("GRIP_EMBEDDING_MODEL")  # Must match rag_chunker_script.py --embedding-model; None uses the default
+STORED_EMBEDDINGS_CHECK_SECONDS = 300  # How often vector retrieval re-checks that chunks carry vectors of the query model
+QUERY_EMBEDDING_CACHE_MAX_ENTRIES = 2000   # LRU capacity; float32 vectors take about 6 KB each at 1536 dimensions
+QUERY_EMBEDDING_CACHE_TTL_SECONDS = 86400
+
+# --- Local Vector Index ---
+LOCAL_VECTOR_INDEX_DIR = os.environ.get("GRIP_LOCAL_VECTOR_INDEX")  # Written by rag_chunker_script.py --vector-index
+LOCAL_VECTOR_INDEX_MODE = os.environ.get("GRIP_LOCAL_VECTOR_INDEX_MODE", "fallback")  # "fallback" or "first" (tier in front of RavenDB)
+
+# --- Observability ---
+METRICS_ENABLED = os.environ.get("GRIP_METRICS", "on") != "off"  # Serves /metrics; "off" turns every metric into a no-op
+TRACE_LOG_PATH = os.environ.get("GRIP_TRACE_LOG")  # Optional JSON-lines file with one record per chat request
+
+# --- Semantic Answer Cache ---
+SEMANTIC_CACHE_ENABLED = True
+SEMANTIC_CACHE_SIMILARITY_THRESHOLD = 0.92  # Minimum cosine similarity between standalone questions
+SEMANTIC_CACHE_MAX_ENTRIES = 1000           # LRU capacity
+SEMANTIC_CACHE_TTL_SECONDS = 3600           # Answers older than this are never served
+SEMANTIC_CACHE_CONTEXT_CHECK_SECONDS = 30   # How often the Context collection is checked for changes
+
+# --- Legality / Enhancement Result Cache ---
+# Bump a prompt version whenever its prompt text changes so old results are not reused.
+LEGALITY_PROMPT_VERSION = "1"
+ENHANCEMENT_PROMPT_VERSION = "1"
+HELPER_CACHE_MAX_ENTRIES = 5000
+HELPER_CACHE_TTL_SECONDS = 86400
+HELPER_CACHE_PATH = os.environ.get("GRIP_HELPER_CACHE_PATH")  # Optional SQLite file to persist across restarts
 
 
 # --- System-Level Engineered Instructions for LLM ---
@@ -78,10 +287,375 @@ Your purpose is to provide reliable, context-grounded assistance about RavenDB u
 }
 
 # --- Session Management ---
-chat_sessions = {}
+# Sessions are persisted in RavenDB so several worker processes can share them
+# and restarts lose nothing; the in-memory store is kept for local development.
+# Either way the sessions held in this process stay under SESSION_MEMORY_LIMIT_BYTES.
+if store and SESSION_STORE_BACKEND == "ravendb":
+    session_store = RavenDBSessionStore(
+        store,
+        flush_interval_seconds=SESSION_FLUSH_INTERVAL_SECONDS,
+        cache_ttl_seconds=SESSION_CACHE_TTL_SECONDS,
+        max_cached_bytes=SESSION_MEMORY_LIMIT_BYTES,
+        logger=app.logger
+    )
+else:
+    session_store = InMemorySessionStore(
+        idle_ttl_seconds=SESSION_IDLE_TTL_SECONDS,
+        max_memory_bytes=SESSION_MEMORY_LIMIT_BYTES,
+        max_history_messages=SESSION_MAX_HISTORY_MESSAGES,
+        min_resident_seconds=SESSION_MIN_RESIDENT_SECONDS,
+        archive=RavenDBSessionArchive(store, logger=app.logger) if store and SESSION_ARCHIVE_ENABLED else None,
+        logger=app.logger
+    )
 
-def check_message_legality(user_message):
-    """Checks if a user message is related to RavenDB using OpenAI."""
+# --- Admission Control ---
+# Rate limits are checked before anything else and each session answers one
+# message at a time, so requests that are turned away, or that repeat a
+# message already being answered, never reach OpenAI.
+client_rate_limiter = TokenBucketLimiter(CLIENT_RATE_LIMIT_PER_MINUTE / 60, CLIENT_RATE_LIMIT_BURST, RATE_LIMIT_MAX_KEYS)
+session_rate_limiter = TokenBucketLimiter(SESSION_RATE_LIMIT_PER_MINUTE / 60, SESSION_RATE_LIMIT_BURST, RATE_LIMIT_MAX_KEYS)
+chat_turn_gate = ChatTurnGate(SESSION_MAX_WAITING_TURNS, SESSION_TURN_TIMEOUT_SECONDS, logger=app.logger)
+# Behind a load balancer every request comes from the balancer's address, so
+# the client limit is keyed on the address the trusted proxies forwarded.
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
+
+def forwarded_client_address(forwarded_for, peer_address):
+    """The client address as ProxyFix reads it: TRUSTED_PROXY_HOPS entries from the end of X-Forwarded-For."""
+    forwarded = [address.strip() for address in forwarded_for.split(",")] if forwarded_for else []
+    if TRUSTED_PROXY_HOPS and len(forwarded) >= TRUSTED_PROXY_HOPS:
+        return forwarded[-TRUSTED_PROXY_HOPS]
+    return peer_address
+
+# --- Semantic Answer Cache ---
+# Answers to first questions in a session are reused for later questions whose
+# enhanced (standalone) form is semantically equivalent. Follow-up questions are
+# never cached because history or a summary changes what the right answer is.
+answer_cache = SemanticAnswerCache(
+    similarity_threshold=SEMANTIC_CACHE_SIMILARITY_THRESHOLD,
+    max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+    ttl_seconds=SEMANTIC_CACHE_TTL_SECONDS
+)
+
+context_collection_state = {"etag": None, "checked_at": float("-inf")}
+context_collection_lock = threading.Lock()
+
+def fetch_context_collection_etag():
+    """Returns RavenDB's result etag for a Context collection query; it changes with any write to the collection."""
+    document_store = get_document_store()
+    if not document_store:
+        return None
+
+    def fetch_etag():
+        query_stats = []
+        with document_store.open_session() as session:
+            list(session.advanced.raw_query(f"from {RAVENDB_COLLECTION_NAME} limit 1", dict).statistics(query_stats.append))
+        return query_stats[0].result_etag if query_stats else None
+
+    try:
+        return run_ravendb_query(fetch_etag, "context_change_check")
+    except Exception as e:
+        app.logger.error(f"Could not check Context collection for changes: {e}")
+        return None
+
+def invalidate_cache_on_context_change():
+    """Drops every cached answer if the Context collection changed since the last check."""
+    with context_collection_lock:
+        now = time.monotonic()
+        if now - context_collection_state['checked_at'] < SEMANTIC_CACHE_CONTEXT_CHECK_SECONDS:
+            return
+        context_collection_state['checked_at'] = now
+
+    current_etag = fetch_context_collection_etag()
+    if current_etag is None:
+        return
+    with context_collection_lock:
+        previous_etag = context_collection_state['etag']
+        context_collection_state['etag'] = current_etag
+    if previous_etag is not None and current_etag != previous_etag:
+        app.logger.info("Context collection changed. Invalidating semantic answer cache.")
+        answer_cache.invalidate()
+
+# --- Legality / Enhancement Result Cache ---
+# Identical messages (retries, double-clicks, common questions) reuse the
+# previous legality verdict and enhanced query instead of calling OpenAI again.
+legality_cache = CompletionResultCache("legality", HELPER_CACHE_MAX_ENTRIES, HELPER_CACHE_TTL_SECONDS, HELPER_CACHE_PATH)
+enhancement_cache = CompletionResultCache("enhancement", HELPER_CACHE_MAX_ENTRIES, HELPER_CACHE_TTL_SECONDS, HELPER_CACHE_PATH)
+
+def legality_cache_key(user_message):
+    return CompletionResultCache.make_key(OPENAI_MODEL, LEGALITY_PROMPT_VERSION, user_message)
+
+def enhancement_cache_key(user_message):
+    return CompletionResultCache.make_key(OPENAI_MODEL, ENHANCEMENT_PROMPT_VERSION, user_message)
+
+# --- Query Embeddings ---
+# Chunks carry vectors computed at ingestion, so only the query is embedded on
+# the request path, with the same backend. Each distinct query is embedded
+# once: repeats, such as the enhanced query used by both the semantic cache and
+# retrieval, come from an LRU cache.
+if EMBEDDING_BACKEND not in ("openai", "sentence-transformers", "hashing", "ravendb"):
+    app.logger.warning(f"Unknown GRIP_EMBEDDING_BACKEND '{EMBEDDING_BACKEND}'; using OpenAI embeddings.")
+    EMBEDDING_BACKEND = "openai"
+# Local backends (sentence-transformers, hashing) embed semantic cache questions locally too; only with
+# "ravendb", which embeds chunks server-side, does OpenAI embed those questions with its default model.
+OPENAI_EMBEDDING_MODEL = (EMBEDDING_MODEL if EMBEDDING_BACKEND == "openai" else None) or DEFAULT_MODELS["openai"]
+local_embedder = None
+if EMBEDDING_BACKEND in ("sentence-transformers", "hashing"):
+    local_embedder = create_embedding_backend(EMBEDDING_BACKEND, EMBEDDING_MODEL)
+query_embedding_model_id = local_embedder.model_id if local_embedder else f"openai/{OPENAI_EMBEDDING_MODEL}"
+query_embedding_cache = CompletionResultCache("query_embedding", QUERY_EMBEDDING_CACHE_MAX_ENTRIES, QUERY_EMBEDDING_CACHE_TTL_SECONDS)
+
+def query_embedding_cache_key(text):
+    return CompletionResultCache.make_key(query_embedding_model_id, "embedding", text)
+
+# --- Local Vector Index ---
+# A memory-mapped copy of the chunk vectors (see vector_index.py). It answers
+# vector queries when RavenDB is unreachable or a query fails, and with
+# GRIP_LOCAL_VECTOR_INDEX_MODE=first it answers them before RavenDB is asked.
+local_vector_index = None
+if LOCAL_VECTOR_INDEX_DIR:
+    try:
+        local_vector_index = LocalVectorIndex(LOCAL_VECTOR_INDEX_DIR)
+        app.logger.info(f"Loaded local vector index: {local_vector_index.count} chunks ({local_vector_index.dtype}), "
+                        f"mode '{LOCAL_VECTOR_INDEX_MODE}'.")
+    except Exception as e:
+        app.logger.error(f"Could not open the local vector index at {LOCAL_VECTOR_INDEX_DIR}: {e}")
+    if local_vector_index is not None and (EMBEDDING_BACKEND == "ravendb" or local_vector_index.model_id != query_embedding_model_id):
+        app.logger.error(f"Local vector index holds '{local_vector_index.model_id}' vectors but queries are embedded with "
+                         f"'{'RavenDB' if EMBEDDING_BACKEND == 'ravendb' else query_embedding_model_id}'; it is disabled.")
+        local_vector_index = None
+
+# --- Metrics and Tracing ---
+# Stage timings, token usage and upstream errors are recorded as they happen;
+# cache, circuit breaker and retry counters are read from their owners when
+# /metrics is scraped. Session ids never become labels: per-session token
+# spend is in the trace log.
+metrics_registry = MetricsRegistry(enabled=METRICS_ENABLED, logger=app.logger)
+requests_total = metrics_registry.counter("grip_requests_total", "Chat requests by endpoint and HTTP status.", ("endpoint", "status"))
+request_duration = metrics_registry.histogram(
+    "grip_request_duration_seconds", "Time until a chat response (for streams, its headers) is ready.", ("endpoint",)
+)
+stage_duration = metrics_registry.histogram("grip_stage_duration_seconds", "Duration of each chat pipeline stage.", ("stage",))
+openai_tokens = metrics_registry.counter("grip_openai_tokens_total", "OpenAI tokens by call and kind (prompt or completion).", ("call", "kind"))
+prompt_part_tokens = metrics_registry.counter(
+    "grip_prompt_tokens_total", "Tokens of the final completion prompt by part, counted locally.", ("part",)
+)
+upstream_errors = metrics_registry.counter(
+    "grip_upstream_errors_total", "Failed OpenAI and RavenDB calls after retries, by error type.", ("dependency", "call", "error")
+)
+
+metered_caches = {
+    "semantic_answer": answer_cache,
+    "legality": legality_cache,
+    "enhancement": enhancement_cache,
+    "query_embedding": query_embedding_cache
+}
+resilience_policies = {"openai": openai_policy, "ravendb": ravendb_policy}
+metrics_registry.collected(
+    "counter", "grip_cache_events_total", "Cache events (hits, misses, evictions, ...) by cache.", ("cache", "event"),
+    lambda: [((name, event), value) for name, cache in metered_caches.items() for event, value in cache.snapshot().items()
+             if event not in ("entries", "hit_rate", "openai_calls_avoided")]
+)
+metrics_registry.collected(
+    "gauge", "grip_cache_entries", "Entries held by each cache.", ("cache",),
+    lambda: [((name,), cache.snapshot()["entries"]) for name, cache in metered_caches.items()]
+)
+metrics_registry.collected(
+    "gauge", "grip_circuit_breaker_state", "1 for the current state of each circuit breaker.", ("dependency", "state"),
+    lambda: [((name, state), int(policy.breaker.state == state))
+             for name, policy in resilience_policies.items() for state in ("closed", "open", "half_open")]
+)
+metrics_registry.collected(
+    "counter", "grip_circuit_breaker_rejected_calls_total", "Calls refused while a circuit breaker was open.", ("dependency",),
+    lambda: [((name,), policy.breaker.rejected_calls) for name, policy in resilience_policies.items()]
+)
+metrics_registry.collected(
+    "counter", "grip_upstream_retries_total", "Retried OpenAI and RavenDB call attempts.", ("dependency",),
+    lambda: [((name,), policy.retries) for name, policy in resilience_policies.items()]
+)
+
+metrics_registry.collected(
+    "gauge", "grip_sessions_resident", "Chat sessions held in this process.", (),
+    lambda: [((), session_store.snapshot()["sessions"])]
+)
+metrics_registry.collected(
+    "gauge", "grip_session_resident_bytes", "Estimated memory of the chat sessions held in this process.", (),
+    lambda: [((), session_store.snapshot()["resident_bytes"])]
+)
+metrics_registry.collected(
+    "counter", "grip_session_events_total", "Session evictions, compacted messages and archive writes and restores.", ("event",),
+    lambda: [((event,), value) for event, value in session_store.snapshot().items() if event not in ("sessions", "resident_bytes")]
+)
+
+rate_limiters = {"client": client_rate_limiter, "session": session_rate_limiter}
+metrics_registry.collected(
+    "counter", "grip_rate_limited_requests_total", "Chat requests refused with 429 by each rate limit.", ("limit",),
+    lambda: [((name,), limiter.snapshot()["rejected"]) for name, limiter in rate_limiters.items()]
+)
+metrics_registry.collected(
+    "counter", "grip_chat_turn_events_total", "Chat turns started, coalesced with an identical message, queued, rejected or abandoned.", ("event",),
+    lambda: [((event,), value) for event, value in chat_turn_gate.snapshot().items() if event != "sessions_in_flight"]
+)
+metrics_registry.collected(
+    "gauge", "grip_sessions_in_flight", "Sessions with a chat turn running or queued.", (),
+    lambda: [((), chat_turn_gate.snapshot()["sessions_in_flight"])]
+)
+
+trace_log = None
+if TRACE_LOG_PATH:
+    try:
+        trace_log = TraceLog(TRACE_LOG_PATH)
+        app.logger.info(f"Writing chat request traces to {TRACE_LOG_PATH}.")
+    except OSError as e:
+        app.logger.error(f"Could not open the trace log {TRACE_LOG_PATH}: {e}")
+
+def record_stage(stage_name, seconds, trace=None):
+    stage_duration.observe((stage_name,), seconds)
+    trace = trace or current_trace.get()
+    if trace is not None:
+        trace.add_span(stage_name, seconds)
+
+def annotate_trace(**attributes):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+def record_openai_usage(call_name, usage, trace=None):
+    """Counts the tokens OpenAI reports for one call."""
+    if usage is None:
+        return
+    trace = trace or current_trace.get()
+    for kind, count in (("prompt", usage.prompt_tokens), ("completion", getattr(usage, "completion_tokens", None) or 0)):
+        openai_tokens.inc((call_name, kind), count)
+        if trace is not None:
+            trace.add_tokens(f"{call_name}.{kind}", count)
+
+def record_final_completion(chat_turn, bot_reply, usage_reported, trace=None):
+    """
+    Counts the final prompt by part. When OpenAI reported no usage for the
+    completion (e.g. a stream), local prompt and reply counts stand in for it.
+    """
+    trace = trace or current_trace.get()
+    if not METRICS_ENABLED and trace is None:
+        return
+    breakdown = chat_turn['prompt_tokens']
+    for part in ("system", "summary", "history", "context", "user"):
+        prompt_part_tokens.inc((part,), breakdown[part])
+    if trace is not None:
+        trace.attributes['prompt_breakdown'] = breakdown
+    if not usage_reported:
+        usage = types.SimpleNamespace(prompt_tokens=breakdown['total'], completion_tokens=token_counter.count(bot_reply))
+        record_openai_usage("chat_completion", usage, trace)
+
+def count_upstream_errors(dependency, call_name, func, *args):
+    try:
+        return func(*args)
+    except Exception as e:
+        upstream_errors.inc((dependency, call_name, type(e).__name__))
+        raise
+
+def start_request_trace(endpoint):
+    return RequestTrace(endpoint) if trace_log is not None else None
+
+def finish_request(endpoint, status, seconds, trace):
+    """Records a finished chat request; traces of streams are written when the stream ends instead."""
+    requests_total.inc((endpoint, str(status)))
+    request_duration.observe((endpoint,), seconds)
+    if trace is not None and not trace.deferred:
+        trace_log.write(trace, status)
+
+def instrumented_endpoint(endpoint):
+    """Decorates a Flask chat view with request metrics and, when enabled, a request trace."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            trace = start_request_trace(endpoint)
+            trace_token = current_trace.set(trace)
+            request_start = time.perf_counter()
+            status = 500
+            try:
+                response = app.make_response(view(*args, **kwargs))
+                status = response.status_code
+                return response
+            finally:
+                current_trace.reset(trace_token)
+                finish_request(endpoint, status, time.perf_counter() - request_start, trace)
+        return wrapper
+    return decorator
+
+def is_answer_cacheable(current_session):
+    return SEMANTIC_CACHE_ENABLED and not current_session['history'] and not current_session.get('conversation_summary')
+
+# --- Prompt Assembly ---
+token_counter = TokenCounter(OPENAI_MODEL, logger=app.logger)
+prompt_budget = PromptBudget(
+    total_tokens=PROMPT_TOTAL_TOKENS,
+    summary_tokens=PROMPT_SUMMARY_TOKENS,
+    history_tokens=PROMPT_HISTORY_TOKENS,
+    context_tokens=PROMPT_CONTEXT_TOKENS
+)
+
+# --- Concurrent Pre-Retrieval Stage ---
+# The legality check, title generation, query enhancement and a speculative
+# vector search on the raw message are independent round trips, so they are
+# started together instead of paying for each latency in sequence. The pool
+# holds every stage of every request thread, so stages never queue behind
+# another turn's; set GRIP_SERVER_THREADS to the server's thread count.
+pre_retrieval_executor = ThreadPoolExecutor(max_workers=PRE_RETRIEVAL_WORKERS, thread_name_prefix="pre-retrieval")
+# Hybrid retrieval runs its full-text query here; submitting it to the pool that
+# is already running the retrieval could deadlock once every thread is busy.
+full_text_executor = ThreadPoolExecutor(max_workers=PRE_RETRIEVAL_WORKERS, thread_name_prefix="full-text")
+# The speculative search is only used as-is when the enhancement returns the
+# message unchanged; otherwise it merely backfills. It is skipped while the
+# moving share of unchanged messages stays below SPECULATION_MIN_REUSE_RATE.
+speculation_state = {"reuse_rate": 1.0, "lock": threading.Lock()}
+
+if RETRIEVAL_MODE not in ("vector", "fulltext", "hybrid"):
+    app.logger.warning(f"Unknown GRIP_RETRIEVAL_MODE '{RETRIEVAL_MODE}'; using vector search.")
+    RETRIEVAL_MODE = "vector"
+app.logger.info(f"Retrieval mode: {RETRIEVAL_MODE}, query enhancement {'on' if QUERY_ENHANCEMENT_ENABLED else 'off'}, "
+                f"embeddings: {'computed by RavenDB' if EMBEDDING_BACKEND == 'ravendb' else query_embedding_model_id}.")
+
+def run_timed_stage(stage_name, func, *args):
+    """Runs a single pipeline stage, logs how long it took and records it in the metrics and request trace."""
+    stage_start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        elapsed = time.perf_counter() - stage_start
+        record_stage(stage_name, elapsed)
+        app.logger.info(f"Stage '{stage_name}' took {elapsed * 1000:.1f} ms.")
+
+def submit_timed_stage(stage_name, func, *args):
+    """Starts a stage on the pre-retrieval pool, carrying over the caller's request trace."""
+    return pre_retrieval_executor.submit(contextvars.copy_context().run, run_timed_stage, stage_name, func, *args)
+
+def speculative_retrieval_likely_reused():
+    """Whether a search on the raw message is likely to be served as the turn's context."""
+    if not QUERY_ENHANCEMENT_ENABLED:
+        return True
+    with speculation_state["lock"]:
+        return speculation_state["reuse_rate"] >= SPECULATION_MIN_REUSE_RATE
+
+def record_enhancement_outcome(user_message, enhanced_query):
+    """Updates the share of messages the enhancement leaves unchanged; returns whether this one was."""
+    unchanged = enhanced_query.strip() == user_message.strip()
+    if QUERY_ENHANCEMENT_ENABLED:
+        with speculation_state["lock"]:
+            speculation_state["reuse_rate"] += SPECULATION_REUSE_WEIGHT * (unchanged - speculation_state["reuse_rate"])
+    return unchanged
+
+def discard_speculative_work(*futures):
+    """Cancels pending speculative futures; results of running ones are ignored."""
+    for future in futures:
+        if future is not None:
+            future.cancel()
+
+# --- OpenAI Helper Requests ---
+# Each helper is split into a request builder and a response parser so the
+# synchronous Flask path and the asyncio path in asgi_app.py share prompts.
+def legality_completion_request(user_message):
+    """Builds the OpenAI request that classifies a message as RavenDB-related."""
     legality_prompt = f"""You are an expert RavenDB assistant named "Grip". You are being asked to validate whether a user's query is related to RavenDB or its general usage context.
 
 Rules:
@@ -94,36 +668,135 @@ Rules:
 Now evaluate the following user prompt:
 "{user_message}"
 """
+    return {
+        "model": OPENAI_MODEL,
+        "messages": [{"role": "user", "content": legality_prompt}],
+        "max_tokens": 10
+    }
+
+def parse_legality_response(response):
+    result = response.choices[0].message.content.strip().lower()
+    is_legal = result == "true"
+    app.logger.info(f"Query Legality Check: '{'LEGAL' if is_legal else 'ILLEGAL'}'.")
+    return is_legal
+
+def enhancement_completion_request(user_message):
+    """Builds the OpenAI request that rewrites a message for semantic search."""
+    enhancement_prompt = f"""Enhance this user message to improve semantic similarity search over embedded documentation about RavenDB. Do not change the meaning, only improve searchability:
+"{user_message}"
+"""
+    return {
+        "model": OPENAI_MODEL,
+        "messages": [{"role": "user", "content": enhancement_prompt}],
+        "max_tokens": 100
+    }
+
+def parse_enhancement_response(response, user_message):
+    enhanced_query = response.choices[0].message.content.strip()
+    app.logger.debug(f"Enhanced query for search: '{enhanced_query}' (Original: '{user_message}')")
+    return enhanced_query
+
+def title_completion_request(first_user_message):
+    """Builds the OpenAI request that names a new chat session."""
+    return {
+        "model": OPENAI_MODEL,
+        "messages": [
+            {"role": "user", "content": f"Generate a concise 3–5 word title for a chat session that begins with this message:\n\"{first_user_message}\""}
+        ],
+        "max_tokens": 20
+    }
+
+def parse_title_response(response):
+    title = response.choices[0].message.content.strip()
+    title = re.sub(r'^["\']|["\']$', '', title).strip()
+    app.logger.debug(f"Generated session title: '{title}'")
+    return title if title else "New Chat"
+
+def summary_completion_request(new_messages, previous_summary=""):
+    """Builds the OpenAI request that folds new messages into the running conversation summary."""
+    conversation_text = ""
+    for msg in new_messages:
+        role = "User" if msg['role'] == 'user' else "Assistant"
+        conversation_text += f"{role}: {msg['content']}\n"
+    
+    if previous_summary:
+        summary_prompt = f"""Update the running summary of a conversation with the newer messages below. Keep everything from the existing summary that still matters, add the technical intent and context of the new messages, and stay compact. Output only the updated summary, suitable for re-use in a future system prompt.
+
+Existing summary:
+{previous_summary}
+
+Newer messages:
+{conversation_text}
+"""
+    else:
+        summary_prompt = f"""Summarize the following conversation history into a compact form that preserves all technical intent and context. Output should be suitable for re-use in a future system prompt.
+
+{conversation_text}
+"""
+    return {
+        "model": OPENAI_MODEL,
+        "messages": [{"role": "user", "content": summary_prompt}],
+        "max_tokens": SUMMARY_MAX_TOKENS
+    }
+
+def parse_summary_response(response):
+    summary = response.choices[0].message.content.strip()
+    app.logger.debug(f"Generated conversation summary. Length: {len(summary)} characters.")
+    return summary
+
+def embedding_request(text):
+    """Builds the OpenAI request that embeds a standalone question."""
+    return {"model": OPENAI_EMBEDDING_MODEL, "input": text}
+
+def parse_embedding_response(response):
+    return response.data[0].embedding
+
+# The cache lookups and writes around each helper call are shared with the
+# async helpers in asgi_app.py, which only replace the OpenAI round trip.
+def cached_legality(user_message):
+    """Returns the cached verdict for a message, or None."""
+    cached_result = legality_cache.get(legality_cache_key(user_message))
+    if cached_result is not None:
+        app.logger.info(f"Query Legality Check: '{'LEGAL' if cached_result else 'ILLEGAL'}' (cached).")
+    return cached_result
+
+def cache_legality_response(user_message, response):
+    """Parses a legality verdict and caches it for identical messages."""
+    is_legal = parse_legality_response(response)
+    legality_cache.set(legality_cache_key(user_message), is_legal)
+    return is_legal
+
+def cached_enhancement(user_message):
+    return enhancement_cache.get(enhancement_cache_key(user_message))
+
+def cache_enhancement_response(user_message, response):
+    """Parses an enhanced query and caches it for identical messages."""
+    enhanced_query = parse_enhancement_response(response, user_message)
+    enhancement_cache.set(enhancement_cache_key(user_message), enhanced_query)
+    return enhanced_query
+
+def check_message_legality(user_message):
+    """Checks if a user message is related to RavenDB using OpenAI."""
+    cached_result = cached_legality(user_message)
+    if cached_result is not None:
+        return cached_result
 
     try:
-        response = openai_client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[{"role": "user", "content": legality_prompt}],
-            max_tokens=10
-        )
-        result = response.choices[0].message.content.strip().lower()
-        is_legal = result == "true"
-        app.logger.info(f"Query Legality Check: '{'LEGAL' if is_legal else 'ILLEGAL'}'.")
-        return is_legal
+        response = openai_chat_completion(legality_completion_request(user_message), OPENAI_HELPER_DEADLINE_SECONDS, "legality_check")
+        return cache_legality_response(user_message, response)
     except Exception as e:
         app.logger.error(f"Failed to check message legality: {e}")
         return True  # Default to legal if check fails
 
 def enhance_query_for_search(user_message):
     """Enhances user message for better semantic search."""
-    enhancement_prompt = f"""Enhance this user message to improve semantic similarity search over embedded documentation about RavenDB. Do not change the meaning, only improve searchability:
-"{user_message}"
-"""
+    cached_query = cached_enhancement(user_message)
+    if cached_query is not None:
+        return cached_query
 
     try:
-        response = openai_client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[{"role": "user", "content": enhancement_prompt}],
-            max_tokens=100
-        )
-        enhanced_query = response.choices[0].message.content.strip()
-        app.logger.debug(f"Enhanced query for search: '{enhanced_query}' (Original: '{user_message}')")
-        return enhanced_query
+        response = openai_chat_completion(enhancement_completion_request(user_message), OPENAI_HELPER_DEADLINE_SECONDS, "query_enhancement")
+        return cache_enhancement_response(user_message, response)
     except Exception as e:
         app.logger.error(f"Failed to enhance query: {e}")
         return user_message  # Return original if enhancement fails
@@ -131,93 +804,305 @@ def enhance_query_for_search(user_message):
 def generate_session_title(first_user_message):
     """Generates a concise title for the chat session using OpenAI."""
     try:
-        response = openai_client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
-                {"role": "user", "content": f"Generate a concise 3–5 word title for a chat session that begins with this message:\n\"{first_user_message}\""}
-            ],
-            max_tokens=20
-        )
-        title = response.choices[0].message.content.strip()
-        title = re.sub(r'^["\']|["\']$', '', title).strip()
-        app.logger.debug(f"Generated session title: '{title}'")
-        return title if title else "New Chat"
+        response = openai_chat_completion(title_completion_request(first_user_message), OPENAI_HELPER_DEADLINE_SECONDS, "title_generation")
+        return parse_title_response(response)
     except Exception as e:
         app.logger.error(f"Failed to generate session title: {e}")
         return "New Chat"
 
-def generate_conversation_summary(conversation_history):
-    """Generates a summary of conversation history for memory efficiency."""
-    if not conversation_history:
-        return ""
-    
-    conversation_text = ""
-    for msg in conversation_history:
-        role = "User" if msg['role'] == 'user' else "Assistant"
-        conversation_text += f"{role}: {msg['content']}\n"
-    
-    summary_prompt = f"""Summarize the following conversation history into a compact form that preserves all technical intent and context. Output should be suitable for re-use in a future system prompt.
-
-{conversation_text}
-"""
+def generate_conversation_summary(new_messages, previous_summary=""):
+    """Folds new messages into the previous summary; returns "" if the call fails."""
+    if not new_messages:
+        return previous_summary
 
     try:
-        response = openai_client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[{"role": "user", "content": summary_prompt}],
-            max_tokens=500
+        response = openai_chat_completion(
+            summary_completion_request(new_messages, previous_summary), OPENAI_SUMMARY_DEADLINE_SECONDS, "conversation_summary"
         )
-        summary = response.choices[0].message.content.strip()
-        app.logger.debug(f"Generated conversation summary. Length: {len(summary)} characters.")
-        return summary
+        return parse_summary_response(response)
     except Exception as e:
         app.logger.error(f"Failed to generate conversation summary: {e}")
         return ""
 
+def embed_text(text):
+    """Embeds text with the configured backend; returns None if the call fails."""
+    try:
+        if local_embedder is not None:
+            return local_embedder.embed([text])[0]
+        response = openai_embedding(embedding_request(text), OPENAI_HELPER_DEADLINE_SECONDS, "query_embedding")
+        return parse_embedding_response(response)
+    except Exception as e:
+        app.logger.error(f"Failed to embed text: {e}")
+        return None
+
+def cached_query_embedding(text):
+    return query_embedding_cache.get(query_embedding_cache_key(text))
+
+def cache_query_embedding(text, embedding):
+    """Caches a fresh query embedding as float32; a failed one (None) is not cached."""
+    if embedding is None:
+        return None
+    embedding = np.asarray(embedding, dtype=np.float32)
+    query_embedding_cache.set(query_embedding_cache_key(text), embedding)
+    return embedding
+
+def embed_query(text):
+    """Embeds a query once; later calls with the same text are served from query_embedding_cache."""
+    cached_embedding = cached_query_embedding(text)
+    if cached_embedding is not None:
+        return cached_embedding
+    return cache_query_embedding(text, embed_text(text))
+
+def lookup_cached_answer(session_id, embedding):
+    """Returns a cached answer for the embedded question, if one is close enough."""
+    if embedding is None:
+        return None
+    invalidate_cache_on_context_change()
+    cached_reply, similarity = answer_cache.lookup(embedding)
+    if cached_reply is not None:
+        app.logger.info(f"Semantic cache hit for session {session_id} (similarity {similarity:.3f}).")
+    else:
+        app.logger.debug(f"Semantic cache miss for session {session_id} (best similarity {similarity:.3f}).")
+    return cached_reply
+
+def run_context_query(where_clause, parameters, limit):
+    """
+    Runs one ranked query over the Context collection and returns the matching
+    chunks as dicts, or None when RavenDB is unavailable, the query fails or
+    its circuit breaker is open.
+    """
+    document_store = get_document_store()
+    if not document_store:
+        return None
+
+    rql_query = f"""
+    from {RAVENDB_COLLECTION_NAME} as a
+    where {where_clause}
+    select {{
+        Id: id(a),
+        Content: a.{RAVENDB_SEARCH_FIELD},
+        Title: a.Title,
+        SourceFile: a.SourceFile,
+        ChunkNumber: a.ChunkNumber
+    }}
+    limit {limit}
+    """
+
+    def execute_query():
+        with document_store.open_session() as session:
+            query = session.advanced.raw_query(rql_query, dict)
+            for name, value in parameters.items():
+                query = query.add_parameter(name, value)
+            return list(query)
+
+    try:
+        return run_ravendb_query(execute_query, "context_query")
+    except CircuitOpenError as e:
+        app.logger.warning(f"Skipped RavenDB query: {e}")
+        return None
+    except Exception as e:
+        app.logger.error(f"RavenDB query failed: {e}", exc_info=True)
+        return None
+
+def vector_search_chunks(search_query, limit=K_RETRIEVAL_CHUNKS, embed=embed_query):
+    """
+    Searches the stored chunk vectors, or lets RavenDB embed chunk text when
+    EMBEDDING_BACKEND is "ravendb". The local vector index, if loaded, stands
+    in for RavenDB when it is unavailable, or goes first in "first" mode.
+    `embed` turns the query into its vector (None if that failed).
+    """
+    if EMBEDDING_BACKEND == "ravendb":
+        where_clause = f"vector.search(embedding.text(a.{RAVENDB_SEARCH_FIELD}), $userInputQuery, {VECTOR_SEARCH_MIN_SIMILARITY})"
+        return run_context_query(where_clause, {"userInputQuery": search_query}, limit) or []
+
+    query_embedding = embed(search_query)
+    if query_embedding is None:
+        return []
+    if local_vector_index is not None and LOCAL_VECTOR_INDEX_MODE == "first":
+        local_results = local_vector_index.search_chunks(query_embedding, limit, STORED_VECTOR_MIN_SIMILARITY)
+        if len(local_results) >= limit:
+            return local_results
+    where_clause = f"vector.search(a.{RAVENDB_EMBEDDING_FIELD}, $queryEmbedding, {STORED_VECTOR_MIN_SIMILARITY})"
+    results = run_context_query(where_clause, {"queryEmbedding": query_embedding.tolist()}, limit)
+    if results is None and local_vector_index is not None:
+        app.logger.warning("RavenDB unavailable; serving the vector query from the local vector index.")
+        return local_vector_index.search_chunks(query_embedding, limit, STORED_VECTOR_MIN_SIMILARITY)
+    return results or []
+
+def full_text_search_chunks(search_query, limit=K_RETRIEVAL_CHUNKS):
+    return run_context_query(f"search(a.{RAVENDB_SEARCH_FIELD}, $userInputQuery)", {"userInputQuery": search_query}, limit) or []
+
+stored_embeddings_state = {"available": None, "checked_at": float("-inf")}
+stored_embeddings_lock = threading.Lock()
+
+def fetch_stored_embeddings_available():
+    """Returns whether any Context chunk carries a vector of the query embedding model, or None if RavenDB cannot tell."""
+    document_store = get_document_store()
+    if not document_store:
+        return None
+
+    def fetch_one():
+        with document_store.open_session() as session:
+            query = session.advanced.raw_query(
+                f"from {RAVENDB_COLLECTION_NAME} where {RAVENDB_EMBEDDING_MODEL_FIELD} = $model limit 1", dict
+            ).add_parameter("model", query_embedding_model_id)
+            return len(list(query)) > 0
+
+    try:
+        return run_ravendb_query(fetch_one, "stored_embeddings_check")
+    except Exception as e:
+        app.logger.error(f"Could not check the Context collection for stored embeddings: {e}")
+        return None
+
+def stored_embeddings_available():
+    """
+    False once a check found no chunk with vectors of the query embedding model:
+    the collection was ingested with another backend or model, or before
+    embeddings were stored. Vector search would then find nothing.
+    """
+    if EMBEDDING_BACKEND == "ravendb":
+        return True
+    with stored_embeddings_lock:
+        now = time.monotonic()
+        if now - stored_embeddings_state['checked_at'] < STORED_EMBEDDINGS_CHECK_SECONDS:
+            return stored_embeddings_state['available'] is not False
+        stored_embeddings_state['checked_at'] = now
+
+    available = fetch_stored_embeddings_available()
+    if available is None:
+        return stored_embeddings_state['available'] is not False
+    with stored_embeddings_lock:
+        previous = stored_embeddings_state['available']
+        stored_embeddings_state['available'] = available
+    if not available and previous is not False:
+        app.logger.warning(f"No chunk in {RAVENDB_COLLECTION_NAME} has '{query_embedding_model_id}' vectors; using full-text "
+                           f"search. Re-run rag_chunker_script.py with the same embedding backend and model as the app.")
+    elif available and previous is False:
+        app.logger.info(f"Chunks with '{query_embedding_model_id}' vectors found; vector search is back on.")
+    return available
+
+def retrieval_embeds_query():
+    """Whether retrieve_context_chunks will embed the query itself, as far as is known without asking RavenDB."""
+    return (RETRIEVAL_MODE != "fulltext" and EMBEDDING_BACKEND != "ravendb"
+            and stored_embeddings_state['available'] is not False)
+
+def retrieve_context_chunks(search_query, embed=embed_query):
+    """
+    Returns up to K_RETRIEVAL_CHUNKS chunks for the query, ranked according to
+    RETRIEVAL_MODE, with text repeated between neighbouring chunks trimmed.
+    `embed` is passed on to vector_search_chunks.
+    """
+    if RETRIEVAL_MODE == "fulltext" or not stored_embeddings_available():
+        return drop_overlapping_chunks(full_text_search_chunks(search_query, K_RETRIEVAL_CHUNKS + SPARE_CANDIDATES), K_RETRIEVAL_CHUNKS)
+    if RETRIEVAL_MODE != "hybrid":
+        return drop_overlapping_chunks(vector_search_chunks(search_query, K_RETRIEVAL_CHUNKS + SPARE_CANDIDATES, embed), K_RETRIEVAL_CHUNKS)
+
+    # Both queries run at once. A failed query returns [], which leaves the other ranking as-is.
+    full_text_future = full_text_executor.submit(full_text_search_chunks, search_query, HYBRID_CANDIDATES_PER_QUERY)
+    vector_results = vector_search_chunks(search_query, HYBRID_CANDIDATES_PER_QUERY, embed)
+    full_text_results = full_text_future.result()
+    fused = reciprocal_rank_fusion([vector_results, full_text_results])
+    results = drop_overlapping_chunks(fused, K_RETRIEVAL_CHUNKS)
+    app.logger.debug(f"Hybrid retrieval: {len(vector_results)} vector + {len(full_text_results)} full-text "
+                     f"candidates, {len(fused)} after fusion, {len(results)} kept.")
+    return results
+
+def merge_retrieved_chunks(primary_chunks, fallback_chunks):
+    """Keeps the primary ranking and fills remaining slots with unseen fallback chunks, trimmed like any ranking."""
+    return drop_overlapping_chunks([*primary_chunks[:K_RETRIEVAL_CHUNKS], *fallback_chunks], K_RETRIEVAL_CHUNKS)
+
 # --- Endpoint to Get All Sessions for Sidebar ---
+# Without query parameters the full list is returned as before. With `limit`,
+# one page is returned together with an opaque `next_cursor` for the next one.
 @app.route('/get_sessions', methods=['GET'])
 def get_sessions():
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+    try:
+        after = float(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    if limit is not None and not 1 <= limit <= MAX_SESSIONS_PAGE_SIZE:
+        return jsonify({"error": f"limit must be between 1 and {MAX_SESSIONS_PAGE_SIZE}"}), 400
+
     session_previews = []
-    for session_id, data in chat_sessions.items():
+    last_cursor = None
+    for session_id, title, is_locked, last_cursor in session_store.list_sessions(after=after, limit=limit):
         session_previews.append({
             "id": session_id,
-            "preview": data.get('title', 'New Chat'),
-            "is_locked": data.get('is_locked', False)
+            "preview": title,
+            "is_locked": is_locked
         })
     app.logger.debug(f"Providing list of {len(session_previews)} sessions for sidebar.")
-    return jsonify(session_previews)
+
+    if limit is None and cursor is None:
+        payload = session_previews
+    else:
+        has_more = limit is not None and len(session_previews) == limit
+        payload = {"sessions": session_previews, "next_cursor": str(last_cursor) if has_more else None}
+
+    # The ETag is a hash of the body: unchanged pages cost no transfer or client re-render.
+    response = jsonify(payload)
+    response.add_etag()
+    return response.make_conditional(request)
 
 # --- Endpoint to Get a Specific Session's History ---
+# `since` returns only messages after that index and `limit` caps the slice.
+# History is append-only, so its length plus the lock state identifies a version
+# and a 304 can be answered without serializing anything. Indexes count every
+# message ever sent; compacted ones are skipped and the reply's `since` says
+# where the returned slice starts.
 @app.route('/get_session_history/<session_id>', methods=['GET'])
 def get_session_history(session_id):
-    session_data = chat_sessions.get(session_id)
-    if session_data:
-        app.logger.debug(f"Fetching history for session: {session_id}")
-        return jsonify({
-            "history": session_data['history'],
-            "is_locked": session_data.get('is_locked', False)
-        })
-    return jsonify({"error": "Session not found"}), 404
+    session_data = session_store.get(session_id)
+    if not session_data:
+        return jsonify({"error": "Session not found"}), 404
+
+    since = request.args.get('since', default=0, type=int)
+    limit = request.args.get('limit', type=int)
+    if since < 0 or (limit is not None and limit < 1):
+        return jsonify({"error": "since must be >= 0 and limit >= 1"}), 400
+
+    history = session_data['history']
+    offset = session_data.get('history_offset', 0)
+    total_messages = offset + len(history)
+    is_locked = session_data.get('is_locked', False)
+    since = max(since, offset)
+    end = total_messages if limit is None else min(total_messages, since + limit)
+    etag = f"{session_id}-{total_messages}-{int(is_locked)}-{since}-{end}"
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={"ETag": f'"{etag}"'})
+
+    app.logger.debug(f"Fetching history for session: {session_id} (messages {since}-{end} of {total_messages})")
+    response = jsonify({
+        "history": history[since - offset:end - offset],
+        "is_locked": is_locked,
+        "since": since,
+        "total_messages": total_messages
+    })
+    response.set_etag(etag)
+    return response
 
 # --- New Chat Endpoint ---
 @app.route('/new_chat', methods=['POST'])
 def new_chat_session():
     session_id = str(uuid.uuid4())
-    chat_sessions[session_id] = {
+    session_store.create(session_id, {
         "history": [],
         "title": "New Chat",
         "illegal_count": 0,
         "is_locked": False,
-        "conversation_summary": ""
-    }
+        "conversation_summary": "",
+        "summarized_count": 0,
+        "history_offset": 0
+    })
     app.logger.info(f"New chat session created: {session_id}")
     return jsonify({"session_id": session_id}), 201
 
 # --- Delete Session Endpoint ---
 @app.route('/delete_session/<session_id>', methods=['DELETE'])
 def delete_session(session_id):
-    if session_id in chat_sessions:
-        del chat_sessions[session_id]
+    if session_store.delete(session_id):
         app.logger.info(f"Deleted session: {session_id}")
         return jsonify({"success": True}), 200
     return jsonify({"error": "Session not found"}), 404
@@ -225,143 +1110,595 @@ def delete_session(session_id):
 # --- Clear All Sessions Endpoint ---
 @app.route('/clear_all_sessions', methods=['POST'])
 def clear_all_sessions():
-    global chat_sessions
-    count = len(chat_sessions)
-    chat_sessions = {}
+    count = session_store.clear()
     app.logger.info(f"Cleared all {count} chat sessions.")
     return jsonify({"success": True}), 200
 
-@app.route('/chat', methods=['POST'])
-def chat_with_rag_and_ravendb():
-    data = request.get_json()
-    user_message = data.get('message')
-    session_id = data.get('session_id')
+# --- Cache Metrics Endpoint ---
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        "semantic_answer_cache": answer_cache.snapshot(),
+        "legality_cache": legality_cache.snapshot(),
+        "enhancement_cache": enhancement_cache.snapshot(),
+        "query_embedding_cache": query_embedding_cache.snapshot(),
+        "session_store": session_store.snapshot()
+    })
+
+# --- Prometheus Metrics Endpoint ---
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled (GRIP_METRICS=off)"}), 404
+    return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
 
-    if not all([user_message, session_id]):
-        return jsonify({"error": "Message and session_id are required"}), 400
+# --- Chat Pipeline Stages ---
+# These stages are framework-agnostic: errors are returned as (payload, status)
+# tuples so both the Flask routes and asgi_app.py can render them.
+def chat_payload_error(data):
+    """Returns the (payload, status) error for a chat payload without a string message and session_id, or None."""
+    fields = [data.get('message'), data.get('session_id')] if isinstance(data, dict) else [None]
+    if not all(field and isinstance(field, str) for field in fields):
+        return {"error": "Message and session_id are required"}, 400
+    return None
 
-    if session_id not in chat_sessions:
-        return jsonify({"error": "Invalid session_id"}), 404
+def validate_chat_request(data):
+    """Returns (error, current_session) for an incoming chat payload."""
+    error = chat_payload_error(data)
+    if error:
+        return error, None
 
-    current_session = chat_sessions[session_id]
+    session_id = data['session_id']
+    current_session = session_store.get(session_id)
+    if current_session is None:
+        return ({"error": "Invalid session_id"}, 404), None
     
     if current_session.get('is_locked', False):
         app.logger.warning(f"Denied request for locked session {session_id}.")
-        return jsonify({"error": "Session is locked due to repeated invalid queries"}), 423
+        return ({"error": "Session is locked due to repeated invalid queries"}, 423), None
 
-    conversation_history = current_session['history']
-    
-    is_legal = check_message_legality(user_message)
-    
+    return None, current_session
+
+def apply_legality_result(session_id, current_session, is_legal):
+    """Updates the illegal-prompt counters and returns an error for illegal messages."""
     if not is_legal:
-        current_session['illegal_count'] = current_session.get('illegal_count', 0) + 1
-        app.logger.warning(f"Illegal message detected in session {session_id}. Count: {current_session['illegal_count']}/{ILLEGAL_PROMPT_THRESHOLD}.")
+        # An increment rather than a write of the new value, so concurrent workers never lose a count.
+        illegal_count = session_store.increment(session_id, 'illegal_count')
+        app.logger.warning(f"Illegal message detected in session {session_id}. Count: {illegal_count}/{ILLEGAL_PROMPT_THRESHOLD}.")
         
-        if current_session['illegal_count'] >= ILLEGAL_PROMPT_THRESHOLD:
-            current_session['is_locked'] = True
+        if illegal_count >= ILLEGAL_PROMPT_THRESHOLD:
+            session_store.update(session_id, is_locked=True)
             app.logger.error(f"SESSION LOCKED: Session {session_id} locked due to too many illegal prompts.")
-            return jsonify({"error": "Session locked due to repeated off-topic queries. Please start a new chat."}), 423
+            return {"error": "Session locked due to repeated off-topic queries. Please start a new chat."}, 423
         
         error_response = "I'm designed to help with RavenDB-related questions. Please ask something related to RavenDB, document databases, or database management."
-        return jsonify({"reply": error_response}), 400
+        return {"reply": error_response}, 400
     
     if current_session['illegal_count'] > 0:
         app.logger.info(f"Legal message received. Resetting illegal count for session {session_id}.")
-        current_session['illegal_count'] = 0
-    
-    if not conversation_history and current_session['title'] == "New Chat":
-        current_session['title'] = generate_session_title(user_message)
-        app.logger.info(f"Session {session_id} titled: '{current_session['title']}'")
+        session_store.update(session_id, illegal_count=0)
+    return None
 
-    enhanced_query = enhance_query_for_search(user_message)
+def build_messages_for_openai(current_session, user_message, results):
+    """
+    Assembles the system prompt, memory, history and retrieved context for the final completion.
 
-    retrieved_context_texts = []
-    
-    if store:
-        with store.open_session() as session:
-            try:
-                rql_query = f"""
-                from {RAVENDB_COLLECTION_NAME} as a
-                where vector.search(embedding.text(a.{RAVENDB_SEARCH_FIELD}), $userInputQuery, 0.8)
-                select {{
-                    Id: id(a),
-                    Content: a.{RAVENDB_SEARCH_FIELD},
-                    Title: a.Title
-                }}
-                limit {K_RETRIEVAL_CHUNKS}
-                """
-                results = list(session.advanced.raw_query(rql_query, dict).add_parameter("userInputQuery", enhanced_query))
-
-                if results:
-                    chunk_titles = [f"'{chunk.get('Title', 'N/A')}'" for chunk in results]
-                    app.logger.info(f"Retrieved {len(results)} chunks. Titles: {', '.join(chunk_titles)}")
-                    
-                    for chunk in results:
-                        content = chunk.get("Content", "")
-                        if content:
-                            retrieved_context_texts.append(f"Chunk (Title: {chunk.get('Title', 'N/A')}): {content}")
-                else:
-                    app.logger.info("No relevant context chunks retrieved from RavenDB.")
-
-            except Exception as e:
-                app.logger.error(f"RavenDB query failed: {e}", exc_info=True)
-    
-    messages_for_openai_api = [SYSTEM_INSTRUCTION]
-    
-    if current_session.get('conversation_summary'):
-        summary_message = {
-            "role": "system", 
-            "content": f"Previous conversation summary: {current_session['conversation_summary']}"
-        }
-        messages_for_openai_api.append(summary_message)
-    
-    if len(conversation_history) <= MAX_MESSAGES_BEFORE_SUMMARY:
-        messages_for_openai_api.extend(conversation_history)
-    else:
-        if not current_session.get('conversation_summary'):
-            app.logger.info("Conversation history is long, generating a summary.")
-            current_session['conversation_summary'] = generate_conversation_summary(conversation_history)
-            summary_message = {
-                "role": "system", 
-                "content": f"Previous conversation summary: {current_session['conversation_summary']}"
-            }
-            messages_for_openai_api.append(summary_message)
-        
-        recent_messages = conversation_history[-(MAX_MESSAGES_BEFORE_SUMMARY//2):]
-        messages_for_openai_api.extend(recent_messages)
+    Returns:
+        A tuple of (messages, token_breakdown) as produced by prompt_assembly.assemble_prompt.
+    """
+    if results:
+        chunk_titles = [f"'{chunk.get('Title', 'N/A')}'" for chunk in results]
+        app.logger.info(f"Retrieved {len(results)} chunks. Titles: {', '.join(chunk_titles)}")
+    elif store:
+        app.logger.info("No relevant context chunks retrieved from RavenDB.")
+
+    # Messages already folded into the summary are never repeated verbatim.
+    summarized_in_memory = current_session.get('summarized_count', 0) - current_session.get('history_offset', 0)
+    unsummarized_history = current_session['history'][summarized_in_memory:]
+    messages_for_openai_api, token_breakdown = assemble_prompt(
+        SYSTEM_INSTRUCTION, current_session.get('conversation_summary'), unsummarized_history,
+        user_message, results, prompt_budget, token_counter
+    )
+    app.logger.info(
+        f"Prompt tokens{'' if token_counter.is_exact else ' (estimated)'}: "
+        f"system={token_breakdown['system']}, summary={token_breakdown['summary']}, "
+        f"history={token_breakdown['history']} ({token_breakdown['history_messages_kept']}/{len(unsummarized_history)} messages), "
+        f"context={token_breakdown['context']} ({token_breakdown['chunks_kept']}/{len(results)} chunks, "
+        f"{token_breakdown['chunks_trimmed']} trimmed), user={token_breakdown['user']}, total={token_breakdown['total']}"
+    )
+    return messages_for_openai_api, token_breakdown
+
+# A turn is prepared in three steps: the pre-retrieval stage, the semantic
+# cache and retrieval. The decisions between the round trips are made by the
+# helpers below, so prepare_chat_turn and its async counterpart in asgi_app.py
+# only differ in how they wait for each round trip.
+def plan_chat_turn(data, current_session):
+    """Returns the plan of a validated turn: which pre-retrieval stages to start."""
+    annotate_trace(session_id=data['session_id'])
+    return {
+        "session_id": data['session_id'],
+        "user_message": data['message'],
+        "needs_title": not current_session['history'] and current_session['title'] == "New Chat",
+        "enhance": QUERY_ENHANCEMENT_ENABLED,
+        "speculate": speculative_retrieval_likely_reused(),
+        "started_at": time.perf_counter()
+    }
+
+def apply_session_title(plan, current_session, title):
+    session_store.update(plan['session_id'], title=title)
+    app.logger.info(f"Session {plan['session_id']} titled: '{current_session['title']}'")
+
+def apply_enhanced_query(plan, enhanced_query):
+    """Records the query retrieval will use and whether the enhancement changed it."""
+    plan['enhanced_query'] = enhanced_query
+    plan['query_unchanged'] = record_enhancement_outcome(plan['user_message'], enhanced_query)
+
+def semantic_cache_applies(current_session):
+    """Whether this turn looks up (and later stores) its answer in the semantic cache."""
+    if is_answer_cacheable(current_session):
+        return True
+    if SEMANTIC_CACHE_ENABLED:
+        answer_cache.record_bypass()
+    return False
+
+def cached_chat_turn(plan, cached_reply):
+    """The chat turn of a question the semantic cache answered; retrieval and the final completion are skipped."""
+    annotate_trace(semantic_cache_hit=True)
+    return {
+        "session_id": plan['session_id'],
+        "user_message": plan['user_message'],
+        "cached_reply": cached_reply
+    }
+
+def speculative_results_suffice(plan, speculative_results):
+    """
+    The speculative raw-message search is reused as-is when the enhancement
+    made no change; otherwise the enhanced query is searched as well and the
+    speculative results only backfill it.
+    """
+    return plan['query_unchanged'] and speculative_results is not None
+
+def complete_chat_turn(plan, current_session, results, cache_embedding):
+    """Assembles the prompt from the retrieved chunks and returns the chat turn to answer."""
+    app.logger.info(f"Pre-retrieval and retrieval stages completed in {(time.perf_counter() - plan['started_at']) * 1000:.1f} ms.")
+    if not results and cache_embedding is not None:
+        # Retrieval failed or found nothing: an answer without context is not worth serving to later askers.
+        app.logger.info(f"Not caching the answer for session {plan['session_id']}: no context was retrieved.")
+        cache_embedding = None
+
+    messages, prompt_tokens = build_messages_for_openai(current_session, plan['user_message'], results)
+    annotate_trace(chunks_retrieved=len(results))
+    return {
+        "session_id": plan['session_id'],
+        "user_message": plan['user_message'],
+        "messages": messages,
+        "prompt_tokens": prompt_tokens,
+        "enhanced_query": plan['enhanced_query'],
+        "cache_embedding": cache_embedding
+    }
+
+def prepare_chat_turn(data):
+    """
+    Validates a chat request and runs every stage up to the final completion.
+
+    Returns:
+        A tuple of (error, chat_turn). Exactly one of them is None; error is a
+        (payload, status) pair and chat_turn holds the messages to send to OpenAI.
+    """
+    error, current_session = validate_chat_request(data)
+    if error:
+        return error, None
+    plan = plan_chat_turn(data, current_session)
+    user_message = plan['user_message']
+
+    # 1. Pre-retrieval stage: all independent round trips are started at once.
+    legality_future = submit_timed_stage("legality_check", check_message_legality, user_message)
+    enhance_future = submit_timed_stage("query_enhancement", enhance_query_for_search, user_message) if plan['enhance'] else None
+    title_future = submit_timed_stage("title_generation", generate_session_title, user_message) if plan['needs_title'] else None
+    speculative_search_future = submit_timed_stage("speculative_retrieval", retrieve_context_chunks, user_message) if plan['speculate'] else None
 
-    context_for_llm = "\n\n".join(retrieved_context_texts)
-    if context_for_llm:
-        context_for_llm = f"Relevant retrieved context chunks:\n---\n{context_for_llm}\n---"
+    error = apply_legality_result(plan['session_id'], current_session, legality_future.result())
+    if error:
+        discard_speculative_work(enhance_future, title_future, speculative_search_future)
+        return error, None
+    if title_future is not None:
+        apply_session_title(plan, current_session, title_future.result())
+    apply_enhanced_query(plan, enhance_future.result() if enhance_future is not None else user_message)
+
+    # 2. Semantic cache: a first question equivalent to one already answered
+    # skips retrieval and the final completion entirely.
+    cache_embedding = None
+    if semantic_cache_applies(current_session):
+        cache_embedding = run_timed_stage("cache_embedding", embed_query, plan['enhanced_query'])
+        cached_reply = lookup_cached_answer(plan['session_id'], cache_embedding)
+        if cached_reply is not None:
+            discard_speculative_work(speculative_search_future)
+            return None, cached_chat_turn(plan, cached_reply)
+
+    # 3. Retrieval.
+    speculative_results = speculative_search_future.result() if speculative_search_future is not None else None
+    if speculative_results_suffice(plan, speculative_results):
+        results = speculative_results
     else:
-        context_for_llm = "No specific relevant context was found in the knowledge base."
+        enhanced_results = run_timed_stage("enhanced_retrieval", retrieve_context_chunks, plan['enhanced_query'])
+        results = merge_retrieved_chunks(enhanced_results, speculative_results or [])
+    return None, complete_chat_turn(plan, current_session, results, cache_embedding)
 
-    user_turn_message_parts = [{"type": "text", "text": f"{user_message}\n\n{context_for_llm}"}]
-    
-    messages_for_openai_api.append({"role": "user", "content": user_turn_message_parts})
+# --- Rolling Conversation Summary ---
+# Once messages leave the RECENT_HISTORY_MESSAGES window they are folded into
+# the session summary in batches, off the request path. Only the new slice is
+# sent with the previous summary, so each fold costs the same regardless of
+# how long the conversation has grown.
+summary_executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="summary")
+summaries_in_flight = set()
+summaries_in_flight_lock = threading.Lock()
+
+def pending_summary_range(current_session):
+    """Returns the (start, end) message numbers due to be folded into the summary, or None."""
+    start = current_session.get('summarized_count', 0)
+    end = current_session.get('history_offset', 0) + len(current_session['history']) - RECENT_HISTORY_MESSAGES
+    if end - start < SUMMARY_FOLD_BATCH_MESSAGES:
+        return None
+    return start, end
 
+def schedule_summary_refresh(session_id):
+    """Queues a background fold when enough history has left the recent window."""
+    current_session = session_store.get(session_id)
+    if not current_session or pending_summary_range(current_session) is None:
+        return
+    with summaries_in_flight_lock:
+        # One fold per session at a time; a later turn picks up whatever is left.
+        if session_id in summaries_in_flight:
+            return
+        summaries_in_flight.add(session_id)
+    summary_executor.submit(refresh_conversation_summary, session_id)
+
+def refresh_conversation_summary(session_id):
     try:
-        app.logger.debug(f"Sending request to OpenAI with {len(messages_for_openai_api)} messages.")
-        openai_response = openai_client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=messages_for_openai_api,
-            stream=False,
-            temperature=0.7
+        current_session = session_store.get(session_id)
+        fold_range = pending_summary_range(current_session) if current_session else None
+        if fold_range is None:
+            return
+        start, end = fold_range
+        offset = current_session.get('history_offset', 0)
+        summary = run_timed_stage(
+            "summary_fold", generate_conversation_summary,
+            current_session['history'][start - offset:end - offset], current_session.get('conversation_summary', "")
+        )
+        if not summary:
+            return  # Keep the previous summary; the same slice is retried after the next turn.
+        session_store.update(session_id, conversation_summary=summary, summarized_count=end)
+        app.logger.info(f"Folded messages {start}-{end} of session {session_id} into its summary ({len(summary)} characters).")
+    except Exception as e:
+        app.logger.error(f"Failed to refresh conversation summary for session {session_id}: {e}")
+    finally:
+        with summaries_in_flight_lock:
+            summaries_in_flight.discard(session_id)
+
+def final_completion_request(chat_turn, stream=False):
+    """Builds the OpenAI request for the user-facing answer."""
+    request_kwargs = {
+        "model": OPENAI_MODEL,
+        "messages": chat_turn['messages'],
+        "stream": stream,
+        "temperature": 0.7
+    }
+    if stream:
+        request_kwargs["stream_options"] = {"include_usage": True}  # Token usage arrives in a final chunk
+    return request_kwargs
+
+def finalize_bot_reply(reply_text):
+    return (reply_text or "").strip() or "I apologize, I couldn't formulate a response."
+
+def record_chat_turn(chat_turn, bot_reply):
+    """Appends a completed user/assistant exchange to the session history and caches fresh answers."""
+    session_store.append_history(chat_turn['session_id'], [
+        {"role": "user", "content": chat_turn['user_message']},
+        {"role": "assistant", "content": bot_reply}
+    ])
+    if chat_turn.get('cache_embedding') is not None:
+        answer_cache.store(chat_turn['cache_embedding'], bot_reply, chat_turn['enhanced_query'])
+    schedule_summary_refresh(chat_turn['session_id'])
+
+def circuit_open_error(error):
+    """Returns (payload, status, headers) for a completion refused while the OpenAI circuit breaker is open."""
+    return (
+        {"error": "The language model is temporarily unavailable. Please try again shortly."},
+        503,
+        {"Retry-After": str(max(1, round(error.retry_after_seconds)))}
+    )
+
+def format_sse_event(event_name, payload):
+    """Serializes a payload as a single Server-Sent Events frame."""
+    return f"event: {event_name}\ndata: {json.dumps(payload)}\n\n"
+
+def replayed_reply_events(reply):
+    """The events of a stream whose whole reply is already known."""
+    return format_sse_event("token", {"text": reply}) + format_sse_event("done", {"reply": reply})
+
+def failed_completion_outcome(chat_turn, error):
+    """The outcome of a final completion that raised; called from the except block, so the traceback is logged."""
+    if isinstance(error, CircuitOpenError):
+        app.logger.warning(f"Rejected chat completion for session {chat_turn['session_id']}: {error}")
+        return circuit_open_error(error)
+    app.logger.error(f"OpenAI API request failed: {error}", exc_info=True)
+    return {"error": f"Failed to communicate with the language model: {error}"}, 503, {}
+
+# --- Reply Streams ---
+# A stream's bookkeeping (first-token and completion stages, token usage, the
+# turn outcome and the deferred trace) lives in a state dict, so the sync
+# generator below and the async one in asgi_app.py only relay chunks.
+def start_reply_stream(chat_turn, turn, trace):
+    return {"chat_turn": chat_turn, "turn": turn, "trace": trace, "reply_parts": [], "usage_reported": False,
+            "outcome": "disconnected", "started_at": time.perf_counter()}
+
+def finish_cached_reply_stream(reply_stream):
+    """Ends the turn of a stream answered from the semantic cache and returns its events."""
+    cached_reply = reply_stream['chat_turn']['cached_reply']
+    finish_chat_turn(reply_stream['turn'], ({"reply": cached_reply}, 200, {}))
+    reply_stream['outcome'] = "done"
+    return replayed_reply_events(cached_reply)
+
+def relay_stream_chunk(reply_stream, chunk):
+    """Records one completion chunk and returns its `token` event, or None for chunks without text."""
+    if getattr(chunk, "usage", None) is not None:
+        # Sent as a final chunk without choices because of stream_options.include_usage.
+        record_openai_usage("chat_completion", chunk.usage, reply_stream['trace'])
+        reply_stream['usage_reported'] = True
+    if not chunk.choices:
+        return None
+    delta = chunk.choices[0].delta.content
+    if not delta:
+        return None
+    if not reply_stream['reply_parts']:
+        first_token_seconds = time.perf_counter() - reply_stream['started_at']
+        record_stage("first_token", first_token_seconds, reply_stream['trace'])
+        app.logger.info(f"Stage 'first_token' took {first_token_seconds * 1000:.1f} ms.")
+    reply_stream['reply_parts'].append(delta)
+    return format_sse_event("token", {"text": delta})
+
+def streamed_reply(reply_stream):
+    return finalize_bot_reply("".join(reply_stream['reply_parts']))
+
+def finish_reply_stream(reply_stream, bot_reply):
+    """Records a completed stream whose exchange is stored, ends its turn and returns the `done` event."""
+    record_final_completion(reply_stream['chat_turn'], bot_reply, reply_stream['usage_reported'], reply_stream['trace'])
+    completion_seconds = time.perf_counter() - reply_stream['started_at']
+    record_stage("completion", completion_seconds, reply_stream['trace'])
+    app.logger.info(f"Stage 'completion' took {completion_seconds * 1000:.1f} ms.")
+    reply_stream['outcome'] = "done"
+    # The turn ends before the last event, so a slow reader never holds up the session.
+    finish_chat_turn(reply_stream['turn'], ({"reply": bot_reply}, 200, {}))
+    return format_sse_event("done", {"reply": bot_reply})
+
+def fail_reply_stream(reply_stream, error):
+    """Ends the turn of a stream whose completion failed and returns the `error` event."""
+    app.logger.error(f"OpenAI streaming request failed: {error}", exc_info=True)
+    reply_stream['outcome'] = "error"
+    error_payload = {"error": f"Failed to communicate with the language model: {error}"}
+    finish_chat_turn(reply_stream['turn'], (error_payload, 503, {}))
+    return format_sse_event("error", error_payload)
+
+def log_stream_disconnect(reply_stream):
+    app.logger.warning(f"Client disconnected from stream for session {reply_stream['chat_turn']['session_id']} "
+                       f"after {len(reply_stream['reply_parts'])} tokens.")
+
+def close_reply_stream(reply_stream):
+    """Runs when a stream ends in any way: ends a turn still running and writes the deferred trace."""
+    finish_chat_turn(reply_stream['turn'], None)  # Only still running if the client left before the reply was complete
+    trace = reply_stream['trace']
+    if trace is not None:
+        if 'cached_reply' not in reply_stream['chat_turn']:
+            trace.attributes['stream_outcome'] = reply_stream['outcome']
+        trace_log.write(trace, 200)
+
+# --- Admission Control ---
+# Outcomes are (payload, status, headers) tuples. A turn's outcome is shared
+# with the requests coalesced into it; None means it ended without an answer.
+def too_many_requests(message, retry_after_seconds):
+    return {"error": message}, 429, {"Retry-After": str(max(1, math.ceil(retry_after_seconds)))}
+
+def check_rate_limits(client_address, data):
+    """Returns the 429 outcome for a chat request over its client or session rate limit, or None."""
+    if not RATE_LIMITS_ENABLED:
+        return None
+    session_id = data.get('session_id')
+    limit, retry_after = "client", client_rate_limiter.acquire(client_address)
+    if not retry_after and isinstance(session_id, str):
+        limit, retry_after = "session", session_rate_limiter.acquire(session_id)
+    if not retry_after:
+        return None
+    app.logger.warning(f"Rate limited a chat request from {client_address} for session {session_id} ({limit} limit).")
+    annotate_trace(rate_limited=limit)
+    return too_many_requests("Too many messages. Please wait a moment before sending another.", retry_after)
+
+def enter_chat_turn(client_address, data):
+    """
+    Applies the rate limits and joins the session's turn queue, without blocking.
+
+    Returns:
+        A tuple of (rejection, turn, is_leader). Payloads without a string
+        message and session id are rejected with the 400 of validation.
+    """
+    error = chat_payload_error(data)
+    if error:
+        return (*error, {}), None, False
+    rejection = check_rate_limits(client_address, data)
+    if rejection:
+        return rejection, None, False
+    session_id, message = data['session_id'], data['message']
+    turn, is_leader = chat_turn_gate.enter(session_id, message)
+    if turn is None:
+        app.logger.warning(f"Rejected a chat request for session {session_id}: {SESSION_MAX_WAITING_TURNS} messages are already waiting.")
+        return too_many_requests("Too many messages are waiting in this session. Please wait for their answers.", 1), None, False
+    return None, turn, is_leader
+
+def coalesced_outcome(outcome):
+    """The response of a request that joined the turn of an identical message."""
+    annotate_trace(coalesced=True)
+    if outcome is None:
+        return {"error": "The same message was already being answered in this session, but that request did not finish. Please send it again."}, 409, {}
+    return outcome
+
+def turn_wait_timed_out():
+    return too_many_requests("Another message in this session is still being answered. Please try again shortly.", 5)
+
+def admit_chat_request(client_address, data):
+    """
+    Blocks until a chat request may run its session's next turn.
+
+    Returns:
+        A tuple of (outcome, turn). An outcome is a finished response: a
+        rejection, or the answer of the identical request this one was
+        coalesced with. Otherwise the caller answers the request and passes
+        the turn to finish_chat_turn.
+    """
+    rejection, turn, is_leader = enter_chat_turn(client_address, data)
+    if rejection:
+        return rejection, None
+    if not is_leader:
+        try:
+            return coalesced_outcome(turn.outcome.result(timeout=2 * SESSION_TURN_TIMEOUT_SECONDS)), None
+        except concurrent.futures.TimeoutError:
+            return coalesced_outcome(None), None
+    if not turn.started.done():
+        try:
+            run_timed_stage("session_queue", turn.started.result, SESSION_TURN_TIMEOUT_SECONDS)
+        except concurrent.futures.TimeoutError:
+            chat_turn_gate.leave(turn, None)
+            return turn_wait_timed_out(), None
+    return None, start_chat_turn(turn)
+
+def start_chat_turn(turn):
+    """Pins the session of a turn about to run, so the store cannot evict it before finish_chat_turn."""
+    session_store.pin(turn.session_id, turn)
+    return turn
+
+def finish_chat_turn(turn, outcome):
+    """Ends a turn, shares its outcome with coalesced requests and lets the session's next turn start."""
+    if turn is not None:
+        session_store.unpin(turn.session_id, turn)
+        chat_turn_gate.leave(turn, outcome)
+
+def answer_chat_request(data):
+    """Runs the /chat pipeline for an admitted request and returns its outcome."""
+    error, chat_turn = prepare_chat_turn(data)
+    if error:
+        payload, status = error
+        return payload, status, {}
+
+    if 'cached_reply' in chat_turn:
+        record_chat_turn(chat_turn, chat_turn['cached_reply'])
+        return {"reply": chat_turn['cached_reply']}, 200, {}
+
+    try:
+        app.logger.debug(f"Sending request to OpenAI with {len(chat_turn['messages'])} messages.")
+        openai_response = run_timed_stage(
+            "completion", openai_chat_completion,
+            final_completion_request(chat_turn), OPENAI_COMPLETION_DEADLINE_SECONDS, "chat_completion"
         )
         
-        bot_reply = openai_response.choices[0].message.content.strip() or "I apologize, I couldn't formulate a response."
+        bot_reply = finalize_bot_reply(openai_response.choices[0].message.content)
 
-        conversation_history.append({"role": "user", "content": user_message})
-        conversation_history.append({"role": "assistant", "content": bot_reply})
+        record_chat_turn(chat_turn, bot_reply)
+        record_final_completion(chat_turn, bot_reply, usage_reported=getattr(openai_response, "usage", None) is not None)
         
-        response_payload = {"reply": bot_reply}
-             
-        return jsonify(response_payload)
+        return {"reply": bot_reply}, 200, {}
 
     except Exception as e:
-        app.logger.error(f"OpenAI API request failed: {e}", exc_info=True)
-        return jsonify({"error": f"Failed to communicate with the language model: {e}"}), 503
+        return failed_completion_outcome(chat_turn, e)
+
+@app.route('/chat', methods=['POST'])
+@instrumented_endpoint("chat")
+def chat_with_rag_and_ravendb():
+    data = request.get_json()
+    outcome, turn = admit_chat_request(request.remote_addr, data)
+    if outcome is None:
+        try:
+            outcome = answer_chat_request(data)
+        finally:
+            finish_chat_turn(turn, outcome)
+    payload, status, headers = outcome
+    return jsonify(payload), status, headers
+
+
+# --- Streaming Chat Endpoint ---
+@app.route('/chat/stream', methods=['POST'])
+@instrumented_endpoint("chat_stream")
+def chat_stream_with_rag_and_ravendb():
+    """
+    Same pipeline as /chat, but relays the completion as Server-Sent Events.
+
+    Emits `token` events carrying each delta, then a single `done` event with
+    the assembled reply, or an `error` event if the model fails mid-stream.
+    Validation failures keep the JSON responses and status codes of /chat.
+    """
+    data = request.get_json()
+    outcome, turn = admit_chat_request(request.remote_addr, data)
+    if outcome is not None:
+        payload, status, headers = outcome
+        if status != 200:
+            return jsonify(payload), status, headers
+        return Response(replayed_reply_events(payload['reply']), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
+    try:
+        error, chat_turn = prepare_chat_turn(data)
+    except Exception:
+        finish_chat_turn(turn, None)
+        raise
+    if error:
+        payload, status = error
+        finish_chat_turn(turn, (payload, status, {}))
+        return jsonify(payload), status
+
+    # The stream outlives this view, so its trace is written when the stream ends.
+    trace = current_trace.get()
+    if trace is not None:
+        trace.deferred = True
+
+    reply_stream = start_reply_stream(chat_turn, turn, trace)
+
+    def generate_events():
+        openai_stream = None
+        try:
+            if 'cached_reply' in chat_turn:
+                record_chat_turn(chat_turn, chat_turn['cached_reply'])
+                yield finish_cached_reply_stream(reply_stream)
+                return
+            app.logger.debug(f"Streaming request to OpenAI with {len(chat_turn['messages'])} messages.")
+            # Only opening the stream is retried; once tokens have been sent a failure ends the stream.
+            openai_stream = openai_chat_completion(
+                final_completion_request(chat_turn, stream=True), OPENAI_COMPLETION_DEADLINE_SECONDS, "chat_completion"
+            )
+            for chunk in openai_stream:
+                event = relay_stream_chunk(reply_stream, chunk)
+                if event:
+                    yield event
+
+            bot_reply = streamed_reply(reply_stream)
+            # History is only written once the full reply exists, so an aborted
+            # stream never leaves a half-answered turn in the session.
+            record_chat_turn(chat_turn, bot_reply)
+            yield finish_reply_stream(reply_stream, bot_reply)
+
+        except GeneratorExit:
+            log_stream_disconnect(reply_stream)
+            raise
+        except Exception as e:
+            yield fail_reply_stream(reply_stream, e)
+        finally:
+            if openai_stream is not None and hasattr(openai_stream, "close"):
+                openai_stream.close()
+            close_reply_stream(reply_stream)
 
+    response = Response(
+        stream_with_context(generate_events()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # A stream closed before its first event never runs the generator, so its turn ends here.
+    response.call_on_close(lambda: finish_chat_turn(turn, None))
+    return response
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
@@ -0,0 +1,449 @@
+"""
+Asyncio serving mode for Grip.
+
+The Flask app in app.py holds a worker thread for the whole duration of a
+/chat request, including four or more OpenAI round trips. This module serves
+the same routes and JSON contracts from a single event loop instead:
+
+- /chat and /chat/stream are native async handlers that use AsyncOpenAI, so a
+  slow LLM call only parks a coroutine rather than a thread.
+- RavenDB has no asyncio client, so its queries, session reads and writes
+  and local embeddings run on a small dedicated thread pool and never block
+  the event loop.
+- Every other route is delegated to the existing Flask app through a WSGI
+  adapter, whose threads absorb their blocking work: session reads and
+  writes go to RavenDB with GRIP_SESSION_STORE=ravendb or the session archive.
+
+The chat pipeline itself is not duplicated here. Validation, the decisions of
+turn preparation, the helper caches, prompt assembly and the bookkeeping of a
+reply stream are app.py helpers; this module only replaces the round trips
+between them with awaits.
+
+Run with:
+    uvicorn asgi_app:asgi_app --host 0.0.0.0 --port 5001
+"""
+import asyncio
+import contextvars
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from a2wsgi import WSGIMiddleware
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import (
+    OPENAI_API_KEY,
+    OPENAI_COMPLETION_DEADLINE_SECONDS,
+    OPENAI_HELPER_DEADLINE_SECONDS,
+    OPENAI_HTTP_LIMITS,
+    app as flask_app,
+    apply_enhanced_query,
+    apply_legality_result,
+    apply_session_title,
+    cache_enhancement_response,
+    cache_legality_response,
+    cache_query_embedding,
+    cached_chat_turn,
+    cached_enhancement,
+    cached_legality,
+    cached_query_embedding,
+    chat_turn_gate,
+    close_reply_stream,
+    coalesced_outcome,
+    complete_chat_turn,
+    embed_query,
+    embedding_request,
+    enhancement_completion_request,
+    enter_chat_turn,
+    fail_reply_stream,
+    failed_completion_outcome,
+    final_completion_request,
+    finalize_bot_reply,
+    finish_cached_reply_stream,
+    finish_chat_turn,
+    finish_reply_stream,
+    finish_request,
+    forwarded_client_address,
+    legality_completion_request,
+    local_embedder,
+    log_stream_disconnect,
+    lookup_cached_answer,
+    merge_retrieved_chunks,
+    openai_policy,
+    openai_timeout,
+    parse_embedding_response,
+    parse_title_response,
+    plan_chat_turn,
+    record_chat_turn,
+    record_final_completion,
+    record_openai_usage,
+    record_stage,
+    relay_stream_chunk,
+    replayed_reply_events,
+    retrieval_embeds_query,
+    retrieve_context_chunks,
+    semantic_cache_applies,
+    SESSION_TURN_TIMEOUT_SECONDS,
+    speculative_results_suffice,
+    start_chat_turn,
+    start_reply_stream,
+    start_request_trace,
+    streamed_reply,
+    title_completion_request,
+    turn_wait_timed_out,
+    upstream_errors,
+    validate_chat_request,
+)
+from admission import await_future
+from telemetry import current_trace
+
+logger = flask_app.logger
+
+# --- Async Configuration ---
+RAVENDB_WORKERS = 8  # Threads reserved for blocking RavenDB queries
+
+# Pool limits, timeouts and the retry policy (with its circuit breaker) are shared with app.py.
+async_openai_client = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    max_retries=0,
+    timeout=openai_timeout(OPENAI_COMPLETION_DEADLINE_SECONDS),
+    http_client=DefaultAsyncHttpxClient(limits=OPENAI_HTTP_LIMITS)
+)
+ravendb_executor = ThreadPoolExecutor(max_workers=RAVENDB_WORKERS, thread_name_prefix="ravendb")
+
+
+async def run_timed_stage_async(stage_name, awaitable):
+    """Awaits a single pipeline stage, logs how long it took and records it like app.run_timed_stage."""
+    stage_start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        elapsed = time.perf_counter() - stage_start
+        record_stage(stage_name, elapsed)
+        logger.info(f"Stage '{stage_name}' took {elapsed * 1000:.1f} ms.")
+
+
+def instrumented_endpoint_async(endpoint):
+    """Async counterpart of app.instrumented_endpoint; tasks started by the handler inherit its trace."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            trace = start_request_trace(endpoint)
+            trace_token = current_trace.set(trace)
+            request_start = time.perf_counter()
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status_code
+                return response
+            finally:
+                current_trace.reset(trace_token)
+                finish_request(endpoint, status, time.perf_counter() - request_start, trace)
+        return wrapper
+    return decorator
+
+
+async def run_in_ravendb_executor(func, *args):
+    """Runs blocking work on the RavenDB thread pool in a copy of the caller's context, so it reports to the request trace."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(ravendb_executor, contextvars.copy_context().run, func, *args)
+
+
+async def retrieve_context_chunks_async(search_query):
+    """
+    Runs the blocking RavenDB search on the dedicated thread pool. The query is
+    embedded first with the async client, so a slow embedding never holds one
+    of its threads.
+    """
+    if not retrieval_embeds_query():
+        return await run_in_ravendb_executor(retrieve_context_chunks, search_query)
+    query_embedding = await embed_query_async(search_query)
+    return await run_in_ravendb_executor(retrieve_context_chunks, search_query, lambda text: query_embedding)
+
+
+async def record_chat_turn_async(chat_turn, bot_reply):
+    # Session writes may reach RavenDB (the session store, or the archive of evicted sessions), so they stay off the event loop.
+    await run_in_ravendb_executor(record_chat_turn, chat_turn, bot_reply)
+
+
+# --- Async OpenAI Helpers ---
+async def count_upstream_errors_async(dependency, call_name, func, *args):
+    """Async counterpart of app.count_upstream_errors."""
+    try:
+        return await func(*args)
+    except Exception as e:
+        upstream_errors.inc((dependency, call_name, type(e).__name__))
+        raise
+
+
+async def openai_chat_completion_async(request_kwargs, deadline_seconds, call_name):
+    response = await count_upstream_errors_async(
+        "openai", call_name, openai_policy.call_async,
+        lambda timeout: async_openai_client.chat.completions.create(**request_kwargs, timeout=openai_timeout(timeout)),
+        deadline_seconds, call_name
+    )
+    record_openai_usage(call_name, getattr(response, "usage", None))
+    return response
+
+
+async def check_message_legality_async(user_message):
+    cached_result = cached_legality(user_message)
+    if cached_result is not None:
+        return cached_result
+
+    try:
+        response = await openai_chat_completion_async(legality_completion_request(user_message), OPENAI_HELPER_DEADLINE_SECONDS, "legality_check")
+        return cache_legality_response(user_message, response)
+    except Exception as e:
+        logger.error(f"Failed to check message legality: {e}")
+        return True  # Default to legal if check fails
+
+
+async def enhance_query_for_search_async(user_message):
+    cached_query = cached_enhancement(user_message)
+    if cached_query is not None:
+        return cached_query
+
+    try:
+        response = await openai_chat_completion_async(enhancement_completion_request(user_message), OPENAI_HELPER_DEADLINE_SECONDS, "query_enhancement")
+        return cache_enhancement_response(user_message, response)
+    except Exception as e:
+        logger.error(f"Failed to enhance query: {e}")
+        return user_message  # Return original if enhancement fails
+
+
+async def generate_session_title_async(first_user_message):
+    try:
+        response = await openai_chat_completion_async(title_completion_request(first_user_message), OPENAI_HELPER_DEADLINE_SECONDS, "title_generation")
+        return parse_title_response(response)
+    except Exception as e:
+        logger.error(f"Failed to generate session title: {e}")
+        return "New Chat"
+
+
+async def embed_query_async(text):
+    """Async counterpart of app.embed_query; local backends run on the RavenDB thread pool."""
+    cached_embedding = cached_query_embedding(text)
+    if cached_embedding is not None:
+        return cached_embedding
+    if local_embedder is not None:
+        return await run_in_ravendb_executor(embed_query, text)
+
+    try:
+        response = await count_upstream_errors_async(
+            "openai", "query_embedding", openai_policy.call_async,
+            lambda timeout: async_openai_client.embeddings.create(**embedding_request(text), timeout=openai_timeout(timeout)),
+            OPENAI_HELPER_DEADLINE_SECONDS, "query_embedding"
+        )
+        record_openai_usage("query_embedding", getattr(response, "usage", None))
+        return cache_query_embedding(text, parse_embedding_response(response))
+    except Exception as e:
+        logger.error(f"Failed to embed text: {e}")
+        return None
+
+
+async def lookup_cached_answer_async(session_id, embedding):
+    # The lookup may check RavenDB for Context changes, so it stays off the event loop.
+    return await run_in_ravendb_executor(lookup_cached_answer, session_id, embedding)
+
+
+async def prepare_chat_turn_async(data):
+    """Async counterpart of app.prepare_chat_turn; the steps between round trips are its shared helpers."""
+    # Validation may load the session from RavenDB, so it stays off the event loop.
+    error, current_session = await run_in_ravendb_executor(validate_chat_request, data)
+    if error:
+        return error, None
+    plan = plan_chat_turn(data, current_session)
+    user_message = plan['user_message']
+
+    # 1. Pre-retrieval stage: all independent round trips are started at once.
+    legality_task = asyncio.create_task(run_timed_stage_async("legality_check", check_message_legality_async(user_message)))
+    enhance_task = asyncio.create_task(run_timed_stage_async("query_enhancement", enhance_query_for_search_async(user_message))) if plan['enhance'] else None
+    title_task = asyncio.create_task(run_timed_stage_async("title_generation", generate_session_title_async(user_message))) if plan['needs_title'] else None
+    speculative_search_task = asyncio.create_task(run_timed_stage_async("speculative_retrieval", retrieve_context_chunks_async(user_message))) if plan['speculate'] else None
+
+    error = await run_in_ravendb_executor(apply_legality_result, plan['session_id'], current_session, await legality_task)
+    if error:
+        cancel_tasks(enhance_task, title_task, speculative_search_task)
+        return error, None
+    if title_task is not None:
+        await run_in_ravendb_executor(apply_session_title, plan, current_session, await title_task)
+    apply_enhanced_query(plan, await enhance_task if enhance_task is not None else user_message)
+
+    # 2. Semantic cache.
+    cache_embedding = None
+    if semantic_cache_applies(current_session):
+        cache_embedding = await run_timed_stage_async("cache_embedding", embed_query_async(plan['enhanced_query']))
+        cached_reply = await lookup_cached_answer_async(plan['session_id'], cache_embedding)
+        if cached_reply is not None:
+            cancel_tasks(speculative_search_task)
+            return None, cached_chat_turn(plan, cached_reply)
+
+    # 3. Retrieval.
+    speculative_results = await speculative_search_task if speculative_search_task is not None else None
+    if speculative_results_suffice(plan, speculative_results):
+        results = speculative_results
+    else:
+        enhanced_results = await run_timed_stage_async("enhanced_retrieval", retrieve_context_chunks_async(plan['enhanced_query']))
+        results = merge_retrieved_chunks(enhanced_results, speculative_results or [])
+    return None, complete_chat_turn(plan, current_session, results, cache_embedding)
+
+
+def cancel_tasks(*tasks):
+    """Async counterpart of app.discard_speculative_work."""
+    for task in tasks:
+        if task is not None:
+            task.cancel()
+
+
+# --- Admission Control ---
+def request_client_address(request):
+    peer_address = request.client.host if request.client else "unknown"
+    return forwarded_client_address(request.headers.get("x-forwarded-for"), peer_address)
+
+
+async def admit_chat_request_async(client_address, data):
+    """Async counterpart of app.admit_chat_request; waiting for a turn only parks the coroutine."""
+    rejection, turn, is_leader = enter_chat_turn(client_address, data)
+    if rejection:
+        return rejection, None
+    if not is_leader:
+        try:
+            return coalesced_outcome(await await_future(turn.outcome, 2 * SESSION_TURN_TIMEOUT_SECONDS)), None
+        except asyncio.TimeoutError:
+            return coalesced_outcome(None), None
+    if not turn.started.done():
+        try:
+            await run_timed_stage_async("session_queue", await_future(turn.started, SESSION_TURN_TIMEOUT_SECONDS))
+        except asyncio.TimeoutError:
+            chat_turn_gate.leave(turn, None)
+            return turn_wait_timed_out(), None
+        except asyncio.CancelledError:
+            chat_turn_gate.leave(turn, None)
+            raise
+    return None, start_chat_turn(turn)
+
+
+# --- Async Chat Endpoints ---
+async def answer_chat_request_async(data):
+    """Async counterpart of app.answer_chat_request."""
+    error, chat_turn = await prepare_chat_turn_async(data)
+    if error:
+        payload, status = error
+        return payload, status, {}
+
+    if 'cached_reply' in chat_turn:
+        await record_chat_turn_async(chat_turn, chat_turn['cached_reply'])
+        return {"reply": chat_turn['cached_reply']}, 200, {}
+
+    try:
+        logger.debug(f"Sending request to OpenAI with {len(chat_turn['messages'])} messages.")
+        openai_response = await run_timed_stage_async(
+            "completion",
+            openai_chat_completion_async(final_completion_request(chat_turn), OPENAI_COMPLETION_DEADLINE_SECONDS, "chat_completion")
+        )
+        bot_reply = finalize_bot_reply(openai_response.choices[0].message.content)
+        await record_chat_turn_async(chat_turn, bot_reply)
+        record_final_completion(chat_turn, bot_reply, usage_reported=getattr(openai_response, "usage", None) is not None)
+        return {"reply": bot_reply}, 200, {}
+
+    except Exception as e:
+        return failed_completion_outcome(chat_turn, e)
+
+
+@instrumented_endpoint_async("chat")
+async def chat_with_rag_and_ravendb(request):
+    data = await request.json()
+    outcome, turn = await admit_chat_request_async(request_client_address(request), data)
+    if outcome is None:
+        try:
+            outcome = await answer_chat_request_async(data)
+        finally:
+            finish_chat_turn(turn, outcome)
+    payload, status, headers = outcome
+    return JSONResponse(payload, status_code=status, headers=headers)
+
+
+@instrumented_endpoint_async("chat_stream")
+async def chat_stream_with_rag_and_ravendb(request):
+    data = await request.json()
+    outcome, turn = await admit_chat_request_async(request_client_address(request), data)
+    if outcome is not None:
+        payload, status, headers = outcome
+        if status != 200:
+            return JSONResponse(payload, status_code=status, headers=headers)
+        return Response(replayed_reply_events(payload['reply']), media_type='text/event-stream', headers={"Cache-Control": "no-cache"})
+
+    try:
+        error, chat_turn = await prepare_chat_turn_async(data)
+    except BaseException:
+        finish_chat_turn(turn, None)
+        raise
+    if error:
+        payload, status = error
+        finish_chat_turn(turn, (payload, status, {}))
+        return JSONResponse(payload, status_code=status)
+
+    trace = current_trace.get()
+    if trace is not None:
+        trace.deferred = True
+
+    reply_stream = start_reply_stream(chat_turn, turn, trace)
+
+    async def generate_events():
+        openai_stream = None
+        try:
+            if 'cached_reply' in chat_turn:
+                await record_chat_turn_async(chat_turn, chat_turn['cached_reply'])
+                yield finish_cached_reply_stream(reply_stream)
+                return
+            logger.debug(f"Streaming request to OpenAI with {len(chat_turn['messages'])} messages.")
+            openai_stream = await openai_chat_completion_async(
+                final_completion_request(chat_turn, stream=True), OPENAI_COMPLETION_DEADLINE_SECONDS, "chat_completion"
+            )
+            async for chunk in openai_stream:
+                event = relay_stream_chunk(reply_stream, chunk)
+                if event:
+                    yield event
+
+            bot_reply = streamed_reply(reply_stream)
+            await record_chat_turn_async(chat_turn, bot_reply)
+            yield finish_reply_stream(reply_stream, bot_reply)
+
+        except asyncio.CancelledError:
+            log_stream_disconnect(reply_stream)
+            raise
+        except Exception as e:
+            yield fail_reply_stream(reply_stream, e)
+        finally:
+            if openai_stream is not None and hasattr(openai_stream, "close"):
+                await openai_stream.close()
+            close_reply_stream(reply_stream)
+
+    return StreamingResponse(
+        generate_events(),
+        media_type='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(finish_chat_turn, turn, None)  # Ends the turn of a stream that never started
+    )
+
+
+asgi_app = Starlette(
+    routes=[
+        Route('/chat', chat_with_rag_and_ravendb, methods=['POST']),
+        Route('/chat/stream', chat_stream_with_rag_and_ravendb, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], expose_headers=["ETag"])],
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(asgi_app, host='0.0.0.0', port=5001)
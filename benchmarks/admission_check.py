@@ -0,0 +1,242 @@
+"""
+Checks the admission control of the chat endpoints in app.py and asgi_app.py:
+coalescing of identical in-flight messages, per-session serialization, the
+bound on queued turns and the client and session rate limits.
+
+Requests are sent concurrently to one session against fake OpenAI clients
+that count their calls, so each check can tell how many upstream calls a
+burst of requests really cost. Each check prints PASS or FAIL and the script
+exits non-zero if any fails.
+
+Usage:
+    python benchmarks/admission_check.py
+"""
+import asyncio
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "admission-check")
+os.environ.setdefault("GRIP_SESSION_STORE", "memory")
+os.environ.setdefault("GRIP_TRUSTED_PROXY_HOPS", "1")  # Lets the checks pose as clients behind one proxy
+
+import httpx
+
+import app as flask_module
+import asgi_app as asgi_module
+from admission import TokenBucketLimiter
+from fake_backends import FakeAsyncOpenAI, FakeOpenAI
+
+LLM_LATENCY = 0.2  # Long enough for concurrent requests to overlap
+
+failures = []
+question_numbers = iter(range(1_000_000))
+
+
+def check(name, passed, detail):
+    print(f"{'PASS' if passed else 'FAIL'}  {name:<48} {detail}")
+    if not passed:
+        failures.append(name)
+
+
+def question():
+    # A new question each time, so the legality and enhancement caches never answer for OpenAI.
+    return f"How do I create index number {next(question_numbers)}?"
+
+
+def off_topic_question():
+    return f"How do I shard a MongoDB cluster number {next(question_numbers)}?"
+
+
+def upstream_calls():
+    return (flask_module.openai_client.calls + flask_module.openai_client.embedding_calls
+            + asgi_module.async_openai_client.calls + asgi_module.async_openai_client.embedding_calls)
+
+
+def wait_for_summaries():
+    for _ in range(flask_module.SUMMARY_WORKERS):
+        flask_module.summary_executor.submit(lambda: None).result()
+
+
+def history_pairs_intact(session_id):
+    history = flask_module.session_store.get(session_id)['history']
+    roles = [message['role'] for message in history]
+    return roles == ["user", "assistant"] * (len(history) // 2), len(history)
+
+
+def run_concurrently(send, bodies):
+    with ThreadPoolExecutor(max_workers=len(bodies)) as pool:
+        return list(pool.map(send, bodies))
+
+
+def check_flask(client, calls_per_turn):
+    new_session = lambda: client.post('/new_chat').get_json()['session_id']
+
+    # 1. Double submit: identical messages in flight share one turn.
+    session_id, message = new_session(), question()
+    before = upstream_calls()
+    responses = run_concurrently(lambda body: client.post('/chat', json=body), [{"message": message, "session_id": session_id}] * 5)
+    wait_for_summaries()
+    spent = upstream_calls() - before
+    replies = {response.get_json().get('reply') for response in responses}
+    _, messages = history_pairs_intact(session_id)
+    check("flask: identical messages share one turn", [r.status_code for r in responses] == [200] * 5
+          and len(replies) == 1 and messages == 2 and spent == calls_per_turn,
+          f"5 requests, {spent} OpenAI calls (one turn: {calls_per_turn}), {messages} messages stored")
+
+    # 2. Double submit on the stream: the duplicate replays the leader's reply.
+    session_id, message = new_session(), question()
+    body = {"message": message, "session_id": session_id}
+    streams = run_concurrently(lambda body: client.post('/chat/stream', json=body).get_data(as_text=True), [body] * 2)
+    _, messages = history_pairs_intact(session_id)
+    check("flask: duplicate stream replays the reply", all("event: done" in stream for stream in streams) and messages == 2,
+          f"{sum('event: done' in stream for stream in streams)}/2 streams done, {messages} messages stored")
+
+    # 3. Distinct messages on one session run one after another.
+    session_id = new_session()
+    bodies = [{"message": question(), "session_id": session_id} for _ in range(3)]
+    statuses = [response.status_code for response in run_concurrently(lambda body: client.post('/chat', json=body), bodies)]
+    intact, messages = history_pairs_intact(session_id)
+    check("flask: distinct messages are serialized", statuses == [200] * 3 and intact and messages == 6,
+          f"statuses {statuses}, {messages} messages stored, pairs {'intact' if intact else 'interleaved'}")
+
+    # 4. Concurrent off-topic messages no longer lose illegal_count increments.
+    session_id = new_session()
+    bodies = [{"message": off_topic_question(), "session_id": session_id} for _ in range(3)]
+    run_concurrently(lambda body: client.post('/chat', json=body), bodies)
+    session = flask_module.session_store.get(session_id)
+    check("flask: off-topic counter sees every message", session['illegal_count'] == 3 and session['is_locked'],
+          f"illegal_count {session['illegal_count']}, locked {session['is_locked']}")
+
+    # 5. One running and two queued turns: a fourth distinct message is refused at once.
+    session_id = new_session()
+    bodies = [{"message": question(), "session_id": session_id} for _ in range(4)]
+    statuses = sorted(response.status_code for response in run_concurrently(lambda body: client.post('/chat', json=body), bodies))
+    check("flask: queue per session is bounded", statuses == [200, 200, 200, 429], f"statuses {statuses}")
+
+    # 6. Malformed payloads are refused by validation before they enter a turn.
+    session_id = new_session()
+    bodies = [{"message": 5, "session_id": session_id}, {"message": ["hi"], "session_id": session_id},
+              {"message": question(), "session_id": 5}, ["not", "an", "object"]]
+    statuses = [client.post('/chat', json=body).status_code for body in bodies]
+    check("flask: malformed payloads get 400", statuses == [400] * len(bodies), f"statuses {statuses}")
+
+
+def check_rate_limits(client, calls_per_turn):
+    flask_module.RATE_LIMITS_ENABLED = True
+    new_session = lambda: client.post('/new_chat').get_json()['session_id']
+
+    # 7. Client limit: a burst beyond it is refused before any OpenAI call.
+    flask_module.client_rate_limiter = TokenBucketLimiter(rate_per_second=0.01, burst=5)
+    bodies = [{"message": question(), "session_id": new_session()} for _ in range(10)]
+    before = upstream_calls()
+    responses = [client.post('/chat', json=body) for body in bodies]
+    wait_for_summaries()
+    spent = upstream_calls() - before
+    statuses = [response.status_code for response in responses]
+    check("rate limit: client burst is refused with 429", statuses == [200] * 5 + [429] * 5
+          and all("Retry-After" in response.headers for response in responses[5:]),
+          f"{statuses.count(200)} OK, {statuses.count(429)} refused, Retry-After {responses[-1].headers.get('Retry-After')} s")
+    check("rate limit: refused requests cost no OpenAI call", spent == 5 * calls_per_turn,
+          f"{spent} OpenAI calls for 5 answered requests (one turn: {calls_per_turn})")
+
+    # 8. Session limit: one chatty session is held back while the client is not.
+    flask_module.client_rate_limiter = TokenBucketLimiter(rate_per_second=100, burst=100)
+    flask_module.session_rate_limiter = TokenBucketLimiter(rate_per_second=0.01, burst=flask_module.SESSION_RATE_LIMIT_BURST)
+    session_id = new_session()
+    statuses = [client.post('/chat', json={"message": question(), "session_id": session_id}).status_code
+                for _ in range(flask_module.SESSION_RATE_LIMIT_BURST + 1)]
+    other = client.post('/chat', json={"message": question(), "session_id": new_session()}).status_code
+    check("rate limit: session limit is per session", statuses[-1] == 429 and statuses[:-1] == [200] * (len(statuses) - 1)
+          and other == 200, f"statuses {statuses}, another session {other}")
+
+    # 9. Behind a proxy, clients are told apart by the address it forwarded.
+    flask_module.client_rate_limiter = TokenBucketLimiter(rate_per_second=0.01, burst=2)
+    flask_module.session_rate_limiter = TokenBucketLimiter(rate_per_second=100, burst=100)
+    statuses = [client.post('/chat', json={"message": question(), "session_id": new_session()},
+                            headers={"X-Forwarded-For": f"203.0.113.{client_number}"}).status_code
+                for client_number in (1, 1, 1, 2)]
+    check("rate limit: clients behind a proxy are apart", statuses == [200, 200, 429, 200],
+          f"statuses {statuses} for clients 1, 1, 1 and 2")
+    flask_module.RATE_LIMITS_ENABLED = False
+
+
+async def check_asgi(calls_per_turn):
+    transport = httpx.ASGITransport(app=asgi_module.asgi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://admission-check", timeout=None) as client:
+        async def new_session():
+            return (await client.post('/new_chat')).json()['session_id']
+
+        blocking_embeddings_before = flask_module.openai_client.embedding_calls
+
+        # 10. Double submit under asyncio.
+        session_id, message = await new_session(), question()
+        before = upstream_calls()
+        responses = await asyncio.gather(*(client.post('/chat', json={"message": message, "session_id": session_id}) for _ in range(5)))
+        wait_for_summaries()
+        spent = upstream_calls() - before
+        _, messages = history_pairs_intact(session_id)
+        check("asgi: identical messages share one turn", [r.status_code for r in responses] == [200] * 5
+              and len({r.json()['reply'] for r in responses}) == 1 and messages == 2 and spent == calls_per_turn,
+              f"5 requests, {spent} OpenAI calls (one turn: {calls_per_turn}), {messages} messages stored")
+
+        # 11. Distinct messages, streamed and not, run one after another.
+        session_id = await new_session()
+        responses = await asyncio.gather(
+            client.post('/chat', json={"message": question(), "session_id": session_id}),
+            client.post('/chat/stream', json={"message": question(), "session_id": session_id}),
+            client.post('/chat', json={"message": question(), "session_id": session_id})
+        )
+        intact, messages = history_pairs_intact(session_id)
+        check("asgi: distinct messages are serialized", [r.status_code for r in responses] == [200] * 3 and intact and messages == 6,
+              f"statuses {[r.status_code for r in responses]}, {messages} messages stored, pairs {'intact' if intact else 'interleaved'}")
+
+        # 12. Retrieval embeds queries with the async client, not on the RavenDB thread pool.
+        blocking_embeddings = flask_module.openai_client.embedding_calls - blocking_embeddings_before
+        check("asgi: retrieval embeds queries asynchronously", blocking_embeddings == 0,
+              f"{blocking_embeddings} blocking embedding calls during the async checks")
+
+        # 13. Malformed payloads and forwarded addresses as in checks 6 and 9.
+        session_id = await new_session()
+        malformed = await client.post('/chat', json={"message": 5, "session_id": session_id})
+        flask_module.RATE_LIMITS_ENABLED = True
+        flask_module.client_rate_limiter = TokenBucketLimiter(rate_per_second=0.01, burst=1)
+        statuses = [(await client.post('/chat', json={"message": question(), "session_id": await new_session()},
+                                       headers={"X-Forwarded-For": f"198.51.100.{client_number}"})).status_code
+                    for client_number in (1, 1, 2)]
+        flask_module.RATE_LIMITS_ENABLED = False
+        check("asgi: malformed payloads and proxied clients", malformed.status_code == 400 and statuses == [200, 429, 200],
+              f"malformed {malformed.status_code}, statuses {statuses} for clients 1, 1 and 2")
+
+
+def main():
+    flask_module.app.logger.setLevel(logging.CRITICAL)
+    flask_module.store = None
+    flask_module.SEMANTIC_CACHE_ENABLED = False
+    flask_module.RATE_LIMITS_ENABLED = False
+    flask_module.SPECULATION_MIN_REUSE_RATE = 0.0  # Every turn speculates, so each costs the same number of calls
+    flask_module.openai_client = FakeOpenAI(latency=LLM_LATENCY, embedding_latency=0)
+    asgi_module.async_openai_client = FakeAsyncOpenAI(latency=LLM_LATENCY, embedding_latency=0)
+    client = flask_module.app.test_client()
+
+    # What one uncontended turn costs, to compare bursts against. The fake enhancement
+    # always returns the same query, so the first turn also fills the embedding cache.
+    for _ in range(2):
+        before = upstream_calls()
+        client.post('/chat', json={"message": question(), "session_id": client.post('/new_chat').get_json()['session_id']})
+        wait_for_summaries()
+        calls_per_turn = upstream_calls() - before
+
+    check_flask(client, calls_per_turn)
+    check_rate_limits(client, calls_per_turn)
+    asyncio.run(check_asgi(calls_per_turn))
+
+    print(f"\n{'All checks passed.' if not failures else f'{len(failures)} check(s) failed.'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
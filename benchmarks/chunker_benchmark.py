@@ -0,0 +1,128 @@
+"""
+Compares the fixed-window splitter with the structure-aware markdown chunker.
+
+For a synthetic markdown corpus it reports, per strategy:
+
+- chunk count and total stored bytes (and how much of that is overlap),
+- how many fenced code blocks were cut across chunks,
+- retrieval hit rate: for sampled paragraphs and code blocks, a query made of
+  part of their words is ranked against every chunk with the hashed
+  bag-of-words embedding from fake_backends; a hit means a top-k chunk holds
+  the whole passage intact.
+
+It then times the markdown chunker on single files of growing size to show
+that its cost stays linear.
+
+Usage:
+    python benchmarks/chunker_benchmark.py --files 200 --file-kb 20 --probes 500
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import rag_chunker_script as chunker
+from fake_backends import fake_embedding
+from markdown_chunker import iter_blocks
+from synthetic_markdown import generate_markdown_document
+
+STRATEGIES = {
+    "fixed": lambda body: chunker.split_into_chunks(body),
+    "markdown": lambda body: [text for text, _ in chunker.split_markdown_sections(body)],
+}
+
+
+def build_corpus(file_count, file_kb, seed):
+    rng = random.Random(seed)
+    return [
+        chunker.prepare_markdown_content(generate_markdown_document(rng, f"Guide {index}", int(file_kb * 1024)))
+        for index in range(file_count)
+    ]
+
+
+def sample_probes(bodies, probe_count, seed):
+    rng = random.Random(seed)
+    passages = [block.text for body in bodies for block in iter_blocks(body.split("\n")) if block.kind != "heading"]
+    probes = []
+    for passage in rng.sample(passages, min(probe_count, len(passages))):
+        words = passage.split()
+        kept = sorted(rng.sample(range(len(words)), max(1, len(words) // 2)))
+        probes.append((passage, " ".join(words[i] for i in kept)))
+    return probes
+
+
+def unit_vectors(texts):
+    matrix = np.array([fake_embedding(text) for text in texts], dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def evaluate(strategy, bodies, probes, top_k):
+    start = time.perf_counter()
+    chunks = [chunk for body in bodies for chunk in STRATEGIES[strategy](body)]
+    seconds = time.perf_counter() - start
+
+    body_bytes = sum(len(body.encode("utf-8")) for body in bodies)
+    stored_bytes = sum(len(chunk.encode("utf-8")) for chunk in chunks)
+    code_blocks = [block.text for body in bodies for block in iter_blocks(body.split("\n")) if block.kind == "code"]
+    chunk_set = "\x00".join(chunks)
+    split_code_blocks = sum(1 for code in code_blocks if code not in chunk_set)
+
+    chunk_vectors = unit_vectors(chunks)
+    query_vectors = unit_vectors([query for _, query in probes])
+    top_chunks = np.argsort(-(query_vectors @ chunk_vectors.T), axis=1)[:, :top_k]
+    hits = sum(1 for (passage, _), ranked in zip(probes, top_chunks) if any(passage in chunks[i] for i in ranked))
+
+    return {
+        "chunks": len(chunks),
+        "stored_bytes": stored_bytes,
+        "overhead": stored_bytes / body_bytes - 1,
+        "split_code_blocks": f"{split_code_blocks}/{len(code_blocks)}",
+        "hit_rate": hits / len(probes) if probes else 0.0,
+        "seconds": seconds,
+    }
+
+
+def time_scaling(sizes_mb, seed):
+    rng = random.Random(seed)
+    print("\nMarkdown chunker on one large file")
+    for size_mb in sizes_mb:
+        body = chunker.prepare_markdown_content(generate_markdown_document(rng, "Large reference", int(size_mb * 1_000_000)))
+        start = time.perf_counter()
+        chunk_count = len(chunker.split_markdown_sections(body))
+        seconds = time.perf_counter() - start
+        print(f"  {size_mb:>6.1f} MB   {chunk_count:>7} chunks   {seconds:>7.2f} s   {seconds / size_mb:>6.2f} s/MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=200, help="Synthetic markdown files")
+    parser.add_argument("--file-kb", type=float, default=20, help="Size of each file in KB")
+    parser.add_argument("--probes", type=int, default=500, help="Passages used as retrieval probes")
+    parser.add_argument("--top-k", type=int, default=5, help="Chunks retrieved per probe")
+    parser.add_argument("--scaling-mb", type=float, nargs="*", default=[1, 4, 16], help="Single-file sizes for the timing run")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    bodies = build_corpus(args.files, args.file_kb, args.seed)
+    probes = sample_probes(bodies, args.probes, args.seed)
+    token_mode = "exact" if chunker.get_token_counter().is_exact else "estimated"
+    print(f"{len(bodies)} files, {sum(len(body) for body in bodies) / 1_000_000:.1f} MB of markdown, "
+          f"{len(probes)} probes, hit@{args.top_k}, {token_mode} token counts\n")
+    print(f"{'strategy':<10} {'chunks':>8} {'stored bytes':>14} {'overhead':>9} {'split code':>11} {'hit rate':>9} {'time':>8}")
+    for strategy in STRATEGIES:
+        result = evaluate(strategy, bodies, probes, args.top_k)
+        print(f"{strategy:<10} {result['chunks']:>8} {result['stored_bytes']:>14,} {result['overhead']:>8.1%} "
+              f"{result['split_code_blocks']:>11} {result['hit_rate']:>8.1%} {result['seconds']:>7.2f}s")
+
+    if args.scaling_mb:
+        time_scaling(args.scaling_mb, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+"""
+Deterministic stand-ins for the OpenAI and RavenDB clients used by app.py
+and rag_chunker_script.py.
+
+They mimic only the attributes app.py touches, answer every prompt type the
+pipeline sends (legality, enhancement, title, summary, final answer) and sleep
+for a configurable latency so benchmarks can model slow upstreams without a
+network or an API key.
+
+FakeOpenAIServer and BlackHoleServer are real local HTTP/TCP servers instead,
+for checks that must go through the actual client libraries (timeouts,
+connection pooling, error mapping).
+"""
+import asyncio
+import hashlib
+import json
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from session_store import APPEND_HISTORY_SCRIPT, INCREMENT_FIELDS_SCRIPT, UPDATE_FIELDS_SCRIPT
+
+
+def _prompt_text(messages):
+    content = messages[-1]['content']
+    if isinstance(content, list):
+        return " ".join(part.get('text', '') for part in content)
+    return content
+
+
+def fake_reply_for(messages):
+    """Returns the canned reply the pipeline expects for a given prompt."""
+    prompt = _prompt_text(messages)
+    if "validate whether a user's query" in prompt:
+        return "false" if "mongodb" in prompt.lower().rsplit("now evaluate", 1)[-1] else "true"
+    if prompt.startswith("Enhance this user message"):
+        return "How to create and configure indexes in RavenDB"
+    if prompt.startswith("Generate a concise 3"):
+        return "RavenDB Index Questions"
+    if prompt.startswith(("Summarize the following conversation", "Update the running summary")):
+        return "The user is asking about RavenDB indexing and querying."
+    return "To create an index in RavenDB, define a map function and deploy it to the database."
+
+
+def _completion(text):
+    message = SimpleNamespace(content=text, role="assistant")
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, delta=message)], usage=None)
+
+
+def _stream_chunks(text):
+    return [_completion(word + " ") for word in text.split(" ")]
+
+
+def fake_embedding(text, dimensions=256):
+    """Deterministic hashed bag-of-words embedding; similar wording gives similar vectors."""
+    vector = [0.0] * dimensions
+    for token in re.findall(r"[a-z0-9]+", text.lower()):
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        vector[int.from_bytes(digest[:4], "little") % dimensions] += 1.0 if digest[4] & 1 else -1.0
+    return vector
+
+
+def _embedding_response(inputs):
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    return SimpleNamespace(data=[SimpleNamespace(embedding=fake_embedding(text), index=i) for i, text in enumerate(inputs)])
+
+
+class FakeStream:
+    def __init__(self, chunks, token_delay):
+        self._chunks = chunks
+        self._token_delay = token_delay
+        self.closed = False
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            time.sleep(self._token_delay)
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class FakeAsyncStream(FakeStream):
+    async def __aiter__(self):
+        for chunk in self._chunks:
+            await asyncio.sleep(self._token_delay)
+            yield chunk
+
+    async def close(self):
+        self.closed = True
+
+
+class _FakeCompletions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, model, messages, stream=False, **kwargs):
+        self._owner.calls += 1
+        time.sleep(self._owner.latency)
+        text = fake_reply_for(messages)
+        if stream:
+            return FakeStream(_stream_chunks(text), self._owner.token_delay)
+        return _completion(text)
+
+
+class _FakeAsyncCompletions(_FakeCompletions):
+    async def create(self, model, messages, stream=False, **kwargs):
+        self._owner.calls += 1
+        await asyncio.sleep(self._owner.latency)
+        text = fake_reply_for(messages)
+        if stream:
+            return FakeAsyncStream(_stream_chunks(text), self._owner.token_delay)
+        return _completion(text)
+
+
+class _FakeEmbeddings:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, model, input, **kwargs):
+        self._owner.embedding_calls += 1
+        time.sleep(self._owner.embedding_latency)
+        return _embedding_response(input)
+
+
+class _FakeAsyncEmbeddings(_FakeEmbeddings):
+    async def create(self, model, input, **kwargs):
+        self._owner.embedding_calls += 1
+        await asyncio.sleep(self._owner.embedding_latency)
+        return _embedding_response(input)
+
+
+class FakeOpenAI:
+    """Synchronous OpenAI client stand-in; every call sleeps for `latency` seconds."""
+    completions_class = _FakeCompletions
+    embeddings_class = _FakeEmbeddings
+
+    def __init__(self, latency=0.2, token_delay=0.0, embedding_latency=0.02):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.embedding_latency = embedding_latency
+        self.calls = 0
+        self.embedding_calls = 0
+        self.chat = SimpleNamespace(completions=self.completions_class(self))
+        self.embeddings = self.embeddings_class(self)
+
+
+class FakeAsyncOpenAI(FakeOpenAI):
+    """AsyncOpenAI stand-in; awaits instead of sleeping the thread."""
+    completions_class = _FakeAsyncCompletions
+    embeddings_class = _FakeAsyncEmbeddings
+
+
+class _FakeQuery:
+    def __init__(self, store):
+        self._store = store
+
+    def add_parameter(self, name, value):
+        return self
+
+    def statistics(self, stats_callback):
+        stats_callback(SimpleNamespace(result_etag=self._store.collection_etag))
+        return self
+
+    def __iter__(self):
+        self._store.queries += 1
+        time.sleep(self._store.latency)
+        return iter(self._store.documents[:self._store.result_count])
+
+
+class _FakeSession:
+    def __init__(self, store):
+        self.advanced = SimpleNamespace(raw_query=lambda rql, object_type=None: _FakeQuery(store))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class FakeDocumentStore:
+    """RavenDB DocumentStore stand-in whose raw queries return fixed `Context` chunks."""
+
+    def __init__(self, latency=0.02, result_count=5, chunk_chars=3000):
+        self.latency = latency
+        self.result_count = result_count
+        self.queries = 0
+        self.collection_etag = 1
+        self.documents = [
+            {
+                "Id": f"ContextChunks/{i}",
+                "Title": f"Indexes - Chunk {i}",
+                "Content": (f"RavenDB indexing reference section {i}. " * (chunk_chars // 38 + 1))[:chunk_chars],
+                "SourceFile": "indexes.md"
+            }
+            for i in range(1, result_count + 1)
+        ]
+
+    def open_session(self, *args, **kwargs):
+        return _FakeSession(self)
+
+
+class _FakeBulkInsert:
+    def __init__(self, store):
+        self._store = store
+        self._buffered_bytes = 0
+
+    def store(self, entity, metadata=None):
+        metadata = metadata or {}
+        document_id = metadata.get("@id") or f"{metadata.get('@collection', 'docs')}/{len(self._store.documents) + 1}"
+        payload = json.dumps(entity.__dict__)
+        self._store.documents[document_id] = json.loads(payload)
+        self._store.documents_written += 1
+        self._buffered_bytes += len(payload)
+        if self._buffered_bytes >= self._store.bulk_flush_bytes:
+            self._flush()
+        return document_id
+
+    def _flush(self):
+        self._store.round_trip(self._buffered_bytes)
+        self._buffered_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._buffered_bytes:
+            self._flush()
+        return False
+
+
+def _apply_patch(document, script, values):
+    """Python equivalents of the patch scripts session_store.py sends."""
+    if script == APPEND_HISTORY_SCRIPT:
+        document['History'] = (document.get('History') or []) + values['messages']
+    elif script == INCREMENT_FIELDS_SCRIPT:
+        for field, amount in values['increments'].items():
+            document[field] = (document.get(field) or 0) + amount
+    elif script == UPDATE_FIELDS_SCRIPT:
+        if (document.get('Revision') or 0) != values['expectedRevision']:
+            raise RuntimeError("RevisionConflict")
+        document.update(values['fields'])
+        document['Revision'] = values['expectedRevision'] + 1
+    else:
+        raise NotImplementedError("Unknown patch script")
+    document['UpdatedAt'] = values['updatedAt']
+
+
+class _FakeWriteSession:
+    def __init__(self, store):
+        self._store = store
+        self._pending = []
+        self._deletes = []
+        self._patches = []
+        self.advanced = SimpleNamespace(
+            get_metadata_for=lambda entity: {},
+            raw_query=lambda rql, object_type=None: rql,
+            stream=self._stream,
+            defer=self._patches.append
+        )
+
+    def _stream(self, rql):
+        # Only used for "from <collection> select <fields>"; every stored document matches.
+        fields = [field.strip() for field in rql.split(" select ", 1)[1].split(",")]
+        self._store.round_trip(0)
+        return [SimpleNamespace(key=document_id, document={field: document.get(field) for field in fields})
+                for document_id, document in list(self._store.documents.items())]
+
+    def load(self, key, object_type=None):
+        self._store.round_trip(0)
+        document = self._store.documents.get(key)
+        return json.loads(json.dumps(document)) if document is not None else None
+
+    def store(self, entity, key=None):
+        self._pending.append((key, entity))
+
+    def delete(self, key):
+        self._deletes.append(key)
+
+    def save_changes(self):
+        payloads = [json.dumps(entity.__dict__) for _, entity in self._pending]
+        for (key, _), payload in zip(self._pending, payloads):
+            self._store.documents[key or f"docs/{len(self._store.documents) + 1}"] = json.loads(payload)
+        for key in self._deletes:
+            self._store.documents.pop(key, None)
+        for command in self._patches:
+            document = self._store.documents.get(command.key)
+            if document is not None:
+                _apply_patch(document, command.patch.script, command.patch.values)
+        self._store.documents_written += len(payloads)
+        self._store.documents_deleted += len(self._deletes)
+        self._store.round_trip(sum(len(payload) for payload in payloads))
+        self._pending.clear()
+        self._deletes.clear()
+        self._patches.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class FakeIngestionStore:
+    """
+    RavenDB DocumentStore stand-in for ingestion benchmarks.
+
+    Every session `save_changes()` and every bulk insert buffer flush costs one
+    round trip of `round_trip_latency` plus transfer time at `bandwidth_mb_per_sec`.
+    """
+
+    def __init__(self, round_trip_latency=0.005, bandwidth_mb_per_sec=100, bulk_flush_bytes=1_000_000):
+        self.round_trip_latency = round_trip_latency
+        self.bandwidth_mb_per_sec = bandwidth_mb_per_sec
+        self.bulk_flush_bytes = bulk_flush_bytes
+        self.documents = {}
+        self.round_trips = 0
+        self.bytes_written = 0
+        self.documents_written = 0
+        self.documents_deleted = 0
+
+    def round_trip(self, payload_bytes):
+        self.round_trips += 1
+        self.bytes_written += payload_bytes
+        time.sleep(self.round_trip_latency + payload_bytes / (self.bandwidth_mb_per_sec * 1_000_000))
+
+    def open_session(self, *args, **kwargs):
+        return _FakeWriteSession(self)
+
+    def bulk_insert(self, *args, **kwargs):
+        return _FakeBulkInsert(self)
+
+
+class _FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so connection reuse by the client is visible
+
+    def setup(self):
+        super().setup()
+        with self.server.owner.lock:
+            self.server.owner.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, text):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for word in text.split(" "):
+            chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": 0, "model": "fake",
+                     "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def do_POST(self):
+        try:
+            self._answer()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # The client gave up at its timeout
+
+    def _answer(self):
+        owner = self.server.owner
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with owner.lock:
+            owner.requests += 1
+            request_number = owner.requests
+        time.sleep(owner.latency)
+        if owner.failure_status and (owner.fail_every == 1 or request_number % owner.fail_every == 0):
+            owner.failures += 1
+            self._send_json(owner.failure_status, {"error": {"message": "Injected failure", "type": "server_error"}})
+            return
+        if self.path.endswith("/embeddings"):
+            inputs = request["input"] if isinstance(request["input"], list) else [request["input"]]
+            self._send_json(200, {"object": "list", "model": request["model"],
+                                  "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(text)}
+                                           for i, text in enumerate(inputs)],
+                                  "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+            return
+        text = fake_reply_for(request["messages"])
+        if request.get("stream"):
+            self._send_stream(text)
+            return
+        self._send_json(200, {"id": "chatcmpl-fake", "object": "chat.completion", "created": 0, "model": request["model"],
+                              "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                              "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}})
+
+
+class FakeOpenAIServer:
+    """
+    Local HTTP server speaking the OpenAI chat completions and embeddings API.
+
+    Point a real client at `base_url`. `latency` delays every answer; with
+    `failure_status` set, every `fail_every`-th request (every request when 1)
+    is answered with that status instead. All three can be changed while the
+    server runs.
+    """
+
+    def __init__(self, latency=0.0, failure_status=None, fail_every=1):
+        self.latency = latency
+        self.failure_status = failure_status
+        self.fail_every = fail_every
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.failures = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeOpenAIHandler)
+        self._server.daemon_threads = True
+        self._server.owner = self
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        return False
+
+
+class BlackHoleServer:
+    """TCP server that accepts connections and never answers, like a hung upstream."""
+
+    def __init__(self):
+        self._socket = socket.create_server(("127.0.0.1", 0))
+        self._connections = []
+        self.url = f"http://127.0.0.1:{self._socket.getsockname()[1]}"
+
+    def _accept(self):
+        while True:
+            try:
+                self._connections.append(self._socket.accept()[0])
+            except OSError:
+                return
+
+    def __enter__(self):
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._socket.close()
+        for connection in self._connections:
+            connection.close()
+        return False
@@ -0,0 +1,105 @@
+"""
+Ingestion throughput of rag_chunker_script.py over a synthetic markdown corpus.
+
+Compares the original loop (one file at a time, one session and save_changes
+per file) with the process-pool + bulk insert pipeline at several degrees of
+parallelism, then re-runs an incremental sync over the unchanged corpus.
+With --large-files the corpus also holds files above STREAM_FILE_BYTES,
+which the pipeline streams out of the pool. By default documents go to FakeIngestionStore, which charges a
+round trip per save_changes or bulk insert flush; pass --ravendb-url to run
+against a real local server instead (the target database is written to).
+
+Usage:
+    python benchmarks/ingestion_benchmark.py --files 2000 --file-kb 20 --workers 1 4 8
+    python benchmarks/ingestion_benchmark.py --files 0 --large-files 8 --large-file-mb 16 --workers 1 4 8
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import rag_chunker_script as chunker
+from fake_backends import FakeIngestionStore
+from memory_profile_chunker import write_large_file
+from synthetic_markdown import write_corpus
+
+
+def make_store(args):
+    if args.ravendb_url:
+        from ravendb import DocumentStore
+        store = DocumentStore(urls=[args.ravendb_url], database=args.database)
+        store.initialize()
+        return store
+    return FakeIngestionStore(round_trip_latency=args.round_trip_ms / 1000)
+
+
+def ingest_one_session_per_file(store, markdown_files):
+    """The original main() loop: chunk a file, then store its chunks in their own session."""
+    stats = {"files": 0, "failed_files": 0, "chunks": 0, "bytes": 0}
+    start_time = time.perf_counter()
+    for md_file in markdown_files:
+        documents, bytes_read, _ = chunker.chunk_file(md_file)
+        stats["files"] += 1
+        stats["bytes"] += bytes_read
+        if documents:
+            with store.open_session() as session:
+                for document in documents:
+                    session.store(document)
+                    session.advanced.get_metadata_for(document)["@collection"] = chunker.COLLECTION_NAME
+                session.save_changes()
+        stats["chunks"] += len(documents)
+    stats["seconds"] = time.perf_counter() - start_time
+    return stats
+
+
+def report(label, stats, store):
+    seconds = stats["seconds"] or 1e-9
+    round_trips = f"{store.round_trips:>7} round trips" if isinstance(store, FakeIngestionStore) else ""
+    print(f"{label:<30} {stats['chunks'] / seconds:>10.1f} docs/sec   "
+          f"{stats['bytes'] / 1_000_000 / seconds:>7.2f} MB/sec   {stats['seconds']:>7.2f} s   {round_trips}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=2000, help="Synthetic markdown files to generate")
+    parser.add_argument("--file-kb", type=float, default=20, help="Average file size in KB")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8], help="Degrees of parallelism to compare")
+    parser.add_argument("--large-files", type=int, default=0, help="Files above STREAM_FILE_BYTES to add")
+    parser.add_argument("--large-file-mb", type=float, default=16, help="Size of each large file in MB")
+    parser.add_argument("--files-per-task", type=int, default=chunker.FILES_PER_TASK, help="Files per worker task")
+    parser.add_argument("--round-trip-ms", type=float, default=5, help="Stand-in latency per round trip")
+    parser.add_argument("--ravendb-url", help="Use a real RavenDB server instead of the stand-in")
+    parser.add_argument("--database", default="RAG_Chatbot_Benchmark", help="Database used with --ravendb-url")
+    parser.add_argument("--skip-baseline", action="store_true", help="Do not run the one-session-per-file loop")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        markdown_files = write_corpus(corpus_dir, args.files, args.file_kb) if args.files else []
+        markdown_files += [write_large_file(Path(corpus_dir) / f"large_{number}.md", args.large_file_mb, seed=number)
+                           for number in range(args.large_files)]
+        corpus_mb = sum(path.stat().st_size for path in markdown_files) / 1_000_000
+        print(f"{len(markdown_files)} files, {corpus_mb:.1f} MB, "
+              f"{'RavenDB at ' + args.ravendb_url if args.ravendb_url else f'stand-in store ({args.round_trip_ms:.0f} ms/round trip)'}\n")
+
+        if not args.skip_baseline:
+            store = make_store(args)
+            report("one session per file", ingest_one_session_per_file(store, markdown_files), store)
+        for workers in args.workers:
+            store = make_store(args)
+            stats = chunker.ingest_files(store, markdown_files, workers, args.files_per_task)
+            report(f"bulk insert, {workers} worker(s)", stats, store)
+
+        # An unchanged corpus should cost one hash scan and no writes.
+        writes_before = store.documents_written if isinstance(store, FakeIngestionStore) else None
+        stats = chunker.ingest_files(store, markdown_files, args.workers[-1], args.files_per_task,
+                                     existing_hashes=chunker.fetch_existing_chunk_hashes(store))
+        report("incremental sync, unchanged", stats, store)
+        written = f"{store.documents_written - writes_before} documents written, " if writes_before is not None else ""
+        print(f"{'':<30} {written}{stats['added'] + stats['changed']} added/changed, {stats['deleted']} deleted")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Load test comparing the threaded Flask app with the asyncio serving mode.
+
+Both modes run in-process against the fake backends in fake_backends.py, so
+no OpenAI key or RavenDB server is needed. The WSGI side is modelled as a
+fixed pool of worker threads (like `gunicorn --threads N`); the ASGI side
+drives asgi_app through httpx's in-process ASGI transport.
+
+With --unique-questions every request misses the legality and enhancement
+caches, so each turn keeps several pre-retrieval stages busy at once. Running
+that at several --workers counts with --pre-retrieval-workers 16
+--always-speculate reproduces the former fixed, shared pool for comparison.
+
+Usage:
+    python benchmarks/load_test.py --requests 200 --concurrency 50 --workers 8
+    python benchmarks/load_test.py --unique-questions --workers 4 8 16 --skip-asgi
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "load-test")
+os.environ.setdefault("GRIP_SESSION_STORE", "memory")
+os.environ.setdefault("GRIP_RATE_LIMITS", "off")  # Every request comes from one client address
+
+import httpx
+
+import app as flask_module
+import asgi_app as asgi_module
+from fake_backends import FakeAsyncOpenAI, FakeDocumentStore, FakeOpenAI
+
+QUESTION = "How do I create an index?"
+question_numbers = count()
+
+
+def next_question(unique):
+    return f"How do I create index number {next(question_numbers)}?" if unique else QUESTION
+
+
+def install_fakes(llm_latency, ravendb_latency):
+    flask_module.openai_client = FakeOpenAI(latency=llm_latency)
+    asgi_module.async_openai_client = FakeAsyncOpenAI(latency=llm_latency)
+    flask_module.store = FakeDocumentStore(latency=ravendb_latency)
+
+
+def create_sessions(count):
+    client = flask_module.app.test_client()
+    return [client.post('/new_chat').get_json()['session_id'] for _ in range(count)]
+
+
+def run_wsgi(total_requests, workers, unique_questions=False):
+    session_ids = create_sessions(total_requests)
+    client = flask_module.app.test_client()
+
+    def send(session_id):
+        start = time.perf_counter()
+        response = client.post('/chat', json={"message": next_question(unique_questions), "session_id": session_id})
+        assert response.status_code == 200, response.get_data(as_text=True)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        latencies = list(pool.map(send, session_ids))
+    return time.perf_counter() - start, latencies
+
+
+async def run_asgi(total_requests, concurrency, unique_questions=False):
+    session_ids = create_sessions(total_requests)
+    limiter = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=asgi_module.asgi_app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=None) as client:
+        async def send(session_id):
+            async with limiter:
+                start = time.perf_counter()
+                response = await client.post('/chat', json={"message": next_question(unique_questions), "session_id": session_id})
+                assert response.status_code == 200, response.text
+                return time.perf_counter() - start
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(send(session_id) for session_id in session_ids))
+    return time.perf_counter() - start, latencies
+
+
+def report(label, elapsed, latencies):
+    ordered = sorted(latencies)
+    p95 = ordered[int(0.95 * (len(ordered) - 1))]
+    print(f"{label:<28} {len(latencies) / elapsed:>9.1f} req/s   "
+          f"p50 {statistics.median(ordered) * 1000:>8.1f} ms   p95 {p95 * 1000:>8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="Total /chat requests per mode")
+    parser.add_argument("--concurrency", type=int, default=50, help="In-flight requests for the ASGI mode")
+    parser.add_argument("--workers", type=int, nargs="+", default=[8], help="Worker threads for the WSGI mode; one run per value")
+    parser.add_argument("--llm-latency-ms", type=float, default=200, help="Latency of every fake OpenAI call")
+    parser.add_argument("--ravendb-latency-ms", type=float, default=20, help="Latency of every fake RavenDB query")
+    parser.add_argument("--unique-questions", action="store_true", help="Send a different question with every request")
+    parser.add_argument("--pre-retrieval-workers", type=int, help="Override the size of app.pre_retrieval_executor")
+    parser.add_argument("--always-speculate", action="store_true", help="Start the speculative search on every turn")
+    parser.add_argument("--skip-asgi", action="store_true", help="Only run the WSGI mode")
+    args = parser.parse_args()
+
+    flask_module.app.logger.setLevel(logging.WARNING)
+    install_fakes(args.llm_latency_ms / 1000, args.ravendb_latency_ms / 1000)
+    if args.pre_retrieval_workers:
+        flask_module.pre_retrieval_executor = ThreadPoolExecutor(max_workers=args.pre_retrieval_workers, thread_name_prefix="pre-retrieval")
+    if args.always_speculate:
+        flask_module.SPECULATION_MIN_REUSE_RATE = 0.0
+
+    print(f"{args.requests} requests, fake LLM latency {args.llm_latency_ms:.0f} ms, "
+          f"fake RavenDB latency {args.ravendb_latency_ms:.0f} ms, "
+          f"{flask_module.pre_retrieval_executor._max_workers} pre-retrieval threads\n")
+    for workers in args.workers:
+        report(f"WSGI ({workers} threads)", *run_wsgi(args.requests, workers, args.unique_questions))
+    if not args.skip_asgi:
+        report(f"ASGI ({args.concurrency} in flight)", *asyncio.run(run_asgi(args.requests, args.concurrency, args.unique_questions)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Peak memory of chunking one very large markdown file.
+
+Writes a synthetic file of each requested size (section by section, so the
+generator itself stays small), then measures the tracemalloc peak of:
+
+- read-all: f.read() + prepare_markdown_content + split, the pre-streaming path,
+- streaming: iter_chunk_documents, draining each chunk as the bulk insert does.
+
+The streaming peak must stay under --bound-kb at every size and must not grow
+with the file; the script exits non-zero otherwise, so it can gate a change.
+
+Usage:
+    python benchmarks/memory_profile_chunker.py --sizes-mb 8 64 --chunker markdown
+"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import rag_chunker_script as chunker
+from synthetic_markdown import generate_markdown_document
+
+
+def write_large_file(path, size_mb, seed):
+    """Appends ~100 KB documents (front matter stripped after the first) until size_mb is reached."""
+    rng = random.Random(seed)
+    target = int(size_mb * 1_000_000)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(generate_markdown_document(rng, "Large reference", 100_000))
+        while f.tell() < target:
+            f.write(generate_markdown_document(rng, "Large reference", 100_000).split("---\n", 2)[2])
+    return path
+
+
+def read_all(path, strategy):
+    with open(path, "r", encoding="utf-8") as f:
+        body = chunker.prepare_markdown_content(f.read())
+    chunks = chunker.split_into_chunks(body) if strategy == "fixed" else chunker.split_markdown_sections(body)
+    return len(chunks)
+
+
+def streaming(path, strategy):
+    count = 0
+    for _ in chunker.iter_chunk_documents(path, strategy):
+        count += 1  # Stands in for bulk_insert.store, which buffers at most 1 MB before flushing
+    return count
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    chunk_count = fn(*args)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return chunk_count, peak, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[8, 64], help="File sizes to profile")
+    parser.add_argument("--chunker", choices=["markdown", "fixed"], default=chunker.CHUNKING_STRATEGY)
+    parser.add_argument("--bound-kb", type=float, default=2048, help="Largest streaming peak allowed")
+    parser.add_argument("--growth", type=float, default=1.5, help="Largest allowed ratio of peaks, largest vs smallest file")
+    parser.add_argument("--skip-read-all", action="store_true", help="Only profile the streaming path")
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    chunker.get_token_counter()  # Load the tokenizer outside the measured region
+    token_mode = "exact" if chunker.get_token_counter().is_exact else "estimated"
+    print(f"{args.chunker} chunker, {token_mode} token counts, MAX_BLOCK_CHARS={chunker.MAX_BLOCK_CHARS:,}, "
+          f"MAX_LINE_CHARS={chunker.MAX_LINE_CHARS:,}\n")
+    print(f"{'file':>9} {'path':<10} {'chunks':>8} {'peak':>12} {'time':>8}")
+
+    peaks = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size_mb in args.sizes_mb:
+            path = write_large_file(Path(directory) / f"large-{size_mb:g}mb.md", size_mb, args.seed)
+            label = f"{path.stat().st_size / 1_000_000:.1f} MB"
+            paths = [("streaming", streaming)] if args.skip_read_all else [("read-all", read_all), ("streaming", streaming)]
+            for name, fn in paths:
+                chunk_count, peak, seconds = measure(fn, path, args.chunker)
+                print(f"{label:>9} {name:<10} {chunk_count:>8} {peak / 1024:>9,.0f} KB {seconds:>7.2f}s")
+                if name == "streaming":
+                    peaks.append(peak)
+            path.unlink()
+
+    failures = []
+    if max(peaks) > args.bound_kb * 1024:
+        failures.append(f"streaming peak {max(peaks) / 1024:,.0f} KB exceeds the {args.bound_kb:,.0f} KB bound")
+    if max(peaks) > peaks[0] * args.growth:
+        failures.append(f"streaming peak grew {max(peaks) / peaks[0]:.2f}x with file size (allowed {args.growth}x)")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print(f"\nOK: streaming peak stays under {args.bound_kb:,.0f} KB and does not grow with file size.")
+
+
+if __name__ == "__main__":
+    main()
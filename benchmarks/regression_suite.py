@@ -0,0 +1,316 @@
+"""
+Offline performance regression suite for app.py and rag_chunker_script.py.
+
+Everything runs in-process against the deterministic fakes in
+fake_backends.py, so no OpenAI key or RavenDB server is needed:
+
+- chat: at each concurrency level, worker threads hold multi-turn
+  conversations through /chat on the Flask test client. Reports throughput,
+  p50/p99 latency, final-prompt size (from the request traces), OpenAI calls
+  per request and the resident size of each session's data.
+- sessions: p50/p99 latency of /new_chat, /get_sessions and
+  /get_session_history, the calls behind the sidebar.
+- chunker: chunk_files over a synthetic markdown corpus (MB/s, chunks) and
+  the tracemalloc peak of streaming the largest file.
+
+Results are flat metric names such as `chat.c4.p99_ms`. Each one is checked
+against the limits in a thresholds file (regression_thresholds.json by
+default, fnmatch patterns allowed) and, with --baseline, against a previous
+--output file with a relative tolerance. The script exits non-zero if any
+check fails, so it can gate a change.
+
+Usage:
+    python benchmarks/regression_suite.py --concurrency 1 4 16 --output results.json
+    python benchmarks/regression_suite.py --baseline results.json --tolerance 0.3
+"""
+import argparse
+import fnmatch
+import itertools
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "regression-suite")
+os.environ.setdefault("GRIP_SESSION_STORE", "memory")
+os.environ.setdefault("GRIP_RATE_LIMITS", "off")  # Every request comes from one client address
+
+import app as flask_module
+import rag_chunker_script as chunker
+from fake_backends import FakeDocumentStore, FakeOpenAI
+from synthetic_markdown import TOPICS, WORDS, write_corpus
+
+DEFAULT_THRESHOLDS = Path(__file__).resolve().parent / "regression_thresholds.json"
+HIGHER_IS_BETTER = ("_rps", "mb_per_s")  # Metric name suffixes; every other metric regresses upwards
+SIDEBAR_PAGE_SIZE = 100  # Sessions per /get_sessions page, as script.js requests them
+CHUNKER_TIMED_PASSES = 3  # Chunker throughput is the best of this many passes, like timeit
+BASELINE_NOISE_FLOOR_MS = 20.0  # Latency changes smaller than this (a few GIL switch intervals) never count as regressions
+
+
+class TraceCollector:
+    """Stands in for app.trace_log and keeps every finished request trace in memory."""
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def write(self, trace, status):
+        record = trace.to_record(status)
+        with self._lock:
+            self.records.append(record)
+
+    def take(self):
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[int(fraction * (len(ordered) - 1))]
+
+
+def deep_sizeof(value):
+    """Bytes held by a session document: containers, strings and arrays, recursively."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_sizeof(key) + deep_sizeof(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(deep_sizeof(item) for item in value)
+    elif isinstance(value, np.ndarray):
+        size += value.nbytes
+    return size
+
+
+def question(conversation, turn):
+    """A distinct, deterministic follow-up question for each turn of each conversation."""
+    topic = TOPICS[(conversation + turn) % len(TOPICS)]
+    detail = " ".join(WORDS[(conversation * 7 + turn * 3 + i) % len(WORDS)] for i in range(4))
+    return f"How do I use {topic} with {detail} in conversation {conversation}, step {turn}?"
+
+
+def install_fakes(args):
+    flask_module.app.logger.setLevel(logging.WARNING)
+    flask_module.openai_client = FakeOpenAI(latency=args.llm_latency_ms / 1000, embedding_latency=args.embedding_latency_ms / 1000)
+    flask_module.store = FakeDocumentStore(latency=args.ravendb_latency_ms / 1000)
+    flask_module.trace_log = TraceCollector()
+
+
+def wait_for_summary_folds():
+    """Returns once every queued background summary fold has finished: all summary workers must be idle at once."""
+    barrier = threading.Barrier(flask_module.SUMMARY_WORKERS)
+    futures = [flask_module.summary_executor.submit(barrier.wait) for _ in range(flask_module.SUMMARY_WORKERS)]
+    for future in futures:
+        future.result()
+
+
+def median_results(runs):
+    """Combines repeated runs of one scenario into the median of each metric."""
+    return {name: statistics.median(run[name] for run in runs) for name in runs[0]}
+
+
+def conversations_per_level(concurrency, args):
+    return max(concurrency, args.requests // args.turns)
+
+
+def run_chat_level(client, concurrency, args, conversation_numbers):
+    """Runs args.requests /chat calls as new conversations of args.turns turns; returns the level's metrics."""
+    conversation_count = conversations_per_level(concurrency, args)
+    conversations = [next(conversation_numbers) for _ in range(conversation_count)]
+    session_ids = [client.post('/new_chat').get_json()['session_id'] for _ in range(conversation_count)]
+    openai_calls_before = flask_module.openai_client.calls + flask_module.openai_client.embedding_calls
+    flask_module.trace_log.take()
+
+    def converse(worker):
+        latencies = []
+        for index in range(worker, conversation_count, concurrency):
+            for turn in range(args.turns):
+                start = time.perf_counter()
+                response = client.post('/chat', json={"message": question(conversations[index], turn),
+                                                      "session_id": session_ids[index]})
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise RuntimeError(f"/chat answered {response.status_code}: {response.get_data(as_text=True)}")
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = [latency for worker_latencies in pool.map(converse, range(concurrency)) for latency in worker_latencies]
+    elapsed = time.perf_counter() - start
+    wait_for_summary_folds()
+
+    prompt_tokens = [record['prompt_breakdown']['total'] for record in flask_module.trace_log.take() if 'prompt_breakdown' in record]
+    openai_calls = flask_module.openai_client.calls + flask_module.openai_client.embedding_calls - openai_calls_before
+    session_bytes = [deep_sizeof(flask_module.session_store.get(session_id)) for session_id in session_ids]
+    return {
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "prompt_tokens_p50": statistics.median(prompt_tokens),
+        "prompt_tokens_max": max(prompt_tokens),
+        "openai_calls_per_request": openai_calls / len(latencies),
+        "session_kb": statistics.mean(session_bytes) / 1024,
+    }
+
+
+def run_session_endpoints(client, concurrency, iterations):
+    """Times the session endpoints the sidebar calls; returns p50/p99 per endpoint."""
+    session_ids = [client.post('/new_chat').get_json()['session_id'] for _ in range(iterations)]
+    calls = {
+        "new_chat": lambda i: client.post('/new_chat'),
+        "get_sessions": lambda i: client.get(f'/get_sessions?limit={SIDEBAR_PAGE_SIZE}'),
+        "get_session_history": lambda i: client.get(f'/get_session_history/{session_ids[i]}'),
+    }
+    metrics = {}
+    for name, call in calls.items():
+        def timed(i):
+            start = time.perf_counter()
+            response = call(i)
+            if not response.status_code < 300:
+                raise RuntimeError(f"{name} answered {response.status_code}")
+            return time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(timed, range(iterations)))
+        metrics[f"sessions.{name}.p50_ms"] = statistics.median(latencies) * 1000
+        metrics[f"sessions.{name}.p99_ms"] = percentile(latencies, 0.99) * 1000
+    return metrics
+
+
+def run_chunker(paths):
+    """Chunks the corpus in-process, then streams its largest file under tracemalloc."""
+    corpus_mb = sum(path.stat().st_size for path in paths) / 1_000_000
+    chunker.chunk_files(paths[:5])  # Warm up the token counter and regex caches
+    elapsed = float("inf")
+    for _ in range(CHUNKER_TIMED_PASSES):
+        start = time.perf_counter()
+        chunked = chunker.chunk_files(paths)
+        elapsed = min(elapsed, time.perf_counter() - start)
+    errors = [f"{md_file.name}: {error}" for md_file, _, _, error in chunked if error]
+    if errors:
+        raise RuntimeError(f"Chunking failed for {', '.join(errors)}")
+    chunk_count = sum(len(documents) for _, documents, _, _ in chunked)
+
+    largest = max(paths, key=lambda path: path.stat().st_size)
+    tracemalloc.start()
+    for _ in chunker.iter_chunk_documents(largest):
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "chunker.mb_per_s": corpus_mb / elapsed,
+        "chunker.chunks": chunk_count,
+        "chunker.stream_peak_kb": peak / 1024,
+    }
+
+
+def check_thresholds(results, thresholds):
+    """
+    Returns a failure message for every metric outside a {"max": x} / {"min": x}
+    limit whose pattern matches it. Patterns for levels that were not run match nothing.
+    """
+    failures = []
+    for pattern, limits in thresholds.items():
+        for name in [name for name in results if fnmatch.fnmatchcase(name, pattern)]:
+            if "max" in limits and results[name] > limits["max"]:
+                failures.append(f"{name} = {results[name]:.2f}, above the threshold of {limits['max']}")
+            if "min" in limits and results[name] < limits["min"]:
+                failures.append(f"{name} = {results[name]:.2f}, below the threshold of {limits['min']}")
+    return failures
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Returns a failure message for every metric that got worse than the baseline by more than `tolerance`."""
+    failures = []
+    for name, value in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if name.endswith("_ms") and abs(value - previous) < BASELINE_NOISE_FLOOR_MS:
+            continue
+        change = value / previous - 1
+        if name.endswith(HIGHER_IS_BETTER):
+            change = -change
+        if change > tolerance:
+            failures.append(f"{name} = {value:.2f}, {change:.0%} worse than the baseline {previous:.2f}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Worker threads per chat level")
+    parser.add_argument("--requests", type=int, default=120, help="/chat requests per concurrency level")
+    parser.add_argument("--turns", type=int, default=8, help="Turns per conversation")
+    parser.add_argument("--session-calls", type=int, default=200, help="Calls per session endpoint")
+    parser.add_argument("--session-concurrency", type=int, default=4, help="Worker threads for the session endpoints")
+    parser.add_argument("--llm-latency-ms", type=float, default=20, help="Latency of every fake OpenAI chat call")
+    parser.add_argument("--embedding-latency-ms", type=float, default=5, help="Latency of every fake OpenAI embedding call")
+    parser.add_argument("--ravendb-latency-ms", type=float, default=5, help="Latency of every fake RavenDB query")
+    parser.add_argument("--corpus-files", type=int, default=200, help="Synthetic markdown files for the chunker run")
+    parser.add_argument("--corpus-file-kb", type=float, default=20, help="Average size of each file in KB")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per scenario; the median of each metric is reported")
+    parser.add_argument("--thresholds", type=Path, default=DEFAULT_THRESHOLDS, help="JSON of {metric pattern: {max|min: limit}}")
+    parser.add_argument("--baseline", type=Path, help="Results of an earlier --output run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Allowed relative regression against --baseline")
+    parser.add_argument("--output", type=Path, help="Write the results as JSON")
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    install_fakes(args)
+    client = flask_module.app.test_client()
+    token_mode = "exact" if flask_module.token_counter.is_exact else "estimated"
+    print(f"Fake latencies: LLM {args.llm_latency_ms:.0f} ms, embeddings {args.embedding_latency_ms:.0f} ms, "
+          f"RavenDB {args.ravendb_latency_ms:.0f} ms; {token_mode} token counts; median of {args.repeats} runs\n")
+
+    results = {}
+    print(f"{'chat':<8} {'sessions':>8} {'req/s':>8} {'p50':>10} {'p99':>10} {'prompt p50':>11} {'prompt max':>11} "
+          f"{'calls/req':>10} {'session':>10}")
+    conversation_numbers = itertools.count()
+    for concurrency in args.concurrency:
+        metrics = median_results([run_chat_level(client, concurrency, args, conversation_numbers) for _ in range(args.repeats)])
+        results.update({f"chat.c{concurrency}.{name}": value for name, value in metrics.items()})
+        print(f"{f'c={concurrency}':<8} {conversations_per_level(concurrency, args):>8} {metrics['throughput_rps']:>8.1f} "
+              f"{metrics['p50_ms']:>7.1f} ms {metrics['p99_ms']:>7.1f} ms {metrics['prompt_tokens_p50']:>11.0f} "
+              f"{metrics['prompt_tokens_max']:>11.0f} {metrics['openai_calls_per_request']:>10.2f} {metrics['session_kb']:>7.1f} KB")
+
+    session_metrics = median_results([run_session_endpoints(client, args.session_concurrency, args.session_calls)
+                                      for _ in range(args.repeats)])
+    results.update(session_metrics)
+    print(f"\nSession endpoints, {args.session_concurrency} threads, {args.session_calls} calls each")
+    for name in ("new_chat", "get_sessions", "get_session_history"):
+        print(f"  {name:<22} p50 {session_metrics[f'sessions.{name}.p50_ms']:>7.2f} ms   "
+              f"p99 {session_metrics[f'sessions.{name}.p99_ms']:>7.2f} ms")
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_corpus(directory, args.corpus_files, args.corpus_file_kb, seed=args.seed)
+        corpus_mb = sum(path.stat().st_size for path in paths) / 1_000_000
+        chunker_metrics = median_results([run_chunker(paths) for _ in range(args.repeats)])
+    results.update(chunker_metrics)
+    print(f"\nChunker, {args.corpus_files} files, {corpus_mb:.1f} MB: {chunker_metrics['chunker.mb_per_s']:.2f} MB/s, "
+          f"{chunker_metrics['chunker.chunks']:.0f} chunks, streaming peak {chunker_metrics['chunker.stream_peak_kb']:.0f} KB")
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+    failures = check_thresholds(results, json.loads(args.thresholds.read_text(encoding="utf-8"))) if args.thresholds.exists() else []
+    if args.baseline:
+        failures += compare_to_baseline(results, json.loads(args.baseline.read_text(encoding="utf-8")), args.tolerance)
+
+    print()
+    for failure in failures:
+        print(f"FAIL  {failure}")
+    print("No regressions." if not failures else f"{len(failures)} regression check(s) failed.")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
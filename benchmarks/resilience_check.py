@@ -0,0 +1,127 @@
+"""
+Checks the timeouts, retries, circuit breakers and RavenDB reconnection of
+app.py against local fake servers that inject latency and failures.
+
+The real OpenAI SDK talks to FakeOpenAIServer over HTTP and the real RavenDB
+client talks to a BlackHoleServer that accepts connections and never
+answers. Deadlines and the breaker reset time are shortened so the whole run
+takes a few seconds. Each scenario prints PASS or FAIL and the script exits
+non-zero if any check fails.
+
+Usage:
+    python benchmarks/resilience_check.py
+"""
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "resilience-check")
+os.environ.setdefault("GRIP_SESSION_STORE", "memory")
+os.environ.setdefault("GRIP_RATE_LIMITS", "off")  # Every request comes from one client address
+
+from fake_backends import BlackHoleServer, FakeOpenAIServer
+
+failures = []
+question_numbers = iter(range(1_000_000))
+
+
+def check(name, passed, detail):
+    print(f"{'PASS' if passed else 'FAIL'}  {name:<44} {detail}")
+    if not passed:
+        failures.append(name)
+
+
+def timed_chat(client, session_id):
+    # A new question each time, so the legality and enhancement caches never answer for OpenAI.
+    message = f"How do I create index number {next(question_numbers)}?"
+    start = time.perf_counter()
+    response = client.post('/chat', json={"message": message, "session_id": session_id})
+    return response, time.perf_counter() - start
+
+
+def main():
+    openai_server = FakeOpenAIServer()
+    with openai_server, BlackHoleServer() as black_hole:
+        os.environ["OPENAI_BASE_URL"] = openai_server.base_url
+        import app as flask_module
+
+        flask_module.app.logger.setLevel(logging.CRITICAL)
+        flask_module.store = None  # Retrieval stays off until the RavenDB scenario
+        flask_module.SEMANTIC_CACHE_ENABLED = False
+        flask_module.OPENAI_HELPER_DEADLINE_SECONDS = 0.5
+        flask_module.OPENAI_COMPLETION_DEADLINE_SECONDS = 1.0
+        flask_module.openai_policy.base_delay_seconds = 0.02
+        flask_module.openai_breaker.reset_timeout_seconds = 1.0
+        client = flask_module.app.test_client()
+        new_session = lambda: client.post('/new_chat').get_json()['session_id']
+
+        # 1. Healthy upstream: every request succeeds over a few pooled connections.
+        statuses = [timed_chat(client, new_session())[0].status_code for _ in range(20)]
+        check("healthy: /chat succeeds", statuses == [200] * 20, f"{statuses.count(200)}/20 OK")
+        check("healthy: keep-alive connections are reused", openai_server.connections <= 5,
+              f"{openai_server.requests} OpenAI requests over {openai_server.connections} connections")
+
+        # 2. Every third request fails with a 500: retries hide the failures.
+        openai_server.failure_status, openai_server.fail_every = 500, 3
+        retries_before, failures_before = flask_module.openai_policy.retries, openai_server.failures
+        statuses = [timed_chat(client, new_session())[0].status_code for _ in range(20)]
+        check("flaky: /chat succeeds despite 500s", statuses == [200] * 20,
+              f"{statuses.count(200)}/20 OK, {openai_server.failures - failures_before} injected 500s, "
+              f"{flask_module.openai_policy.retries - retries_before} retries")
+        check("flaky: breaker stays closed", flask_module.openai_breaker.state == "closed", flask_module.openai_breaker.state)
+
+        # 3. Upstream slower than every deadline: requests end on time, then the breaker fails fast.
+        openai_server.failure_status, openai_server.latency = None, 3.0
+        response, elapsed = timed_chat(client, new_session())
+        check("slow: /chat gives up at its deadlines", response.status_code == 503 and elapsed < 2.5,
+              f"status {response.status_code} after {elapsed:.2f} s (upstream takes 3 s)")
+        check("slow: timeouts open the breaker", flask_module.openai_breaker.state == "open", flask_module.openai_breaker.state)
+        response, elapsed = timed_chat(client, new_session())
+        check("open: /chat fails fast with Retry-After", response.status_code == 503 and elapsed < 0.1
+              and "Retry-After" in response.headers, f"status {response.status_code} after {elapsed * 1000:.1f} ms")
+
+        # 4. Upstream recovers: after the reset timeout one probe closes the breaker.
+        openai_server.latency = 0.0
+        time.sleep(flask_module.openai_breaker.reset_timeout_seconds + 0.1)
+        response, _ = timed_chat(client, new_session())
+        check("recovered: probe closes the breaker", response.status_code == 200 and flask_module.openai_breaker.state == "closed",
+              f"status {response.status_code}, breaker {flask_module.openai_breaker.state}")
+
+        # 5. RavenDB missing at startup, then reachable but hung.
+        flask_module.RAVENDB_URLS = [black_hole.url]
+        flask_module.RAVENDB_READ_TIMEOUT_SECONDS = 1.0
+        flask_module.RAVENDB_QUERY_DEADLINE_SECONDS = 0.3
+        flask_module.ravendb_breaker.reset_timeout_seconds = 60.0
+        flask_module.store_reconnect_state['next_attempt_at'] = 0.0
+        check("ravendb: lazy reconnect creates the store", flask_module.get_document_store() is not None,
+              f"store {'created' if flask_module.store is not None else 'missing'}")
+        start = time.perf_counter()
+        results = flask_module.run_context_query("true", {}, 5)
+        elapsed = time.perf_counter() - start
+        check("ravendb: hung query gives up at its deadline", results is None and elapsed < 0.5,
+              f"returned {results} after {elapsed:.2f} s")
+        statuses = [timed_chat(client, new_session())[0].status_code for _ in range(3)]
+        check("ravendb: /chat still answers without context", statuses == [200] * 3, f"{statuses.count(200)}/3 OK")
+        while flask_module.ravendb_breaker.state != "open":
+            flask_module.run_context_query("true", {}, 5)
+        start = time.perf_counter()
+        results = flask_module.run_context_query("true", {}, 5)
+        elapsed = time.perf_counter() - start
+        check("ravendb: open breaker skips the query", flask_module.ravendb_breaker.state == "open" and elapsed < 0.01,
+              f"breaker {flask_module.ravendb_breaker.state}, returned after {elapsed * 1000:.2f} ms")
+        flask_module.SEMANTIC_CACHE_ENABLED = True
+        stores_before = flask_module.answer_cache.snapshot()["stores"]
+        response, _ = timed_chat(client, new_session())
+        stored = flask_module.answer_cache.snapshot()["stores"] - stores_before
+        check("ravendb: answers without context are not cached", response.status_code == 200 and stored == 0,
+              f"status {response.status_code}, {stored} answers cached")
+
+    print(f"\n{'All checks passed.' if not failures else f'{len(failures)} check(s) failed.'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
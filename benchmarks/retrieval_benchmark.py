@@ -0,0 +1,159 @@
+"""
+Retrieval quality of vector, full-text and hybrid (RRF) ranking.
+
+A synthetic markdown corpus is chunked with rag_chunker_script.py and each
+document is seeded with a few unique configuration keys (e.g.
+`Indexing.MapBatchTimeoutInSec`). Two kinds of probes are ranked against the chunks:
+
+- identifier probes ask about one key ("How do I set X?"); a hit is a top-k
+  chunk containing the key,
+- prose probes keep half the words of a paragraph; a hit is a top-k chunk
+  holding the whole paragraph.
+
+The vector ranker uses the hashed bag-of-words embedding from fake_backends,
+the full-text ranker is a small BM25 standing in for RavenDB's search(), and
+hybrid fuses both with retrieval.reciprocal_rank_fusion. Every mode then
+trims text repeated between neighbouring chunks with
+retrieval.drop_overlapping_chunks, exactly as app.retrieve_context_chunks does.
+
+Usage:
+    python benchmarks/retrieval_benchmark.py --files 200 --file-kb 20 --probes 300
+"""
+import argparse
+import math
+import random
+import re
+import sys
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import rag_chunker_script as chunker
+from fake_backends import fake_embedding
+from markdown_chunker import iter_blocks
+from retrieval import drop_overlapping_chunks, reciprocal_rank_fusion
+from synthetic_markdown import WORDS, generate_markdown_document
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[a-z0-9]+)*")  # Keeps dotted identifiers whole, like the standard analyzer
+KEY_SUFFIXES = ["InSec", "InMb", "Enabled", "MaxCount", "Strategy"]
+
+
+def config_key(rng, used):
+    while True:
+        key = f"{rng.choice(WORDS).title()}.{rng.choice(WORDS).title()}{rng.choice(WORDS).title()}{rng.choice(KEY_SUFFIXES)}"
+        if key not in used:
+            used.add(key)
+            return key
+
+
+def build_chunks(file_count, file_kb, keys_per_file, seed, strategy="markdown"):
+    """Returns (chunks, keys) where chunks are dicts shaped like the RavenDB projection."""
+    rng = random.Random(seed)
+    used_keys, keys, chunks = set(), [], []
+    for index in range(file_count):
+        lines = generate_markdown_document(rng, f"Guide {index}", int(file_kb * 1024)).split("\n")
+        prose = [i for i, line in enumerate(lines) if line and line[0].isupper() and line.endswith(".")]
+        for line_index in rng.sample(prose, min(keys_per_file, len(prose))):
+            key = config_key(rng, used_keys)
+            lines[line_index] += f" Set `{key}` to tune this behaviour."
+            keys.append(key)
+        body = chunker.prepare_markdown_content("\n".join(lines))
+        texts = ([text for text, _ in chunker.split_markdown_sections(body)] if strategy == "markdown"
+                 else chunker.split_into_chunks(body))
+        for number, text in enumerate(texts, start=1):
+            chunks.append({"Id": f"Context/guide-{index}.md/{number}", "Content": text,
+                           "SourceFile": f"guide-{index}.md", "ChunkNumber": number})
+    return chunks, keys
+
+
+class BM25:
+    def __init__(self, texts, k1=1.2, b=0.75):
+        self.k1, self.b = k1, b
+        self.term_counts = [Counter(TOKEN_RE.findall(text.lower())) for text in texts]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.average_length = sum(self.lengths) / len(self.lengths)
+        self.postings = defaultdict(list)
+        for doc, counts in enumerate(self.term_counts):
+            for term in counts:
+                self.postings[term].append(doc)
+
+    def rank(self, query, limit):
+        scores = defaultdict(float)
+        for term in set(TOKEN_RE.findall(query.lower())):
+            docs = self.postings.get(term, [])
+            idf = math.log(1 + (len(self.term_counts) - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc in docs:
+                tf = self.term_counts[doc][term]
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc] / self.average_length)
+                scores[doc] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores, key=scores.get, reverse=True)[:limit]
+
+
+def unit_vectors(texts):
+    matrix = np.array([fake_embedding(text) for text in texts], dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def sample_probes(chunks, keys, probe_count, seed):
+    rng = random.Random(seed)
+    identifier_probes = [(key, f"How do I set {key} in RavenDB?") for key in rng.sample(keys, min(probe_count, len(keys)))]
+    passages = [block.text for chunk in chunks for block in iter_blocks(chunk["Content"].split("\n"))
+                if block.kind == "paragraph" and len(block.text.split()) >= 8]
+    prose_probes = []
+    for passage in rng.sample(passages, min(probe_count, len(passages))):
+        words = passage.split()
+        kept = sorted(rng.sample(range(len(words)), len(words) // 2))
+        prose_probes.append((passage, " ".join(words[i] for i in kept)))
+    return {"identifier": identifier_probes, "prose": prose_probes}
+
+
+def evaluate(chunks, probes, top_k, candidates, spare):
+    chunk_vectors = unit_vectors([chunk["Content"] for chunk in chunks])
+    bm25 = BM25([chunk["Content"] for chunk in chunks])
+    results = {}
+    for kind, kind_probes in probes.items():
+        query_vectors = unit_vectors([query for _, query in kind_probes])
+        hits = Counter()
+        for (needle, query), query_vector in zip(kind_probes, query_vectors):
+            vector_ranking = [chunks[i] for i in np.argsort(-(chunk_vectors @ query_vector))[:candidates]]
+            full_text_ranking = [chunks[i] for i in bm25.rank(query, candidates)]
+            rankings = {
+                "vector": drop_overlapping_chunks(vector_ranking[:top_k + spare], top_k),
+                "full-text": drop_overlapping_chunks(full_text_ranking[:top_k + spare], top_k),
+                "hybrid": drop_overlapping_chunks(reciprocal_rank_fusion([vector_ranking, full_text_ranking]), top_k),
+            }
+            for mode, ranked in rankings.items():
+                hits[mode] += any(needle in chunk["Content"] for chunk in ranked)
+        results[kind] = {mode: hits[mode] / len(kind_probes) for mode in ("vector", "full-text", "hybrid")}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=200, help="Synthetic markdown files")
+    parser.add_argument("--file-kb", type=float, default=20, help="Size of each file in KB")
+    parser.add_argument("--keys-per-file", type=int, default=3, help="Configuration keys seeded into each file")
+    parser.add_argument("--probes", type=int, default=300, help="Probes of each kind")
+    parser.add_argument("--top-k", type=int, default=5, help="Chunks retrieved per probe")
+    parser.add_argument("--candidates", type=int, default=20, help="Chunks each ranker contributes before fusion")
+    parser.add_argument("--spare", type=int, default=3, help="Extra chunks vector and full-text fetch for deduplication")
+    parser.add_argument("--chunker", choices=["markdown", "fixed"], default="markdown",
+                        help="Chunking strategy; fixed windows overlap their neighbours by CHUNK_OVERLAP characters")
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+
+    chunks, keys = build_chunks(args.files, args.file_kb, args.keys_per_file, args.seed, args.chunker)
+    probes = sample_probes(chunks, keys, args.probes, args.seed)
+    print(f"{len(chunks)} chunks from {args.files} files, hit@{args.top_k}, "
+          f"{args.candidates} candidates per ranker for hybrid\n")
+    print(f"{'probes':<12} {'vector':>9} {'full-text':>10} {'hybrid':>9}")
+    for kind, rates in evaluate(chunks, probes, args.top_k, args.candidates, args.spare).items():
+        print(f"{kind:<12} {rates['vector']:>8.1%} {rates['full-text']:>10.1%} {rates['hybrid']:>8.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Measures what the sidebar and history endpoints cost as sessions pile up.
+
+Sessions are seeded straight into the in-memory session store, then each
+endpoint is hit through the Flask test client in the modes the frontend uses:
+
+- /get_sessions: the full list versus one page of `--page-size` sessions, and
+  a revalidation of that page with If-None-Match (a 304).
+- /get_session_history: the full history versus a `since` delta of the last
+  exchange, and a revalidation with If-None-Match (a 304).
+
+Usage:
+    python benchmarks/session_listing_benchmark.py --sessions 100 1000 10000 --messages 10 100 1000
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("GRIP_SESSION_STORE", "memory")
+
+import app as flask_module
+
+MESSAGE_TEXT = "How do I create a static index that maps orders by company and sums their totals? " * 3
+
+
+def seed_sessions(count, messages_per_session):
+    flask_module.session_store.clear()
+    session_ids = []
+    for index in range(count):
+        session_id = str(uuid.uuid4())
+        flask_module.session_store.create(session_id, {
+            "history": [
+                {"role": "user" if turn % 2 == 0 else "assistant", "content": MESSAGE_TEXT}
+                for turn in range(messages_per_session)
+            ],
+            "title": f"Question about indexes #{index}",
+            "illegal_count": 0,
+            "is_locked": False,
+            "conversation_summary": ""
+        })
+        session_ids.append(session_id)
+    return session_ids
+
+
+def measure(client, url, repeat, headers=None):
+    """Returns (median latency in ms, response bytes, status code, ETag) for a GET."""
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(url, headers=headers or {})
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies), len(response.get_data()), response.status_code, response.headers.get("ETag")
+
+
+def report(label, median_ms, size, status):
+    print(f"  {label:<34} {status:>3}   {size:>11,} bytes   {median_ms:>8.2f} ms")
+
+
+def benchmark_listing(client, session_count, page_size, repeat):
+    seed_sessions(session_count, 2)
+    print(f"\n/get_sessions with {session_count:,} sessions")
+    median_ms, size, status, _ = measure(client, '/get_sessions', repeat)
+    report("full list", median_ms, size, status)
+    median_ms, size, status, etag = measure(client, f'/get_sessions?limit={page_size}', repeat)
+    report(f"first page (limit={page_size})", median_ms, size, status)
+    median_ms, size, status, _ = measure(client, f'/get_sessions?limit={page_size}', repeat, {"If-None-Match": etag})
+    report("first page, revalidated", median_ms, size, status)
+
+
+def benchmark_history(client, messages_per_session, repeat):
+    session_id = seed_sessions(1, messages_per_session)[0]
+    url = f'/get_session_history/{session_id}'
+    print(f"\n/get_session_history with {messages_per_session:,} messages")
+    median_ms, size, status, _ = measure(client, url, repeat)
+    report("full history", median_ms, size, status)
+    since = max(messages_per_session - 2, 0)
+    median_ms, size, status, etag = measure(client, f'{url}?since={since}', repeat)
+    report("delta (last exchange)", median_ms, size, status)
+    median_ms, size, status, _ = measure(client, f'{url}?since={since}', repeat, {"If-None-Match": etag})
+    report("delta, revalidated", median_ms, size, status)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[100, 1000, 10000], help="Session counts for /get_sessions")
+    parser.add_argument("--messages", type=int, nargs="+", default=[10, 100, 1000], help="History lengths for /get_session_history")
+    parser.add_argument("--page-size", type=int, default=100, help="limit used for the paged listing")
+    parser.add_argument("--repeat", type=int, default=20, help="Requests per measurement; the median is reported")
+    args = parser.parse_args()
+
+    flask_module.app.logger.setLevel(logging.WARNING)
+    client = flask_module.app.test_client()
+    for session_count in args.sessions:
+        benchmark_listing(client, session_count, args.page_size, args.repeat)
+    for messages_per_session in args.messages:
+        benchmark_history(client, messages_per_session, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Checks the session lifecycle of the in-memory session store: the resident
+size estimate, the memory cap, lazy idle expiry, history compaction, the
+RavenDB archive, pinned sessions and the compacted history seen through the
+Flask routes.
+
+Memory is measured with tracemalloc, so the estimate the store reports (and
+/metrics exposes) is compared with what the sessions really allocate. Each
+check prints PASS or FAIL and the script exits non-zero if any fails.
+
+Usage:
+    python benchmarks/session_memory_check.py --sessions 20000 --cap-mb 5
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "session-memory-check")
+os.environ.setdefault("GRIP_SESSION_STORE", "memory")
+os.environ.setdefault("GRIP_RATE_LIMITS", "off")  # Every request comes from one client address
+
+from fake_backends import FakeIngestionStore, FakeOpenAI
+from session_store import InMemorySessionStore, RavenDBSessionArchive
+
+failures = []
+quiet_logger = logging.getLogger("session-memory-check")
+quiet_logger.setLevel(logging.CRITICAL)
+
+
+def check(name, passed, detail):
+    print(f"{'PASS' if passed else 'FAIL'}  {name:<44} {detail}")
+    if not passed:
+        failures.append(name)
+
+
+def new_session():
+    return {"history": [], "title": "New Chat", "illegal_count": 0, "is_locked": False,
+            "conversation_summary": "", "summarized_count": 0, "history_offset": 0}
+
+
+def exchange(session_number, turn, answer_chars):
+    """One user/assistant pair with distinct strings, so nothing is shared between sessions."""
+    question = f"Session {session_number} question {turn}: how do I configure indexes for my collection?"
+    answer = (f"Answer {session_number}.{turn}: define a map function, deploy it and query it. " * (answer_chars // 70 + 1))[:answer_chars]
+    return [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+
+
+def fill(store, first, count, turns, answer_chars):
+    for number in range(first, first + count):
+        session_id = f"session-{number}"
+        store.create(session_id, new_session())
+        for turn in range(turns):
+            store.append_history(session_id, exchange(number, turn, answer_chars))
+
+
+def check_estimate(args):
+    store = InMemorySessionStore(logger=quiet_logger)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    fill(store, 0, args.sessions // 10, args.turns, args.answer_chars)
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    ratio = store.resident_bytes / allocated
+    check("estimate: tracks allocated session memory", 0.7 <= ratio <= 1.3,
+          f"estimated {store.resident_bytes / 1e6:.1f} MB, allocated {allocated / 1e6:.1f} MB ({ratio:.2f}x)")
+
+
+def check_cap(args):
+    cap = args.cap_mb * 1_000_000
+    uncapped = InMemorySessionStore(logger=quiet_logger)
+    start = time.perf_counter()
+    fill(uncapped, 0, args.sessions, args.turns, args.answer_chars)
+    uncapped_seconds = time.perf_counter() - start
+    uncapped_bytes = uncapped.resident_bytes
+    del uncapped
+
+    timed = InMemorySessionStore(max_memory_bytes=cap, min_resident_seconds=0, logger=quiet_logger)
+    start = time.perf_counter()
+    fill(timed, 0, args.sessions, args.turns, args.answer_chars)
+    capped_seconds = time.perf_counter() - start
+    del timed
+
+    capped = InMemorySessionStore(max_memory_bytes=cap, min_resident_seconds=0, logger=quiet_logger)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    fill(capped, 0, args.sessions, args.turns, args.answer_chars)
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    snapshot = capped.snapshot()
+    check("cap: resident estimate stays under the cap", snapshot["resident_bytes"] <= cap,
+          f"{snapshot['sessions']} of {args.sessions} sessions, {snapshot['resident_bytes'] / 1e6:.1f} MB "
+          f"(uncapped: {uncapped_bytes / 1e6:.1f} MB)")
+    check("cap: allocated memory stays near the cap", allocated <= 1.3 * cap,
+          f"{allocated / 1e6:.1f} MB allocated for a {args.cap_mb:.0f} MB cap, {snapshot['memory_evictions']} evictions")
+    operations = args.sessions * (args.turns + 1)
+    check("cap: eviction does not slow writes down", capped_seconds <= 2 * uncapped_seconds,
+          f"{capped_seconds / operations * 1e6:.1f} us per write with eviction, "
+          f"{uncapped_seconds / operations * 1e6:.1f} us without")
+
+
+def check_idle_expiry():
+    store = InMemorySessionStore(idle_ttl_seconds=0.2, logger=quiet_logger)
+    fill(store, 0, 1000, 1, 200)
+    time.sleep(0.3)
+    store.create("fresh", new_session())
+    snapshot = store.snapshot()
+    check("idle: expired sessions go on the next write", snapshot["sessions"] == 1 and snapshot["idle_evictions"] == 1000,
+          f"{snapshot['idle_evictions']} evicted, {snapshot['sessions']} resident")
+
+
+def check_compaction():
+    store = InMemorySessionStore(max_history_messages=40, logger=quiet_logger)
+    store.create("long", new_session())
+    for turn in range(500):
+        store.append_history("long", exchange(0, turn, 300))
+        total = store.get("long")['history_offset'] + len(store.get("long")['history'])
+        store.update("long", conversation_summary=f"Summary after {turn} turns.", summarized_count=total - 4)
+    session = store.get("long")
+    total = session['history_offset'] + len(session['history'])
+    check("compaction: history stays bounded", len(session['history']) <= 40 and total == 1000
+          and session['history'][-1]['content'].startswith("Answer 0.499"),
+          f"{len(session['history'])} messages resident, {session['history_offset']} compacted, {total} in total")
+
+
+def check_archive():
+    document_store = FakeIngestionStore(round_trip_latency=0)
+    archive = RavenDBSessionArchive(document_store, logger=quiet_logger)
+    store = InMemorySessionStore(max_memory_bytes=50_000, min_resident_seconds=0, archive=archive, logger=quiet_logger)
+    fill(store, 0, 50, 5, 1000)
+    snapshot = store.snapshot()
+    restored = store.get("session-0")
+    check("archive: evicted sessions are restored", restored is not None and len(restored['history']) == 10
+          and restored['history'][9]['content'].startswith("Answer 0.4"),
+          f"{snapshot['archived']} archived, session-0 restored with {len(restored['history']) if restored else 0} messages")
+    archived_before = len(document_store.documents)
+    store.delete("session-1")
+    check("archive: deleting a session removes its copy", store.get("session-1") is None
+          and len(document_store.documents) == archived_before - 1,
+          f"{archived_before} archived documents before, {len(document_store.documents)} after")
+
+    # A write (a summary fold, say) to a session evicted since it was last read restores it first.
+    fill(store, 100, 20, 5, 1000)
+    evicted = "session-2" not in store._sessions
+    store.append_history("session-2", exchange(2, 5, 100))
+    restored = store.get("session-2")
+    check("archive: writes restore evicted sessions", evicted and len(restored['history']) == 12,
+          f"evicted {evicted}, {len(restored['history'])} messages after the write")
+
+    # Evicted sessions stay listed, and a restored one keeps its place (and cursor) in the listing.
+    listed = [session_id for session_id, _, _, _ in store.list_sessions()]
+    expected = [f"session-{n}" for n in range(50) if n != 1] + [f"session-{n}" for n in range(100, 120)]
+    store.update("session-3", title="Restored")
+    after_restore = list(store.list_sessions())
+    check("archive: evicted sessions keep their listing", listed == expected
+          and [row[0] for row in after_restore] == expected and after_restore[2][1] == "Restored",
+          f"{len(listed)} of {len(expected)} listed, {len(store._sessions)} resident, "
+          f"session-3 at position {[row[0] for row in after_restore].index('session-3')} after restore")
+
+
+def check_pinned():
+    store = InMemorySessionStore(max_memory_bytes=50_000, min_resident_seconds=0, logger=quiet_logger)
+    store.create("live", new_session())
+    store.pin("live", "turn")
+    fill(store, 0, 50, 5, 1000)  # Other chats push the live one to the LRU end while its turn runs
+    resident = "live" in store._sessions
+    try:
+        store.append_history("live", exchange(0, 0, 1000))
+        error = None
+    except KeyError as e:
+        error = e
+    store.unpin("live", "turn")
+    store.unpin("live", "turn")
+    fill(store, 100, 50, 5, 1000)
+    check("pinned: turns in flight keep their session", resident and error is None and "live" not in store._sessions,
+          f"resident while pinned {resident}, write error {error!r}, evicted after unpin {'live' not in store._sessions}")
+
+
+def check_routes():
+    import app as flask_module
+
+    flask_module.app.logger.setLevel(logging.CRITICAL)
+    flask_module.openai_client = FakeOpenAI(latency=0, embedding_latency=0)
+    flask_module.store = None
+    flask_module.session_store.max_history_messages = 12
+    client = flask_module.app.test_client()
+    session_id = client.post('/new_chat').get_json()['session_id']
+    statuses = set()
+    for turn in range(20):
+        response = client.post('/chat', json={"message": f"How do I define index number {turn}?", "session_id": session_id})
+        statuses.add(response.status_code)
+        flask_module.summary_executor.submit(lambda: None).result()  # One summary worker is enough to drain a single session
+    page = client.get(f'/get_session_history/{session_id}').get_json()
+    follow_up = client.get(f"/get_session_history/{session_id}?since={page['since'] + len(page['history'])}").get_json()
+    check("routes: /chat keeps working while compacting", statuses == {200}, f"statuses {sorted(statuses)}")
+    check("routes: history reports where it starts", page['total_messages'] == 40 and page['since'] > 0
+          and page['since'] + len(page['history']) == 40 and follow_up['history'] == [],
+          f"messages {page['since']}-{page['total_messages']} returned, {page['since']} compacted")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20000, help="Sessions written in the memory cap check")
+    parser.add_argument("--turns", type=int, default=4, help="Exchanges per session")
+    parser.add_argument("--answer-chars", type=int, default=1200, help="Characters per assistant answer")
+    parser.add_argument("--cap-mb", type=float, default=5, help="Memory cap for the cap check")
+    args = parser.parse_args()
+
+    check_estimate(args)
+    check_cap(args)
+    check_idle_expiry()
+    check_compaction()
+    check_archive()
+    check_pinned()
+    check_routes()
+
+    print(f"\n{'All checks passed.' if not failures else f'{len(failures)} check(s) failed.'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
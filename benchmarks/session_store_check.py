@@ -0,0 +1,122 @@
+"""
+Checks the write paths of RavenDBSessionStore against an in-process stand-in
+for RavenDB that applies the store's patch scripts: writes to sessions that
+have dropped out of the cache, sessions pinned by a turn in flight and
+counters incremented by several workers.
+
+Each worker process is modelled as its own RavenDBSessionStore over one
+shared FakeIngestionStore. Flushing is driven by hand rather than by the
+background thread. Each check prints PASS or FAIL and the script exits
+non-zero if any fails.
+
+Usage:
+    python benchmarks/session_store_check.py
+"""
+import logging
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fake_backends import FakeIngestionStore
+from session_store import RavenDBSessionStore
+
+failures = []
+quiet_logger = logging.getLogger("session-store-check")
+quiet_logger.setLevel(logging.CRITICAL)
+
+
+def check(name, passed, detail):
+    print(f"{'PASS' if passed else 'FAIL'}  {name:<44} {detail}")
+    if not passed:
+        failures.append(name)
+
+
+def new_session():
+    return {"history": [], "title": "New Chat", "illegal_count": 0, "is_locked": False,
+            "conversation_summary": "", "summarized_count": 0, "history_offset": 0}
+
+
+def worker(document_store, **options):
+    # A flush interval of an hour keeps the background thread out of the way.
+    return RavenDBSessionStore(document_store, flush_interval_seconds=3600, logger=quiet_logger, **options)
+
+
+def exchange(turn):
+    return [{"role": "user", "content": f"Question {turn}"}, {"role": "assistant", "content": f"Answer {turn}"}]
+
+
+def check_write_after_eviction():
+    document_store = FakeIngestionStore(round_trip_latency=0)
+    store = worker(document_store, cache_ttl_seconds=0.05, max_cached_sessions=1)
+    store.create("a", new_session())
+    store.flush()
+    store.get("a")
+    time.sleep(0.1)
+    store.create("b", new_session())  # Pushes the clean, stale entry of "a" out of the cache
+    evicted = store.snapshot()["sessions"] == 1
+    try:
+        store.append_history("a", exchange(1))
+        store.update("a", title="Indexes")
+        store.flush()
+        error = None
+    except KeyError as e:
+        error = e
+    document = document_store.documents[RavenDBSessionStore.document_id("a")]
+    check("cache miss: writes load the session first", evicted and error is None
+          and len(document['History']) == 2 and document['Title'] == "Indexes",
+          f"evicted {evicted}, error {error!r}, {len(document['History'])} messages and title '{document['Title']}' stored")
+
+
+def check_pinned():
+    document_store = FakeIngestionStore(round_trip_latency=0)
+    store = worker(document_store, max_cached_sessions=1)
+    store.create("live", new_session())
+    store.flush()
+    store.pin("live", "turn")
+    store.create("other", new_session())
+    store.flush()
+    store.get("other")
+    cached_while_pinned = "live" in store._cache
+    store.unpin("live", "turn")
+    store.create("third", new_session())
+    check("pinned: turns in flight keep their session", cached_while_pinned and "live" not in store._cache,
+          f"cached while pinned {cached_while_pinned}, evicted after unpin {'live' not in store._cache}")
+
+
+def check_concurrent_increments():
+    document_store = FakeIngestionStore(round_trip_latency=0)
+    first, second = worker(document_store), worker(document_store)
+    first.create("s", new_session())
+    first.flush()
+    second.get("s")
+    counts = [first.increment("s", "illegal_count"), second.increment("s", "illegal_count"), second.increment("s", "illegal_count")]
+    first.update("s", title="Sharding")  # Makes the second worker's title update conflict
+    second.update("s", conversation_summary="Off-topic questions.")
+    first.flush()
+    second.flush()
+    document = document_store.documents[RavenDBSessionStore.document_id("s")]
+    check("increments: no worker loses a count", document['IllegalCount'] == 3
+          and document['Title'] == "Sharding" and document['ConversationSummary'] == "Off-topic questions.",
+          f"local counts {counts}, stored {document['IllegalCount']}, title '{document['Title']}'")
+
+    second.update("s", illegal_count=0)
+    second.increment("s", "illegal_count")
+    second.flush()
+    document = document_store.documents[RavenDBSessionStore.document_id("s")]
+    check("increments: a reset carries later increments", document['IllegalCount'] == 1,
+          f"stored {document['IllegalCount']} after a reset and one increment")
+
+
+def main():
+    check_write_after_eviction()
+    check_pinned()
+    check_concurrent_increments()
+
+    print(f"\n{'All checks passed.' if not failures else f'{len(failures)} check(s) failed.'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Deterministic synthetic markdown documentation for the chunker benchmarks.
+
+Documents look like the RavenDB docs the chunker ingests: front matter, nested
+headings, prose paragraphs, bullet lists and fenced code blocks.
+"""
+import random
+from pathlib import Path
+
+TOPICS = ["indexes", "queries", "sessions", "subscriptions", "counters", "attachments",
+          "revisions", "time series", "sharding", "replication", "backups", "clustering"]
+WORDS = ("document store session query index map reduce field collection database node cluster "
+         "replication etag change vector patch revision subscription attachment counter batch "
+         "client server request response cache lazy stream projection facet spatial vector search").split()
+
+
+def _sentence(rng):
+    words = rng.choices(WORDS, k=rng.randint(8, 20))
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraph(rng):
+    return " ".join(_sentence(rng) for _ in range(rng.randint(2, 6)))
+
+
+def _code_block(rng):
+    lines = [f"var {rng.choice(WORDS)}{i} = session.{rng.choice(['Load', 'Query', 'Store'])}(\"{rng.choice(WORDS)}/{i}\");"
+             for i in range(rng.randint(3, 15))]
+    return "```csharp\n" + "\n".join(lines) + "\n```"
+
+
+def _bullets(rng):
+    return "\n".join(f"- {_sentence(rng)}" for _ in range(rng.randint(2, 6)))
+
+
+def generate_markdown_document(rng, title, target_bytes):
+    """Returns one markdown document of roughly target_bytes."""
+    parts = [f"---\ntitle: {title}\ncategory: {rng.choice(TOPICS)}\n---\n", f"# {title}\n"]
+    size = sum(len(part) for part in parts)
+    section = 0
+    while size < target_bytes:
+        section += 1
+        block = [f"## {rng.choice(TOPICS).title()} {section}"]
+        for subsection in range(rng.randint(1, 3)):
+            block.append(f"### {rng.choice(WORDS).title()} {section}.{subsection + 1}")
+            for _ in range(rng.randint(1, 3)):
+                block.append(rng.choice([_paragraph, _paragraph, _code_block, _bullets])(rng))
+        text = "\n\n".join(block) + "\n\n"
+        parts.append(text)
+        size += len(text)
+    return "".join(parts)
+
+
+def write_corpus(directory, file_count, file_kb, seed=42):
+    """Writes file_count markdown files averaging file_kb kilobytes; returns their paths."""
+    rng = random.Random(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for index in range(file_count):
+        topic = TOPICS[index % len(TOPICS)]
+        path = directory / f"{topic.replace(' ', '-')}-{index:05d}.md"
+        target_bytes = int(file_kb * 1024 * rng.uniform(0.5, 1.5))
+        path.write_text(generate_markdown_document(rng, f"{topic.title()} guide {index}", target_bytes), encoding="utf-8")
+        paths.append(path)
+    return paths
@@ -0,0 +1,124 @@
+"""
+Recall and latency of the local vector index (vector_index.py) against exact
+float32 search, at growing index sizes.
+
+For each size a clustered synthetic embedding set is generated block by
+block and written three ways: a float32 matrix (the exact baseline, searched
+with the same blockwise scan) and float16 and int8 indexes built with
+VectorIndexWriter. Queries are perturbed copies of random rows. Reported per
+variant: size on disk, recall@k against the exact top-k, and p50/p99 query
+latency with the files in the page cache.
+
+Usage:
+    python benchmarks/vector_index_benchmark.py --sizes 10000 100000 1000000 --dimensions 384
+"""
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from vector_index import SEARCH_BLOCK_BYTES, LocalVectorIndex, VectorIndexWriter
+
+GENERATE_BLOCK_ROWS = 50_000
+
+
+def generate_blocks(count, dimensions, clusters, seed):
+    """Yields unit vectors scattered around `clusters` centers, like topic-grouped documentation chunks."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimensions)).astype(np.float32)
+    for start in range(0, count, GENERATE_BLOCK_ROWS):
+        rows = min(GENERATE_BLOCK_ROWS, count - start)
+        block = centers[rng.integers(0, clusters, rows)] + 0.9 * rng.standard_normal((rows, dimensions)).astype(np.float32)
+        yield start, block / np.linalg.norm(block, axis=1, keepdims=True)
+
+
+def build(directory, count, dimensions, clusters, seed):
+    exact_path = directory / "exact.f32"
+    exact = np.memmap(exact_path, dtype=np.float32, mode="w+", shape=(count, dimensions))
+    writers = {dtype: VectorIndexWriter(directory / dtype, dtype=dtype, model_id="benchmark") for dtype in ("float16", "int8")}
+    for start, block in generate_blocks(count, dimensions, clusters, seed):
+        exact[start:start + len(block)] = block
+        chunks = [{"Id": f"Context/{start + i}"} for i in range(len(block))]
+        for writer in writers.values():
+            writer.add_batch(block, chunks)
+    exact.flush()
+    for writer in writers.values():
+        writer.close()
+    return np.memmap(exact_path, dtype=np.float32, mode="r", shape=(count, dimensions))
+
+
+def exact_search(matrix, query, k):
+    """Blockwise float32 scan with the same top-k merge as LocalVectorIndex.search."""
+    block_rows = max(1, SEARCH_BLOCK_BYTES // (4 * matrix.shape[1]))
+    best_rows, best_scores = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    for start in range(0, len(matrix), block_rows):
+        scores = matrix[start:start + block_rows] @ query
+        top = np.argpartition(scores, -k)[-k:] if len(scores) > k else np.arange(len(scores))
+        best_rows = np.concatenate([best_rows, top + start])
+        best_scores = np.concatenate([best_scores, scores[top]])
+        if len(best_scores) > k:
+            keep = np.argpartition(best_scores, -k)[-k:]
+            best_rows, best_scores = best_rows[keep], best_scores[keep]
+    return [int(row) for row in best_rows[np.argsort(-best_scores)]]
+
+
+def timed(search, queries):
+    search(queries[0])  # Warm the page cache
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query))
+        latencies.append(time.perf_counter() - start)
+    return results, latencies
+
+
+def disk_mb(path):
+    paths = [path] if path.is_file() else list(path.glob("*.bin"))
+    return sum(p.stat().st_size for p in paths) / 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="Chunks per index")
+    parser.add_argument("--dimensions", type=int, default=384, help="Embedding dimensions (1536 for text-embedding-3-small)")
+    parser.add_argument("--clusters", type=int, default=200, help="Topic clusters in the synthetic embeddings")
+    parser.add_argument("--queries", type=int, default=50, help="Queries per size")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{args.dimensions} dimensions, {args.queries} queries, recall@{args.top_k} against exact float32 search\n")
+    print(f"{'chunks':>9} {'variant':<8} {'disk':>10} {'recall':>8} {'p50':>10} {'p99':>10}")
+    rng = np.random.default_rng(args.seed + 1)
+    for count in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            exact = build(directory, count, args.dimensions, args.clusters, args.seed)
+            queries = exact[rng.integers(0, count, args.queries)] + 0.05 * rng.standard_normal((args.queries, args.dimensions))
+            queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+            truth, latencies = timed(lambda query: exact_search(exact, query, args.top_k), queries)
+            variants = [("float32", directory / "exact.f32", None, latencies)]
+            for dtype in ("float16", "int8"):
+                index = LocalVectorIndex(directory / dtype)
+                found, latencies = timed(lambda query: [row for row, _ in index.search(query, args.top_k)], queries)
+                recall = statistics.mean(len(set(a) & set(b)) / args.top_k for a, b in zip(found, truth))
+                variants.append((dtype, directory / dtype, recall, latencies))
+
+            for name, path, recall, latencies in variants:
+                ordered = sorted(latencies)
+                p99 = ordered[int(0.99 * (len(ordered) - 1))]
+                recall_text = "exact" if recall is None else f"{recall:.1%}"
+                print(f"{count:>9,} {name:<8} {disk_mb(path):>7.1f} MB {recall_text:>8} "
+                      f"{statistics.median(ordered) * 1000:>7.1f} ms {p99 * 1000:>7.1f} ms")
+            del exact
+
+
+if __name__ == "__main__":
+    main()
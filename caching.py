@@ -0,0 +1,199 @@
+"""
+In-process caches used by the chat pipeline in app.py.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    Caches final answers keyed on the embedding of the standalone (enhanced)
+    question that produced them.
+
+    A lookup returns the stored answer whose question embedding has the
+    highest cosine similarity to the new one, provided it clears the
+    similarity threshold. Entries expire after `ttl_seconds` and the least
+    recently used entry is evicted once `max_entries` is reached. The whole
+    cache is dropped by `invalidate()`, e.g. when the knowledge base changes.
+    """
+
+    def __init__(self, similarity_threshold=0.92, max_entries=1000, ttl_seconds=3600):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # entry_id -> (unit embedding, answer, question, created_at)
+        self._matrix = None            # Stacked unit embeddings, rebuilt lazily after writes
+        self._matrix_ids = []
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "bypasses": 0, "stores": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _drop_expired(self, now):
+        # Entries are kept in insertion/recency order, but recency refreshes do
+        # not reset created_at, so expired entries can sit anywhere.
+        expired = [entry_id for entry_id, entry in self._entries.items() if now - entry[3] > self.ttl_seconds]
+        for entry_id in expired:
+            del self._entries[entry_id]
+        if expired:
+            self.stats["expirations"] += len(expired)
+            self._matrix = None
+
+    def lookup(self, embedding):
+        """Returns (answer, similarity) for the closest fresh entry, or (None, best_similarity)."""
+        query = self._normalize(embedding)
+        with self._lock:
+            self._drop_expired(time.monotonic())
+            if not self._entries:
+                self.stats["misses"] += 1
+                return None, 0.0
+
+            if self._matrix is None:
+                self._matrix_ids = list(self._entries.keys())
+                self._matrix = np.stack([self._entries[entry_id][0] for entry_id in self._matrix_ids])
+
+            similarities = self._matrix @ query
+            best = int(np.argmax(similarities))
+            best_similarity = float(similarities[best])
+            if best_similarity < self.similarity_threshold:
+                self.stats["misses"] += 1
+                return None, best_similarity
+
+            entry_id = self._matrix_ids[best]
+            self._entries.move_to_end(entry_id)
+            self.stats["hits"] += 1
+            return self._entries[entry_id][1], best_similarity
+
+    def store(self, embedding, answer, question=""):
+        with self._lock:
+            while len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+            self._entries[self._next_id] = (self._normalize(embedding), answer, question, time.monotonic())
+            self._next_id += 1
+            self._matrix = None
+            self.stats["stores"] += 1
+
+    def record_bypass(self):
+        with self._lock:
+            self.stats["bypasses"] += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self.stats["invalidations"] += 1
+
+    def snapshot(self):
+        """Returns the counters plus current size and hit rate."""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "entries": len(self._entries),
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0
+            }
+
+
+class CompletionResultCache:
+    """
+    Bounded memo for deterministic helper completions (legality, enhancement).
+
+    Keys combine the normalized message with the model and a prompt version,
+    so editing a prompt or switching models never serves stale results.
+    Entries are evicted least-recently-used beyond `max_entries` and ignored
+    once older than `ttl_seconds`. When `persist_path` is set, entries are
+    written through to a SQLite table and reloaded on startup.
+    """
+
+    def __init__(self, namespace, max_entries=5000, ttl_seconds=86400, persist_path=None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (value, created_at)
+        self._lock = threading.Lock()
+        self._db = None
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0}
+        if persist_path:
+            self._open_persistent_store(persist_path)
+
+    @staticmethod
+    def normalize(text):
+        return " ".join(text.split()).casefold()
+
+    @staticmethod
+    def make_key(model, prompt_version, text):
+        raw_key = f"{model}\x1f{prompt_version}\x1f{CompletionResultCache.normalize(text)}"
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+    def _open_persistent_store(self, persist_path):
+        self._db = sqlite3.connect(persist_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS completion_cache "
+            "(namespace TEXT, key TEXT, value TEXT, created_at REAL, PRIMARY KEY (namespace, key))"
+        )
+        self._db.execute(
+            "DELETE FROM completion_cache WHERE namespace = ? AND created_at < ?",
+            (self.namespace, time.time() - self.ttl_seconds)
+        )
+        rows = self._db.execute(
+            "SELECT key, value, created_at FROM completion_cache WHERE namespace = ? "
+            "ORDER BY created_at DESC LIMIT ?",
+            (self.namespace, self.max_entries)
+        ).fetchall()
+        for key, value, created_at in reversed(rows):
+            self._entries[key] = (json.loads(value), created_at)
+        self._db.commit()
+
+    def get(self, key):
+        """Returns the cached value, or None on a miss or an expired entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] > self.ttl_seconds:
+                self._delete(key)
+                self.stats["expirations"] += 1
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[0]
+
+    def set(self, key, value):
+        created_at = time.time()
+        with self._lock:
+            self._entries[key] = (value, created_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._delete(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+            self.stats["stores"] += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO completion_cache VALUES (?, ?, ?, ?)",
+                    (self.namespace, key, json.dumps(value), created_at)
+                )
+                self._db.commit()
+
+    def _delete(self, key):
+        del self._entries[key]
+        if self._db is not None:
+            self._db.execute("DELETE FROM completion_cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+            self._db.commit()
+
+    def snapshot(self):
+        """Returns the counters plus current size; every hit is one OpenAI call avoided."""
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries), "openai_calls_avoided": self.stats["hits"]}
@@ -0,0 +1,92 @@
+"""
+Pluggable embedding backends shared by rag_chunker_script.py, which stores a
+vector with every chunk at ingestion, and app.py, which embeds queries and
+searches those stored vectors.
+
+Both sides must use the same backend and model. Every backend exposes a
+`model_id` that is stored on each chunk (`EmbeddingModel`) and folded into
+its ContentHash, so switching backends re-embeds the collection on the next
+sync instead of mixing vector spaces.
+
+- "openai": the OpenAI embeddings API (text-embedding-3-small by default).
+- "sentence-transformers": a local model, `pip install sentence-transformers`.
+- "hashing": dependency-free feature hashing of words and word pairs. It is
+  deterministic and runs anywhere, but only matches shared wording, not
+  meaning; intended for offline deployments and benchmarks.
+"""
+import hashlib
+import math
+import re
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+DEFAULT_MODELS = {
+    "openai": "text-embedding-3-small",
+    "sentence-transformers": "all-MiniLM-L6-v2",
+    "hashing": "384",  # Dimensions
+}
+HASHING_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+class OpenAIEmbeddings:
+    def __init__(self, client, model=DEFAULT_MODELS["openai"]):
+        self.client = client
+        self.model = model
+        self.model_id = f"openai/{model}"
+
+    def embed(self, texts):
+        response = self.client.embeddings.create(model=self.model, input=list(texts))
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+class SentenceTransformerEmbeddings:
+    def __init__(self, model=DEFAULT_MODELS["sentence-transformers"]):
+        if SentenceTransformer is None:
+            raise RuntimeError("The sentence-transformers backend needs `pip install sentence-transformers`.")
+        self._model = SentenceTransformer(model)
+        self.model_id = f"sentence-transformers/{model}"
+
+    def embed(self, texts):
+        return self._model.encode(list(texts), normalize_embeddings=True).tolist()
+
+
+class HashingEmbeddings:
+    def __init__(self, model=DEFAULT_MODELS["hashing"]):
+        self.dimensions = int(model)
+        self.model_id = f"hashing/{self.dimensions}"
+
+    def _embed_one(self, text):
+        vector = [0.0] * self.dimensions
+        tokens = HASHING_TOKEN_RE.findall(text.lower())
+        for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dimensions] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector] if norm else vector
+
+    def embed(self, texts):
+        return [self._embed_one(text) for text in texts]
+
+
+def create_embedding_backend(name, model=None, openai_client=None):
+    """
+    Returns the backend registered under `name` with `model` (or its default).
+
+    Raises:
+        ValueError: For an unknown backend name.
+        RuntimeError: When the backend's optional dependency is missing.
+    """
+    model = model or DEFAULT_MODELS.get(name)
+    if name == "openai":
+        if openai_client is None:
+            from openai import OpenAI
+            openai_client = OpenAI()
+        return OpenAIEmbeddings(openai_client, model)
+    if name == "sentence-transformers":
+        return SentenceTransformerEmbeddings(model)
+    if name == "hashing":
+        return HashingEmbeddings(model)
+    raise ValueError(f"Unknown embedding backend '{name}'; expected one of {', '.join(DEFAULT_MODELS)}.")
@@ -0,0 +1,207 @@
+"""
+Structure-aware markdown chunking for rag_chunker_script.py.
+
+A single pass over the lines groups them into blocks (headings, paragraphs and
+fenced code blocks) and counts each block's tokens exactly once, so the cost
+is linear in the size of the file. Blocks are then packed into chunks of at
+most `chunk_tokens`:
+
+- A heading closes the current chunk once it holds `min_chunk_tokens`, so
+  chunks follow sections; smaller sections are merged with what follows.
+- Fenced code blocks are never split. One larger than `chunk_tokens` becomes
+  a chunk of its own.
+- Paragraphs larger than `chunk_tokens` are split on line boundaries, and on
+  token boundaries only when a single line is too long.
+- Overlap is adaptive: a chunk that ends at a section boundary has none, a
+  chunk cut mid-section repeats its last paragraph if that fits in
+  `max_overlap_tokens`, and code is never repeated.
+
+Every chunk records the heading path (e.g. ["Indexes", "Map Indexes"]) of the
+section it starts in.
+
+Lines are consumed lazily and chunks are yielded as soon as they are complete,
+so with `max_block_chars` set, memory stays bounded by a few blocks no matter
+how large the input is.
+"""
+import re
+from dataclasses import dataclass, field
+
+FENCE_RE = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+HEADING_RE = re.compile(r'^ {0,3}(#{1,6})\s+(.*?)(?:\s+#+)?\s*$')
+
+DEFAULT_CHUNK_TOKENS = 700       # Target upper bound for a chunk
+DEFAULT_MIN_CHUNK_TOKENS = 200   # Sections smaller than this are merged with the next one
+DEFAULT_MAX_OVERLAP_TOKENS = 100 # Largest paragraph repeated across a mid-section cut
+
+
+@dataclass
+class MarkdownChunk:
+    text: str
+    heading_path: list = field(default_factory=list)
+    tokens: int = 0
+
+
+@dataclass
+class _Block:
+    text: str
+    kind: str  # "heading", "paragraph" or "code"
+    heading_path: list
+    tokens: int = 0
+
+
+def iter_blocks(lines, max_block_chars=None):
+    """
+    Groups markdown lines into heading, paragraph and fenced code blocks.
+
+    `lines` may be any iterable of lines (with or without trailing newlines),
+    so a file can be chunked without reading it into memory first. A block
+    that grows past `max_block_chars` is emitted in parts; this is the only
+    case in which a fenced code block is split.
+    """
+    heading_path = []
+    buffer = []
+    buffered_chars = 0
+    fence = None  # Opening fence marker while inside a code block
+
+    def flush(kind):
+        nonlocal buffered_chars
+        text = "\n".join(buffer).strip("\n")
+        buffer.clear()
+        buffered_chars = 0
+        return _Block(text, kind, list(heading_path)) if text.strip() else None
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if max_block_chars and buffered_chars + len(line) > max_block_chars and buffer:
+            block = flush("code" if fence is not None else "paragraph")
+            if block:
+                yield block
+        buffered_chars += len(line) + 1
+        if fence is not None:
+            buffer.append(line)
+            stripped = line.strip()
+            # A closing fence uses the opening character at least as many times and nothing else.
+            if stripped and set(stripped) == {fence[0]} and len(stripped) >= len(fence):
+                fence = None
+                block = flush("code")
+                if block:
+                    yield block
+            continue
+
+        opening = FENCE_RE.match(line)
+        if opening:
+            block = flush("paragraph")
+            if block:
+                yield block
+            fence = opening.group(1)
+            buffer.append(line)
+            continue
+
+        heading = HEADING_RE.match(line)
+        if heading:
+            block = flush("paragraph")
+            if block:
+                yield block
+            level = len(heading.group(1))
+            heading_path = heading_path[:level - 1] + [heading.group(2)]
+            yield _Block(line.strip(), "heading", list(heading_path))
+            continue
+
+        if not line.strip():
+            block = flush("paragraph")
+            if block:
+                yield block
+            continue
+        buffer.append(line)
+
+    # An unterminated fence still forms one code block.
+    block = flush("code" if fence is not None else "paragraph")
+    if block:
+        yield block
+
+
+def _split_paragraph(block, chunk_tokens, counter):
+    """Yields pieces of an oversized paragraph, each at most chunk_tokens."""
+    piece_lines = []
+    piece_tokens = 0
+    for line in block.text.split("\n"):
+        line_tokens = counter.count(line)
+        if line_tokens > chunk_tokens:
+            if piece_lines:
+                yield _Block("\n".join(piece_lines), "paragraph", block.heading_path, piece_tokens)
+                piece_lines, piece_tokens = [], 0
+            for part in counter.split(line, chunk_tokens):
+                yield _Block(part, "paragraph", block.heading_path, counter.count(part))
+            continue
+        if piece_tokens + line_tokens > chunk_tokens and piece_lines:
+            yield _Block("\n".join(piece_lines), "paragraph", block.heading_path, piece_tokens)
+            piece_lines, piece_tokens = [], 0
+        piece_lines.append(line)
+        piece_tokens += line_tokens
+    if piece_lines:
+        yield _Block("\n".join(piece_lines), "paragraph", block.heading_path, piece_tokens)
+
+
+def iter_markdown_chunks(lines, counter, chunk_tokens=DEFAULT_CHUNK_TOKENS, min_chunk_tokens=DEFAULT_MIN_CHUNK_TOKENS,
+                         max_overlap_tokens=DEFAULT_MAX_OVERLAP_TOKENS, max_block_chars=None):
+    """
+    Yields MarkdownChunk objects for the given markdown lines.
+
+    Args:
+        lines: Iterable of markdown lines, front matter already removed.
+        counter: A prompt_assembly.TokenCounter (or anything with count/split).
+        chunk_tokens: Upper bound per chunk; only a single oversized code block exceeds it.
+        min_chunk_tokens: A heading only starts a new chunk once the current one holds this much.
+        max_overlap_tokens: Largest trailing paragraph carried over a mid-section cut.
+        max_block_chars: Optional cap on a single block, which bounds memory on huge inputs.
+    """
+    current = []
+    current_tokens = 0
+
+    def emit(blocks):
+        return MarkdownChunk("\n\n".join(block.text for block in blocks), blocks[0].heading_path,
+                             sum(block.tokens for block in blocks))
+
+    for block in iter_blocks(lines, max_block_chars):
+        block.tokens = counter.count(block.text)
+
+        if block.kind == "heading":
+            if current_tokens >= min_chunk_tokens:
+                yield emit(current)
+                current, current_tokens = [], 0
+            current.append(block)
+            current_tokens += block.tokens
+            continue
+
+        if block.tokens > chunk_tokens:
+            if block.kind == "code":
+                # Oversized code stays whole, together with any headings that introduce it.
+                if any(held.kind != "heading" for held in current):
+                    yield emit(current)
+                    current = []
+                yield emit(current + [block])
+                current, current_tokens = [], 0
+                continue
+            pieces = list(_split_paragraph(block, chunk_tokens, counter))
+        else:
+            pieces = [block]
+
+        for piece in pieces:
+            if current and current_tokens + piece.tokens > chunk_tokens:
+                # Headings at the end move on with the content they introduce.
+                carried = []
+                while current and current[-1].kind == "heading":
+                    carried.insert(0, current.pop())
+                if current:
+                    yield emit(current)
+                    last = current[-1]
+                    # Cut mid-section: repeat the closing paragraph so the next chunk keeps its lead-in.
+                    if (not carried and last.kind == "paragraph" and last.tokens <= max_overlap_tokens
+                            and last.tokens + piece.tokens <= chunk_tokens):
+                        carried = [last]
+                current, current_tokens = carried, sum(held.tokens for held in carried)
+            current.append(piece)
+            current_tokens += piece.tokens
+
+    if current and any(block.kind != "heading" for block in current):
+        yield emit(current)
@@ -0,0 +1,173 @@
+"""
+Token-budgeted assembly of the final completion prompt used by app.py.
+
+The prompt is built from five parts: the system instruction, the rolling
+conversation summary, the unsummarized history, the retrieved context chunks
+and the user's message. Each of summary, history and context has its own
+token allocation, and the whole prompt is capped by a total budget:
+
+- The system instruction and the user's message are always sent in full.
+- The summary is truncated to its allocation.
+- History is kept newest-first until its allocation is used.
+- Context chunks arrive ordered by relevance. They are added best-first; the
+  first chunk that does not fit is trimmed to the remaining space (if enough
+  is left to be useful) and every lower-ranked chunk is dropped.
+
+Tokens are counted locally with tiktoken. If the encoding cannot be loaded
+(e.g. no network access to fetch it and no TIKTOKEN_CACHE_DIR), counts fall
+back to a characters-per-token estimate.
+"""
+import logging
+from dataclasses import dataclass
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+CHARS_PER_TOKEN_ESTIMATE = 4
+MESSAGE_OVERHEAD_TOKENS = 4  # Role and separator tokens the API adds around every message
+MIN_TRIMMED_CHUNK_TOKENS = 100  # Smaller chunk remnants are dropped rather than sent
+
+
+class TokenCounter:
+    """Counts and truncates text in the tokens of a given OpenAI model."""
+
+    def __init__(self, model, logger=None):
+        self.model = model
+        self.logger = logger or logging.getLogger(__name__)
+        self._encoding = None
+        if tiktoken is None:
+            self.logger.warning("tiktoken is not installed; prompt token counts are estimated.")
+            return
+        try:
+            try:
+                self._encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self._encoding = tiktoken.get_encoding("o200k_base")  # Unknown model name: use the current default
+        except Exception as e:
+            self.logger.warning(f"Could not load the tokenizer for {model}; prompt token counts are estimated: {e}")
+
+    @property
+    def is_exact(self):
+        return self._encoding is not None
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self._encoding is None:
+            return len(text) // CHARS_PER_TOKEN_ESTIMATE + 1
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def count_message(self, message):
+        content = message['content']
+        if isinstance(content, list):
+            content = "".join(part.get('text', "") for part in content)
+        return self.count(content) + MESSAGE_OVERHEAD_TOKENS
+
+    def truncate(self, text, max_tokens):
+        """Returns the longest prefix of text that fits in max_tokens."""
+        if max_tokens <= 0:
+            return ""
+        if self._encoding is None:
+            return text[:max_tokens * CHARS_PER_TOKEN_ESTIMATE]
+        tokens = self._encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else self._encoding.decode(tokens[:max_tokens])
+
+    def split(self, text, max_tokens):
+        """Splits text into consecutive pieces of at most max_tokens, encoding it only once."""
+        if self._encoding is None:
+            step = max_tokens * CHARS_PER_TOKEN_ESTIMATE
+            return [text[start:start + step] for start in range(0, len(text), step)]
+        tokens = self._encoding.encode(text, disallowed_special=())
+        return [self._encoding.decode(tokens[start:start + max_tokens]) for start in range(0, len(tokens), max_tokens)]
+
+
+@dataclass
+class PromptBudget:
+    total_tokens: int
+    summary_tokens: int
+    history_tokens: int
+    context_tokens: int
+
+
+def _fit_history(history, budget_tokens, counter):
+    selected = []
+    used_tokens = 0
+    for message in reversed(history):
+        message_tokens = counter.count_message(message)
+        if used_tokens + message_tokens > budget_tokens:
+            break
+        selected.append(message)
+        used_tokens += message_tokens
+    selected.reverse()
+    return selected, used_tokens
+
+
+def _fit_context_chunks(chunks, budget_tokens, counter):
+    """Returns (context texts, tokens used, trimmed count) for chunks ordered best-first."""
+    texts = []
+    used_tokens = 0
+    trimmed = 0
+    for chunk in chunks:
+        content = chunk.get("Content", "")
+        if not content:
+            continue
+        prefix = f"Chunk (Title: {chunk.get('Title', 'N/A')}): "
+        text = prefix + content
+        text_tokens = counter.count(text)
+        remaining = budget_tokens - used_tokens
+        if text_tokens > remaining:
+            if remaining >= MIN_TRIMMED_CHUNK_TOKENS:
+                texts.append(prefix + counter.truncate(content, remaining - counter.count(prefix)))
+                used_tokens += remaining
+                trimmed += 1
+            break
+        texts.append(text)
+        used_tokens += text_tokens
+    return texts, used_tokens, trimmed
+
+
+def assemble_prompt(system_message, summary, history, user_message, chunks, budget, counter):
+    """
+    Builds the messages for the final completion within `budget`.
+
+    Returns:
+        A tuple of (messages, breakdown) where breakdown maps each prompt part
+        to its token count and records how many chunks were kept and trimmed.
+    """
+    messages = [system_message]
+    breakdown = {"system": counter.count_message(system_message)}
+
+    if summary:
+        summary = counter.truncate(summary, budget.summary_tokens)
+        summary_message = {"role": "system", "content": f"Previous conversation summary: {summary}"}
+        messages.append(summary_message)
+        breakdown["summary"] = counter.count_message(summary_message)
+    else:
+        breakdown["summary"] = 0
+
+    kept_history, breakdown["history"] = _fit_history(history, budget.history_tokens, counter)
+    messages.extend(kept_history)
+
+    user_message_tokens = counter.count(user_message) + MESSAGE_OVERHEAD_TOKENS
+    fixed_tokens = breakdown["system"] + breakdown["summary"] + breakdown["history"] + user_message_tokens
+    context_budget = min(budget.context_tokens, budget.total_tokens - fixed_tokens)
+    context_texts, _, trimmed = _fit_context_chunks(chunks, context_budget, counter)
+
+    context_for_llm = "\n\n".join(context_texts)
+    if context_for_llm:
+        context_for_llm = f"Relevant retrieved context chunks:\n---\n{context_for_llm}\n---"
+    else:
+        context_for_llm = "No specific relevant context was found in the knowledge base."
+    user_turn_message_parts = [{"type": "text", "text": f"{user_message}\n\n{context_for_llm}"}]
+    messages.append({"role": "user", "content": user_turn_message_parts})
+
+    # Count the final user turn as sent, so the context wrapper text is accounted for too.
+    breakdown["user"] = user_message_tokens
+    breakdown["context"] = counter.count_message(messages[-1]) - user_message_tokens
+    breakdown["total"] = sum(breakdown[part] for part in ("system", "summary", "history", "context", "user"))
+    breakdown["history_messages_kept"] = len(kept_history)
+    breakdown["chunks_kept"] = len(context_texts)
+    breakdown["chunks_trimmed"] = trimmed
+    return messages, breakdown
@@ -1,11 +1,25 @@
+import argparse
+import hashlib
+import multiprocessing
 import os
+import queue
 import re
-from pyravendb.store.document_store import DocumentStore
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack, closing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain
+from ravendb import DocumentStore, MetadataAsDictionary
 from pathlib import Path
 import frontmatter
+from embeddings import DEFAULT_MODELS, create_embedding_backend
+from markdown_chunker import iter_markdown_chunks
+from prompt_assembly import TokenCounter
+from vector_index import SUPPORTED_DTYPES, VectorIndexWriter
 
 # --- LIBRARIES TO INSTALL ---
-# pip install pyravendb python-frontmatter
+# pip install ravendb python-frontmatter openai
 
 # --- CONFIGURATION ---
 RAVEN_URL = "http://localhost:8080"
@@ -14,17 +28,72 @@ COLLECTION_NAME = "Context"
 MARKDOWN_DIR = Path.cwd() / "markdown_files" # Directory containing your .md files
 
 # --- CHUNKING PARAMETERS ---
-CHUNK_SIZE = 3000      # Updated chunk size
-CHUNK_OVERLAP = 450    # Updated, hefty overlap
+CHUNKING_STRATEGY = "markdown"  # "markdown" (sections, tokens, intact code) or "fixed" (character windows)
+CHUNK_TOKENS = 700              # Markdown strategy: upper bound per chunk
+MIN_CHUNK_TOKENS = 200          # Markdown strategy: smaller sections are merged with the next
+MAX_OVERLAP_TOKENS = 100        # Markdown strategy: largest paragraph repeated across a mid-section cut
+TOKENIZER_MODEL = "gpt-4o-mini" # Chunks are sized in the tokens of the model that reads them
+CHUNK_SIZE = 3000      # Fixed strategy: chunk size in characters
+CHUNK_OVERLAP = 450    # Fixed strategy: overlap in characters
+
+# --- INGESTION PARAMETERS ---
+INGEST_WORKERS = os.cpu_count() or 1  # Processes that read and chunk files in parallel
+FILES_PER_TASK = 16                   # Files handed to a worker at once, amortizing inter-process overhead
+PROGRESS_EVERY_FILES = 500            # How often progress is printed during a run
+DELETE_BATCH_SIZE = 512               # Stale chunk deletions sent per save_changes
+
+# --- STREAMING PARAMETERS ---
+STREAM_FILE_BYTES = 8 * 1024 * 1024  # Larger files are streamed out of a pool worker in batches instead of returned whole
+STREAM_BATCH_CHUNKS = 64             # Chunks of a streamed file sent to this process per message
+STREAM_QUEUE_BATCHES = 4             # Messages per worker that may wait for the bulk insert before workers pause
+MAX_LINE_CHARS = 64 * 1024           # Longer lines are read, and chunked, in pieces of this size
+MAX_BLOCK_CHARS = 64 * 1024          # Longer paragraphs or code blocks are emitted in parts, bounding memory
+FRONT_MATTER_MAX_LINES = 200         # Front matter still open after this many lines is treated as content
+FRONT_MATTER_BOUNDARY = re.compile(r'^-{3,}\s*$')
+BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+# --- EMBEDDING PARAMETERS ---
+# The same environment variables configure app.py, so both sides embed with one model by default.
+EMBEDDING_BACKEND = os.environ.get("GRIP_EMBEDDING_BACKEND", "openai")  # "openai", "sentence-transformers", "hashing" or "ravendb" (RavenDB embeds at query time)
+EMBEDDING_MODEL = os.environ.get("GRIP_EMBEDDING_MODEL")  # None uses the backend's default, see embeddings.DEFAULT_MODELS
+EMBEDDING_BATCH_SIZE = 32     # Added or changed chunks embedded per backend call
+EMBEDDING_MAX_TOKENS = 8000   # Longer inputs are truncated, staying under text-embedding-3-small's 8191 limit
+
+# --- LOCAL VECTOR INDEX ---
+VECTOR_INDEX_DIR = None         # e.g. Path.cwd() / "vector_index"; app.py searches it when RavenDB is unavailable
+VECTOR_INDEX_DTYPE = "int8"     # "int8" (1 byte per dimension plus a scale per chunk) or "float16" (2 bytes, slower to scan)
 
 # --- DOCUMENT CLASS DEFINITION ---
 # This class provides a clear structure for our documents, fixing the error.
 class ContextChunk:
-    def __init__(self, title=None, content=None, source_file=None, chunk_number=None):
+    def __init__(self, title=None, content=None, source_file=None, chunk_number=None, content_hash=None,
+                 heading_path=None, embedding_model=None, embedding=None):
         self.Title = title
         self.Content = content
         self.SourceFile = source_file
         self.ChunkNumber = chunk_number
+        self.ContentHash = content_hash
+        self.HeadingPath = heading_path or []
+        self.EmbeddingModel = embedding_model
+        self.Embedding = embedding
+
+def chunk_document_id(source_file: str, chunk_number) -> str:
+    """Deterministic document ID, so re-ingesting a file overwrites its chunks instead of duplicating them."""
+    return f"{COLLECTION_NAME}/{source_file}/{chunk_number}"
+
+def content_hash(title: str, content: str, heading_path: list = (), embedding_model: str = "") -> str:
+    """The embedding model is part of the hash, so switching models re-embeds every chunk once."""
+    raw = "\x1f".join([title, content, *heading_path]) + (f"\x1e{embedding_model}" if embedding_model else "")
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+_token_counter = None
+
+def get_token_counter() -> TokenCounter:
+    """One tokenizer per process, loaded on first use."""
+    global _token_counter
+    if _token_counter is None:
+        _token_counter = TokenCounter(TOKENIZER_MODEL)
+    return _token_counter
 
 def prepare_markdown_content(markdown_text: str) -> str:
     """
@@ -48,93 +117,504 @@ def prepare_markdown_content(markdown_text: str) -> str:
 
     # 2. Normalize excessive whitespace to ensure consistent chunking
     # This collapses more than two consecutive newlines into just two.
-    content = re.sub(r'\n{3,}', '\n\n', content)
+    content = BLANK_LINES_RE.sub('\n\n', content)
 
     return content.strip()
 
-def process_and_chunk_file(store: DocumentStore, md_file: Path):
+def split_into_chunks(markdown_body: str) -> list:
+    """Fixed strategy: splits the markdown text into CHUNK_SIZE windows overlapping by CHUNK_OVERLAP."""
+    chunks = []
+    start = 0
+    while start < len(markdown_body):
+        end = start + CHUNK_SIZE
+        chunk_content = markdown_body[start:end]
+        chunks.append(chunk_content)
+        start += CHUNK_SIZE - CHUNK_OVERLAP
+        if start >= len(markdown_body):
+            break
+    return chunks
+
+def split_markdown_sections(markdown_body: str) -> list:
+    """Markdown strategy: returns (text, heading_path) pairs; see markdown_chunker."""
+    chunks = iter_markdown_chunks(
+        markdown_body.split("\n"), get_token_counter(),
+        chunk_tokens=CHUNK_TOKENS, min_chunk_tokens=MIN_CHUNK_TOKENS, max_overlap_tokens=MAX_OVERLAP_TOKENS
+    )
+    return [(chunk.text, chunk.heading_path) for chunk in chunks]
+
+def _skip_front_matter(lines):
+    """Drops a leading front matter block, looking at most FRONT_MATTER_MAX_LINES ahead."""
+    held = []
+    for line in lines:
+        if not held and not line.strip():
+            continue  # Front matter may follow blank lines, as in frontmatter.loads
+        held.append(line)
+        if len(held) == 1 and not FRONT_MATTER_BOUNDARY.match(line):
+            break
+        if len(held) > 1 and FRONT_MATTER_BOUNDARY.match(line):
+            try:
+                if not frontmatter.loads("".join(held)).content.strip():
+                    held = []  # Parsed cleanly: everything held was front matter
+            except Exception:
+                pass  # Invalid front matter stays in the content, as in prepare_markdown_content
+            break
+        if len(held) > FRONT_MATTER_MAX_LINES:
+            break
+    yield from held
+    yield from lines
+
+def iter_markdown_segments(f):
     """
-    Reads, lightly cleans, and chunks a single markdown file,
-    then uploads the markdown chunks to RavenDB.
+    Streaming counterpart of prepare_markdown_content: yields pieces of the
+    cleaned markdown body which, joined, equal prepare_markdown_content(f.read()),
+    while reading at most MAX_LINE_CHARS at a time.
 
     Args:
-        store: An initialized RavenDB DocumentStore instance.
-        md_file: The path to the markdown file to process.
-
-    Returns:
-        The number of chunks successfully created and stored from the file.
+        f: A text file object opened for reading.
     """
-    print(f"\n{'='*15} Processing File: {md_file.name} {'='*15}")
-    
-    try:
-        with open(md_file, "r", encoding="utf-8") as f:
-            raw_content = f.read()
+    lines = _skip_front_matter(iter(partial(f.readline, MAX_LINE_CHARS), ""))
+    started = False
+    pending = ""  # Whitespace held back: it is dropped if the body ends here
+    out, out_chars = [], 0  # Lines are yielded in batches; per-line generators dominate the cost otherwise
+    for piece in lines:
+        if not started:
+            piece = piece.lstrip()
+            if not piece:
+                continue
+            started = True
+        body = piece.rstrip()
+        if not body:
+            pending += piece
+            continue
+        # Newline runs only span the held-back whitespace, since a piece ends at its one newline.
+        if "\n\n\n" in pending:
+            pending = BLANK_LINES_RE.sub("\n\n", pending)
+        out.append(pending)
+        out.append(body)
+        out_chars += len(pending) + len(body)
+        pending = piece[len(body):]
+        if out_chars >= MAX_LINE_CHARS:
+            yield "".join(out)
+            out, out_chars = [], 0
+    if out:
+        yield "".join(out)
+
+def iter_body_lines(segments):
+    """Regroups markdown segments into lines; a line longer than MAX_LINE_CHARS is yielded in pieces."""
+    partial_line = ""
+    for segment in segments:
+        *lines, partial_line = (partial_line + segment).split("\n")
+        yield from lines
+        while len(partial_line) > MAX_LINE_CHARS:
+            yield partial_line[:MAX_LINE_CHARS]
+            partial_line = partial_line[MAX_LINE_CHARS:]
+    if partial_line:
+        yield partial_line
 
-        if not raw_content.strip():
-            print("  - LOG: File is empty or contains only whitespace. Skipping.")
-            return 0
+def iter_fixed_windows(segments):
+    """Streaming split_into_chunks: yields the same windows while holding about one window of text."""
+    step = CHUNK_SIZE - CHUNK_OVERLAP
+    buffer = ""
+    for segment in segments:
+        buffer += segment
+        start = 0
+        # A window is final once the text after its start fills it.
+        while len(buffer) - start >= CHUNK_SIZE:
+            yield buffer[start:start + CHUNK_SIZE]
+            start += step
+        buffer = buffer[start:]
+    while buffer:
+        yield buffer[:CHUNK_SIZE]
+        buffer = buffer[step:]
 
-        # 1. Prepare the markdown content (remove front matter, etc.)
-        print("  - LOG: Preparing markdown content (preserving structure)...")
-        markdown_body = prepare_markdown_content(raw_content)
+def iter_file_chunks(f, strategy: str = CHUNKING_STRATEGY):
+    """Yields (text, heading_path) for an open markdown file without reading it whole."""
+    segments = iter_markdown_segments(f)
+    if strategy == "fixed":
+        for chunk_text in iter_fixed_windows(segments):
+            yield chunk_text, []
+        return
+    chunks = iter_markdown_chunks(
+        iter_body_lines(segments), get_token_counter(),
+        chunk_tokens=CHUNK_TOKENS, min_chunk_tokens=MIN_CHUNK_TOKENS, max_overlap_tokens=MAX_OVERLAP_TOKENS,
+        max_block_chars=MAX_BLOCK_CHARS
+    )
+    for chunk in chunks:
+        yield chunk.text, chunk.heading_path
 
-        if not markdown_body:
-            print("  - LOG: No content left after preparation. Skipping.")
-            return 0
+def iter_chunk_documents(md_file: Path, strategy: str = CHUNKING_STRATEGY, embedding_model: str = ""):
+    """
+    Reads, lightly cleans, and chunks a single markdown file, yielding each
+    ContextChunk as soon as it is complete. Memory stays at a small multiple
+    of MAX_BLOCK_CHARS however large the file is.
 
-        # 2. Split the markdown text into chunks with overlap
-        print(f"  - LOG: Splitting text into chunks (Size: {CHUNK_SIZE}, Overlap: {CHUNK_OVERLAP})...")
-        chunks = []
-        start = 0
-        while start < len(markdown_body):
-            end = start + CHUNK_SIZE
-            chunk_content = markdown_body[start:end]
-            chunks.append(chunk_content)
-            start += CHUNK_SIZE - CHUNK_OVERLAP
-            if start >= len(markdown_body):
-                break
-
-        # 3. Prepare document objects for RavenDB
-        base_title = md_file.stem.replace("_", " ").replace("-", " ").title()
-        documents_to_store = []
-        for i, chunk_text in enumerate(chunks):
+    Args:
+        md_file: The path to the markdown file to process.
+        strategy: "markdown" or "fixed", see CHUNKING_STRATEGY.
+        embedding_model: model_id of the embedding backend, "" when RavenDB embeds at query time.
+    """
+    base_title = md_file.stem.replace("_", " ").replace("-", " ").title()
+    with open(md_file, "r", encoding="utf-8") as f:
+        for i, (chunk_text, heading_path) in enumerate(iter_file_chunks(f, strategy)):
             chunk_num = i + 1
-            # Create an instance of our ContextChunk class
-            document_obj = ContextChunk(
-                title=f"{base_title} - Chunk {chunk_num}",
+            title = f"{base_title} - Chunk {chunk_num}"
+            yield ContextChunk(
+                title=title,
                 content=chunk_text,
                 source_file=md_file.name,
-                chunk_number=chunk_num
+                chunk_number=chunk_num,
+                content_hash=content_hash(title, chunk_text, heading_path, embedding_model),
+                heading_path=heading_path,
+                embedding_model=embedding_model or None
             )
-            documents_to_store.append(document_obj)
-        
-        print(f"  - LOG: Created {len(documents_to_store)} markdown chunks.")
-
-        # 4. Store all document objects in a single session
-        if documents_to_store:
-            print("  - LOG: Storing document chunks in RavenDB...")
-            with store.open_session() as session:
-                for doc_obj in documents_to_store:
-                    # Store the object. RavenDB will serialize it correctly.
-                    session.store(doc_obj)
-                    # Explicitly set the collection for the stored object
-                    session.advanced.get_metadata_for(doc_obj)["@collection"] = COLLECTION_NAME
-                session.save_changes()
-            print("  - ✅ LOG: Documents committed successfully.")
-        
-        return len(documents_to_store)
 
+def chunk_file(md_file: Path, strategy: str = CHUNKING_STRATEGY, embedding_model: str = ""):
+    """
+    Chunks a single markdown file into a list. Runs in a worker process, so it
+    only returns plain data and never touches RavenDB.
+
+    Args:
+        md_file: The path to the markdown file to process.
+        strategy: "markdown" or "fixed", see CHUNKING_STRATEGY.
+        embedding_model: See iter_chunk_documents.
+
+    Returns:
+        A tuple of (documents, bytes_read, error) where documents is a list of
+        ContextChunk objects and error is None or a description of the failure.
+    """
+    try:
+        documents = list(iter_chunk_documents(md_file, strategy, embedding_model))
+        return documents, md_file.stat().st_size, None
     except Exception as e:
-        print(f"\n  {'!'*10} CRITICAL FAILURE {'!'*10}")
-        print(f"  - ❌ FAILED to process file '{md_file.name}'.")
-        print(f"  - Error Type: {type(e).__name__}")
-        print(f"  - Error Details: {e}")
-        return 0
+        return [], 0, f"{type(e).__name__}: {e}"
+
+def chunk_files(md_files: list, strategy: str = CHUNKING_STRATEGY, embedding_model: str = "") -> list:
+    """Worker entry point: chunks a batch of files in one inter-process round trip."""
+    return [(md_file, *chunk_file(md_file, strategy, embedding_model)) for md_file in md_files]
+
+def iter_stream_messages(md_file: Path, strategy: str = CHUNKING_STRATEGY, embedding_model: str = "",
+                         batch_chunks: int = STREAM_BATCH_CHUNKS):
+    """
+    Chunks one large file like iter_chunk_documents, yielding (md_file,
+    documents, finished, error) messages of at most batch_chunks documents.
+    Only the last message has finished set; its error is None or a description
+    of the chunking failure, in which case the chunks already yielded stand.
+    """
+    documents, error = [], None
+    try:
+        for document in iter_chunk_documents(md_file, strategy, embedding_model):
+            documents.append(document)
+            if len(documents) >= batch_chunks:
+                yield md_file, documents, False, None
+                documents = []
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    yield md_file, documents, True, error
+
+_stream_queue = None  # Set in each pool worker by _init_stream_worker
+
+def _init_stream_worker(stream_queue):
+    global _stream_queue
+    _stream_queue = stream_queue
+
+def stream_file(md_file: Path, strategy: str = CHUNKING_STRATEGY, embedding_model: str = ""):
+    """Worker entry point: puts a large file's iter_stream_messages on the queue shared with ingest_files."""
+    for message in iter_stream_messages(md_file, strategy, embedding_model):
+        _stream_queue.put(message)
+
+def embedding_input(document: ContextChunk) -> str:
+    """The text embedded for a chunk: its heading path, then its content, within EMBEDDING_MAX_TOKENS."""
+    text = f"{' > '.join(document.HeadingPath)}\n\n{document.Content}" if document.HeadingPath else document.Content
+    return get_token_counter().truncate(text, EMBEDDING_MAX_TOKENS)
+
+def _file_size(md_file: Path) -> int:
+    try:
+        return md_file.stat().st_size
+    except OSError:
+        return 0  # Left to chunk_file, which reports the error
+
+def iter_file_batches(markdown_files: list, files_per_task: int):
+    for start in range(0, len(markdown_files), files_per_task):
+        yield markdown_files[start:start + files_per_task]
+
+def iter_chunked_batches(executor: ProcessPoolExecutor, chunker, batches, max_in_flight: int):
+    """
+    Yields chunk_files results in submission order while keeping at most
+    max_in_flight batches queued, so chunked files never pile up in memory
+    faster than RavenDB accepts them.
+    """
+    pending = deque()
+    for batch in batches:
+        pending.append(executor.submit(chunker, batch))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def iter_streamed_files(executor: ProcessPoolExecutor, stream_queue, streamer, md_files: list):
+    """
+    Streams each file in its own pool task and yields their messages (see
+    iter_stream_messages) as they arrive, until every file has finished. The
+    queue is bounded, so workers pause whenever the bulk insert falls behind.
+    """
+    futures = [executor.submit(streamer, md_file) for md_file in md_files]
+    remaining = len(md_files)
+    try:
+        while remaining:
+            try:
+                message = stream_queue.get(timeout=1)
+            except queue.Empty:
+                for future in futures:
+                    if future.done() and future.exception():
+                        raise future.exception()  # e.g. a worker died, so its file never finishes
+                continue
+            remaining -= message[2]
+            yield message
+    finally:
+        # Workers blocked on a full queue would otherwise never let the pool shut down.
+        for future in futures:
+            future.cancel()
+        while not all(future.done() for future in futures):
+            try:
+                stream_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+def fetch_existing_chunk_hashes(store: DocumentStore) -> dict:
+    """Streams {document_id: ContentHash} for every chunk already in the collection."""
+    with store.open_session() as session:
+        query = session.advanced.raw_query(f"from {COLLECTION_NAME} select ContentHash", dict)
+        return {result.key: (result.document or {}).get("ContentHash") for result in session.advanced.stream(query)}
+
+def delete_chunks(store: DocumentStore, document_ids: list):
+    for start in range(0, len(document_ids), DELETE_BATCH_SIZE):
+        with store.open_session() as session:
+            for document_id in document_ids[start:start + DELETE_BATCH_SIZE]:
+                session.delete(document_id)
+            session.save_changes()
+
+def ingest_files(store: DocumentStore, markdown_files: list, workers: int = INGEST_WORKERS,
+                 files_per_task: int = FILES_PER_TASK, verbose: bool = False,
+                 existing_hashes: dict = None, dry_run: bool = False, strategy: str = CHUNKING_STRATEGY,
+                 embedder=None) -> dict:
+    """
+    Chunks files in a process pool and streams chunks into RavenDB through a
+    single bulk insert, which batches documents over one connection instead
+    of paying a round trip per file. Files larger than STREAM_FILE_BYTES are
+    chunked after the others, each by one pool worker that sends its chunks
+    back in batches of STREAM_BATCH_CHUNKS as it goes, so no file is ever held
+    in memory whole and the bulk insert drains several large files at once.
+
+    With `existing_hashes` (see fetch_existing_chunk_hashes) the run is an
+    incremental sync: chunks whose ContentHash is unchanged are skipped, and
+    existing chunks no longer produced by any file (removed files, shrunken
+    content, legacy server-generated IDs) are deleted. Without it every chunk
+    is written. With `dry_run` nothing is written and the returned stats
+    describe what would change.
+
+    With an `embedder` (see embeddings.create_embedding_backend) every added
+    or changed chunk is embedded in batches of EMBEDDING_BATCH_SIZE before it
+    is written, so unchanged chunks are never re-embedded.
+
+    Args:
+        store: An initialized RavenDB DocumentStore instance.
+        markdown_files: The markdown files to ingest.
+        workers: Number of chunking processes; 1 chunks in this process.
+        files_per_task: Files sent to a worker per task.
+        verbose: Print one line per file instead of periodic progress.
+        existing_hashes: Current {document_id: ContentHash} of the collection.
+        dry_run: Only compute the changes.
+        strategy: "markdown" or "fixed", see CHUNKING_STRATEGY.
+        embedder: Embedding backend for chunk vectors, or None to store text only.
+
+    Returns:
+        A dict with files, failed_files, chunks, bytes, seconds, added, changed,
+        unchanged, deleted, embedded, embedding_seconds and changes_by_file
+        ({file: {kind: count}}).
+    """
+    stats = {"files": 0, "failed_files": 0, "chunks": 0, "bytes": 0, "seconds": 0.0,
+             "added": 0, "changed": 0, "unchanged": 0, "deleted": 0, "embedded": 0, "embedding_seconds": 0.0}
+    changes_by_file = defaultdict(lambda: defaultdict(int))
+    existing_hashes = existing_hashes if existing_hashes is not None else {}
+    produced_ids = set()
+    failed_prefixes = []
+    start_time = time.perf_counter()
+    streamed = {md_file for md_file in markdown_files if _file_size(md_file) > STREAM_FILE_BYTES}
+    large_files = [md_file for md_file in markdown_files if md_file in streamed]
+    pooled_files = [md_file for md_file in markdown_files if md_file not in streamed]
+    batches = iter_file_batches(pooled_files, files_per_task)
+    embedding_model = embedder.model_id if embedder is not None else ""
+    chunker = partial(chunk_files, strategy=strategy, embedding_model=embedding_model)
+
+    streamer = partial(stream_file, strategy=strategy, embedding_model=embedding_model)
+
+    stream_queue = multiprocessing.Queue(maxsize=workers * STREAM_QUEUE_BATCHES) if workers > 1 and large_files else None
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_stream_worker,
+                                   initargs=(stream_queue,)) if workers > 1 else None
+    try:
+        with ExitStack() as stack:
+            bulk_insert = None  # Opened on the first write, so an unchanged corpus costs no bulk insert
+            pending_writes = []  # (document, document_id) waiting for the next embedding batch
+
+            def write_documents(entries):
+                nonlocal bulk_insert
+                if embedder is not None:
+                    embedding_start = time.perf_counter()
+                    vectors = embedder.embed([embedding_input(document) for document, _ in entries])
+                    for (document, _), vector in zip(entries, vectors):
+                        document.Embedding = vector
+                    stats["embedded"] += len(entries)
+                    stats["embedding_seconds"] += time.perf_counter() - embedding_start
+                if bulk_insert is None:
+                    bulk_insert = stack.enter_context(store.bulk_insert())
+                for document, document_id in entries:
+                    bulk_insert.store(document, MetadataAsDictionary({"@collection": COLLECTION_NAME, "@id": document_id}))
+                entries.clear()
+
+            def sync_document(md_file, document):
+                document_id = chunk_document_id(document.SourceFile, document.ChunkNumber)
+                produced_ids.add(document_id)
+                if document_id not in existing_hashes:
+                    kind = "added"
+                elif existing_hashes[document_id] != document.ContentHash:
+                    kind = "changed"
+                else:
+                    stats["unchanged"] += 1
+                    return
+                stats[kind] += 1
+                changes_by_file[md_file.name][kind] += 1
+                if dry_run:
+                    return
+                pending_writes.append((document, document_id))
+                if embedder is None or len(pending_writes) >= EMBEDDING_BATCH_SIZE:
+                    write_documents(pending_writes)
+
+            def finish_file(md_file, chunk_count, bytes_read, error):
+                stats["files"] += 1
+                stats["bytes"] += bytes_read
+                stats["chunks"] += chunk_count
+                if error:
+                    # Keep whatever this file already has in RavenDB rather than deleting it.
+                    stats["failed_files"] += 1
+                    failed_prefixes.append(chunk_document_id(md_file.name, ""))
+                    print(f"  - ❌ FAILED to process file '{md_file.name}'. {error}")
+                elif verbose:
+                    print(f"  - LOG: {md_file.name}: {chunk_count} chunk(s).")
+                elif stats["files"] % PROGRESS_EVERY_FILES == 0:
+                    print(f"  - LOG: {stats['files']}/{len(markdown_files)} files, {stats['chunks']} chunks so far...")
+
+            # Workers keep chunking ahead while the bulk insert drains their results.
+            results = iter_chunked_batches(executor, chunker, batches, workers * 2) if executor else map(chunker, batches)
+            for batch_results in results:
+                for md_file, documents, bytes_read, error in batch_results:
+                    for document in documents:
+                        sync_document(md_file, document)
+                    finish_file(md_file, len(documents), bytes_read, error)
+
+            # Large files come last: a worker streaming one may wait on this loop, which must not be
+            # waiting on a small batch queued behind it. Only chunking errors fail a file.
+            if executor:
+                messages = stack.enter_context(closing(iter_streamed_files(executor, stream_queue, streamer, large_files)))
+            else:
+                messages = chain.from_iterable(iter_stream_messages(md_file, strategy, embedding_model) for md_file in large_files)
+            chunk_counts = defaultdict(int)
+            for md_file, documents, finished, error in messages:
+                for document in documents:
+                    sync_document(md_file, document)
+                chunk_counts[md_file] += len(documents)
+                if finished:
+                    # Chunks streamed before a failure stay written; the file's older chunks are kept.
+                    finish_file(md_file, chunk_counts.pop(md_file), 0 if error else _file_size(md_file), error)
+
+            if pending_writes:
+                write_documents(pending_writes)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+        if stream_queue:
+            stream_queue.close()
+
+    stale_ids = sorted(
+        document_id for document_id in existing_hashes.keys() - produced_ids
+        if not document_id.startswith(tuple(failed_prefixes))
+    )
+    for document_id in stale_ids:
+        source_file = document_id.split("/", 1)[1].rsplit("/", 1)[0] if document_id.startswith(f"{COLLECTION_NAME}/") else document_id
+        changes_by_file[source_file]["deleted"] += 1
+    stats["deleted"] = len(stale_ids)
+    if stale_ids and not dry_run:
+        delete_chunks(store, stale_ids)
+
+    stats["changes_by_file"] = {name: dict(kinds) for name, kinds in sorted(changes_by_file.items())}
+    stats["seconds"] = time.perf_counter() - start_time
+    return stats
+
+def export_vector_index(store: DocumentStore, directory: Path, model_id: str, dtype: str = VECTOR_INDEX_DTYPE) -> dict:
+    """
+    Streams every chunk embedded with `model_id` from the collection into a
+    local vector index (see vector_index.py), so the index always matches
+    RavenDB rather than only the files of the last run.
+
+    Returns:
+        A dict with exported and skipped (no vector, or another model's) counts.
+    """
+    stats = {"exported": 0, "skipped": 0}
+    fields = "Title, Content, SourceFile, ChunkNumber, EmbeddingModel, Embedding"
+    with store.open_session() as session, VectorIndexWriter(directory, dtype=dtype, model_id=model_id) as writer:
+        query = session.advanced.raw_query(f"from {COLLECTION_NAME} select {fields}", dict)
+        for result in session.advanced.stream(query):
+            document = result.document or {}
+            if document.get("EmbeddingModel") != model_id or not document.get("Embedding"):
+                stats["skipped"] += 1
+                continue
+            writer.add(document["Embedding"], {
+                "Id": result.key,
+                "Title": document.get("Title"),
+                "Content": document.get("Content"),
+                "SourceFile": document.get("SourceFile"),
+                "ChunkNumber": document.get("ChunkNumber")
+            })
+            stats["exported"] += 1
+    return stats
+
+def report_throughput(stats: dict):
+    seconds = stats["seconds"] or 1e-9
+    print(f"Chunked {stats['chunks']} chunk(s) from {stats['files']} file(s) "
+          f"({stats['bytes'] / 1_000_000:.1f} MB) in {stats['seconds']:.2f} s.")
+    print(f"Throughput: {stats['chunks'] / seconds:.1f} docs/sec, {stats['bytes'] / 1_000_000 / seconds:.2f} MB/sec.")
+    if stats["embedded"]:
+        print(f"Embedded {stats['embedded']} chunk(s) in {stats['embedding_seconds']:.2f} s.")
+
+def report_changes(stats: dict, dry_run: bool):
+    verb = "Would write" if dry_run else "Wrote"
+    for file_name, kinds in stats["changes_by_file"].items():
+        print(f"  - {file_name}: " + ", ".join(f"{count} {kind}" for kind, count in kinds.items()))
+    print(f"{verb} {stats['added']} added and {stats['changed']} changed chunk(s), "
+          f"{'would delete' if dry_run else 'deleted'} {stats['deleted']}, {stats['unchanged']} unchanged.")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Chunk markdown files and bulk insert them into RavenDB.")
+    parser.add_argument("--markdown-dir", type=Path, default=MARKDOWN_DIR, help="Directory containing .md files")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="Chunking processes (1 disables the pool)")
+    parser.add_argument("--files-per-task", type=int, default=FILES_PER_TASK, help="Files per worker task")
+    parser.add_argument("--verbose", action="store_true", help="Print one line per file")
+    parser.add_argument("--dry-run", action="store_true", help="Report what a sync would add, change and delete without writing")
+    parser.add_argument("--full", action="store_true", help="Rewrite every chunk instead of only added or changed ones")
+    parser.add_argument("--chunker", choices=["markdown", "fixed"], default=CHUNKING_STRATEGY, help="Chunking strategy")
+    parser.add_argument("--embedding-backend", choices=[*DEFAULT_MODELS, "ravendb"], default=EMBEDDING_BACKEND,
+                        help="Backend that embeds chunks; 'ravendb' stores text only and lets RavenDB embed at query time")
+    parser.add_argument("--embedding-model", default=EMBEDDING_MODEL, help="Model for the embedding backend")
+    parser.add_argument("--vector-index", type=Path, default=VECTOR_INDEX_DIR,
+                        help="Also write a local vector index of the collection to this directory")
+    parser.add_argument("--vector-index-dtype", choices=list(SUPPORTED_DTYPES), default=VECTOR_INDEX_DTYPE,
+                        help="Storage type of the local vector index")
+    return parser.parse_args()
 
 def main():
     """
     Main function to connect to RavenDB and orchestrate the processing of files.
     """
+    args = parse_args()
     print(f"Connecting to RavenDB at {RAVEN_URL}, Database: {DATABASE_NAME}")
     try:
         store = DocumentStore(urls=[RAVEN_URL], database=DATABASE_NAME)
@@ -144,30 +624,60 @@ def main():
         print(f"❌ Could not connect to RavenDB. Please check your connection settings. Error: {e}")
         return
 
-    total_chunks_uploaded = 0
-    files_processed = 0
+    embedder = None
+    if args.embedding_backend != "ravendb":
+        try:
+            embedder = create_embedding_backend(args.embedding_backend, args.embedding_model)
+            print(f"Embedding chunks with {embedder.model_id}.")
+        except Exception as e:
+            print(f"❌ Could not load the '{args.embedding_backend}' embedding backend. Error: {e}")
+            return
 
-    print(f"\nScanning for markdown files in: {MARKDOWN_DIR}")
-    if not MARKDOWN_DIR.exists() or not MARKDOWN_DIR.is_dir():
-        print(f"❌ ERROR: Directory not found: {MARKDOWN_DIR}")
+    print(f"\nScanning for markdown files in: {args.markdown_dir}")
+    if not args.markdown_dir.exists() or not args.markdown_dir.is_dir():
+        print(f"❌ ERROR: Directory not found: {args.markdown_dir}")
         return
 
-    markdown_files = list(MARKDOWN_DIR.glob("*.md")) + list(MARKDOWN_DIR.glob("*.markdown"))
-    
+    markdown_files = list(args.markdown_dir.glob("*.md")) + list(args.markdown_dir.glob("*.markdown"))
+
     if not markdown_files:
         print("  - LOG: No markdown files found in the specified directory.")
         return
-    
-    print(f"Found {len(markdown_files)} markdown file(s) to process.")
 
-    for md_file in markdown_files:
-        files_processed += 1
-        chunks_from_file = process_and_chunk_file(store, md_file)
-        total_chunks_uploaded += chunks_from_file
+    print(f"Found {len(markdown_files)} markdown file(s) to process with {args.workers} worker(s).")
+
+    try:
+        existing_hashes = fetch_existing_chunk_hashes(store)
+        print(f"  - LOG: {len(existing_hashes)} chunk(s) already in the '{COLLECTION_NAME}' collection.")
+        if args.full:
+            # Keep the IDs, so stale chunks are still deleted, but force every hash to mismatch.
+            existing_hashes = dict.fromkeys(existing_hashes)
+        stats = ingest_files(store, markdown_files, args.workers, args.files_per_task, args.verbose,
+                             existing_hashes=existing_hashes, dry_run=args.dry_run, strategy=args.chunker,
+                             embedder=embedder)
+    except Exception as e:
+        print(f"\n  {'!'*10} CRITICAL FAILURE {'!'*10}")
+        print(f"  - ❌ Sync aborted. Error Type: {type(e).__name__}")
+        print(f"  - Error Details: {e}")
+        return
+
+    print(f"\n\n--- {'Dry Run Report' if args.dry_run else 'All Files Processed'} ---")
+    print(f"Processed {stats['files']} file(s), {stats['failed_files']} failed.")
+    report_changes(stats, args.dry_run)
+    if not args.dry_run:
+        print(f"✅ '{COLLECTION_NAME}' collection is in sync with {args.markdown_dir}.")
+    report_throughput(stats)
 
-    print("\n\n--- All Files Processed ---")
-    print(f"Processed {files_processed} file(s).")
-    print(f"✅ Successfully uploaded a total of {total_chunks_uploaded} chunk(s) to the '{COLLECTION_NAME}' collection.")
+    if args.vector_index and not args.dry_run:
+        if embedder is None:
+            print("  - LOG: Skipping the local vector index: chunks have no stored embeddings with --embedding-backend ravendb.")
+            return
+        try:
+            index_stats = export_vector_index(store, args.vector_index, embedder.model_id, args.vector_index_dtype)
+            print(f"✅ Wrote {index_stats['exported']} chunk(s) to the local vector index at {args.vector_index} "
+                  f"({args.vector_index_dtype}, {index_stats['skipped']} skipped).")
+        except Exception as e:
+            print(f"❌ Could not write the local vector index. Error: {e}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,225 @@
+"""
+Deadlines, retries and circuit breaking for the outbound calls of app.py.
+
+Every OpenAI request and every RavenDB context query goes through a
+RetryPolicy bound to one CircuitBreaker per dependency:
+
+- A call gets one overall deadline. Each attempt receives the time that is
+  left as its timeout, and no retry is started that could not finish in time.
+- Transient failures (timeouts, dropped connections, 429 and 5xx answers)
+  are retried with full-jitter exponential backoff, so callers that failed
+  together do not retry in lockstep.
+- After `failure_threshold` consecutive transient failures the breaker opens
+  and calls fail immediately with CircuitOpenError instead of tying up a
+  request thread. Once `reset_timeout_seconds` has passed a single probe call
+  is let through; its outcome closes the breaker or opens it again.
+
+The RavenDB Python client sends its HTTP requests without a timeout, so a
+hung server blocks the calling thread forever. TimeoutHTTPAdapter supplies
+connect and read timeouts and sizes the connection pool for the threads that
+share the DocumentStore.
+"""
+import asyncio
+import concurrent.futures
+import random
+import threading
+import time
+
+import openai
+from requests.adapters import HTTPAdapter
+
+TRANSIENT_STATUS_CODES = {408, 409, 429}  # Plus every 5xx
+# Future.result and asyncio.wait_for raise their own TimeoutError classes before Python 3.11.
+DEADLINE_ERRORS = (TimeoutError, concurrent.futures.TimeoutError, asyncio.TimeoutError)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+    def __init__(self, name, retry_after_seconds):
+        super().__init__(f"Circuit breaker '{name}' is open; retry in {retry_after_seconds:.0f}s.")
+        self.retry_after_seconds = retry_after_seconds
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker shared by every thread and coroutine calling one dependency."""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout_seconds=30.0, logger=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_started_at = None
+        self.times_opened = 0
+        self.rejected_calls = 0
+
+    @property
+    def state(self):
+        return self._state
+
+    def retry_after_seconds(self):
+        return max(0.0, self.reset_timeout_seconds - (time.monotonic() - self._opened_at))
+
+    def before_call(self):
+        """Raises CircuitOpenError unless a call may go ahead now."""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == "open":
+                if now - self._opened_at < self.reset_timeout_seconds:
+                    self.rejected_calls += 1
+                    raise CircuitOpenError(self.name, self.retry_after_seconds())
+                self._state = "half_open"
+                self._probe_started_at = None
+            if self._state == "half_open":
+                # One probe at a time. A probe that never reported back (e.g. a
+                # cancelled coroutine) stops blocking others after the reset timeout.
+                if self._probe_started_at is not None and now - self._probe_started_at < self.reset_timeout_seconds:
+                    self.rejected_calls += 1
+                    raise CircuitOpenError(self.name, self.reset_timeout_seconds)
+                self._probe_started_at = now
+
+    def record_success(self):
+        with self._lock:
+            if self._state != "closed" and self.logger:
+                self.logger.info(f"Circuit breaker '{self.name}' closed.")
+            self._state = "closed"
+            self._consecutive_failures = 0
+            self._probe_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._state == "half_open" or (self._state == "closed" and self._consecutive_failures >= self.failure_threshold):
+                self._state = "open"
+                self._opened_at = time.monotonic()
+                self._probe_started_at = None
+                self.times_opened += 1
+                if self.logger:
+                    self.logger.warning(f"Circuit breaker '{self.name}' opened after {self._consecutive_failures} "
+                                        f"consecutive failures; failing fast for {self.reset_timeout_seconds:.0f}s.")
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._consecutive_failures,
+                "times_opened": self.times_opened,
+                "rejected_calls": self.rejected_calls
+            }
+
+
+class RetryPolicy:
+    """
+    Runs an operation with retries under one deadline and a circuit breaker.
+
+    `operation` is called with the seconds left before the deadline, to be
+    used as that attempt's timeout. `is_transient(error)` decides whether an
+    error is retried and counted against the breaker; any other error means
+    the dependency answered, and is raised at once.
+    """
+
+    def __init__(self, breaker, attempts=3, base_delay_seconds=0.25, max_delay_seconds=4.0,
+                 is_transient=None, logger=None):
+        self.breaker = breaker
+        self.attempts = attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.is_transient = is_transient or (lambda error: True)
+        self.logger = logger
+        self.retries = 0
+
+    def _start_attempt(self, deadline, description):
+        """Checks the breaker and returns the timeout for the next attempt."""
+        self.breaker.before_call()
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"{description} exceeded its deadline.")
+        return remaining
+
+    def _retry_delay(self, error, attempt, deadline, description):
+        """Records a failed attempt and returns the backoff before the next one, or None to give up."""
+        if not self.is_transient(error):
+            self.breaker.record_success()
+            return None
+        self.breaker.record_failure()
+        delay = random.uniform(0, min(self.max_delay_seconds, self.base_delay_seconds * 2 ** (attempt - 1)))
+        if attempt >= self.attempts or time.monotonic() + delay >= deadline:
+            return None
+        self.retries += 1
+        if self.logger:
+            self.logger.warning(f"{description} failed ({type(error).__name__}: {error}); "
+                                f"retry {attempt}/{self.attempts - 1} in {delay * 1000:.0f} ms.")
+        return delay
+
+    def call(self, operation, deadline_seconds, description="Call"):
+        deadline = time.monotonic() + deadline_seconds
+        for attempt in range(1, self.attempts + 1):
+            timeout = self._start_attempt(deadline, description)
+            try:
+                result = operation(timeout)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, deadline, description)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def call_async(self, operation, deadline_seconds, description="Call"):
+        """Like call(), for an `operation` that returns an awaitable."""
+        deadline = time.monotonic() + deadline_seconds
+        for attempt in range(1, self.attempts + 1):
+            timeout = self._start_attempt(deadline, description)
+            try:
+                result = await asyncio.wait_for(operation(timeout), timeout)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, deadline, description)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+
+def call_with_deadline(executor, func, timeout):
+    """
+    Runs func() on `executor` and waits at most `timeout` seconds for it.
+
+    Used for blocking clients that cannot be given a deadline themselves: the
+    caller is released on time, while the abandoned call finishes (or hits its
+    socket timeout) on the executor thread.
+    """
+    future = executor.submit(func)
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()  # Still queued behind other stuck calls; never start it
+        raise
+
+
+def is_transient_openai_error(error):
+    """Timeouts, connection failures, rate limits and server errors are worth retrying; bad requests are not."""
+    if isinstance(error, (openai.APIConnectionError, ConnectionError, *DEADLINE_ERRORS)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in TRANSIENT_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """requests adapter that applies default (connect, read) timeouts to every request sent through it."""
+
+    def __init__(self, connect_timeout_seconds, read_timeout_seconds, pool_size):
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.timeout = (connect_timeout_seconds, read_timeout_seconds)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
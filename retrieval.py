@@ -0,0 +1,132 @@
+"""
+Result fusion for hybrid retrieval in app.py.
+
+Hybrid retrieval runs a RavenDB full-text `search()` query and the vector
+query side by side. Full-text search finds exact identifiers (configuration
+keys, API names, error codes) that embeddings tend to blur, while the vector
+query finds paraphrases. The two rankings are merged with reciprocal rank
+fusion, which only uses ranks, so BM25 scores and cosine similarities never
+need to be put on a common scale.
+
+Neighbouring chunks of one file share their overlap (a repeated paragraph,
+or the fixed strategy's overlapping characters). Whatever the ranking, the
+text a chunk repeats from a selected neighbour in the same `SourceFile` is
+measured and trimmed away, so the prompt never carries it twice; only a
+chunk left with almost nothing new is dropped and its slot goes to other
+material.
+"""
+
+RRF_K = 60  # Standard damping constant; larger values flatten the gap between top ranks
+MIN_NEW_TEXT_FRACTION = 0.2  # A chunk repeating more than the rest of its text from selected neighbours is dropped
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Fuses ranked lists of chunks into one list, best first.
+
+    A chunk scores sum(1 / (k + rank)) over the lists it appears in (rank
+    starts at 1), so chunks found by both rankers rise above chunks found by
+    one. Chunks are matched on `Id`; ties keep the order of first appearance.
+    Each returned chunk is the first copy seen, with its fused score under
+    `FusionScore`.
+    """
+    scores = {}
+    chunks = {}
+    for ranking in rankings:
+        for rank, chunk in enumerate(ranking, start=1):
+            chunk_id = chunk.get('Id')
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+            chunks.setdefault(chunk_id, chunk)
+    ordered = sorted(scores, key=scores.get, reverse=True)  # sorted() is stable, so ties keep first-seen order
+    return [{**chunks[chunk_id], 'FusionScore': scores[chunk_id]} for chunk_id in ordered]
+
+
+def shared_boundary_length(earlier, later):
+    """Returns the length of the longest start of `later` that is also the end of `earlier`: the text `later` repeats."""
+    if not earlier or not later:
+        return 0
+    # KMP prefix function over later + separator + the tail of earlier, linear in their lengths.
+    text = later + "\x00" + earlier[-len(later):]
+    prefix = [0] * len(text)
+    for i in range(1, len(text)):
+        length = prefix[i - 1]
+        while length and text[i] != text[length]:
+            length = prefix[length - 1]
+        if text[i] == text[length]:
+            length += 1
+        prefix[i] = length
+    return prefix[-1]
+
+
+def drop_overlapping_chunks(chunks, limit, min_new_text_fraction=MIN_NEW_TEXT_FRACTION):
+    """
+    Returns the first `limit` chunks in their given order without repeated text.
+
+    A chunk next to one already selected from the same SourceFile (by
+    ChunkNumber) is merged into that chunk's context block, minus the text
+    the two share at their boundary, so a passage cut between them reads
+    whole again. A block keeps the rank, Id and ChunkNumber of its first
+    selected chunk and uses one slot per chunk in it. A chunk that would add
+    less than `min_new_text_fraction` of its Content is skipped. Chunks
+    missing either field (e.g. ingested before chunk numbers existed) are
+    only deduplicated by Id.
+    """
+    blocks = []  # Context blocks in rank order: {"chunk", "parts", "first", "last"}
+    block_at = {}  # (SourceFile, ChunkNumber) -> block holding that chunk
+    seen_ids = set()
+    used = 0
+    for chunk in chunks:
+        if used >= limit:
+            break
+        chunk_id = chunk.get('Id')
+        if chunk_id is not None and chunk_id in seen_ids:
+            continue
+        source_file, chunk_number = chunk.get('SourceFile'), chunk.get('ChunkNumber')
+        positioned = source_file is not None and isinstance(chunk_number, int)
+        if positioned and (source_file, chunk_number) in block_at:
+            continue
+        content = chunk.get('Content') or ""
+        previous = block_at.get((source_file, chunk_number - 1)) if positioned else None
+        following = block_at.get((source_file, chunk_number + 1)) if positioned else None
+        lead = shared_boundary_length(previous["last"], content) if previous else 0
+        tail = shared_boundary_length(content, following["first"]) if following else 0
+        if len(content) - lead - tail < min_new_text_fraction * len(content):
+            continue
+        seen_ids.add(chunk_id)
+        used += 1
+
+        # Neighbours without shared text are still separate passages.
+        new_text = ("" if previous is None or lead else "\n\n") + content[lead:len(content) - tail] \
+            + ("" if following is None or tail else "\n\n")
+        if previous is None and following is None:
+            block = {"chunk": chunk, "parts": [content], "first": content, "last": content}
+            blocks.append(block)
+        elif following is None:
+            block = previous
+            block["parts"].append(new_text)
+            block["last"] = content
+        elif previous is None:
+            block = following
+            block["parts"].insert(0, new_text)
+            block["first"] = content
+        else:
+            # The chunk closes the gap between two blocks; they become one at the better rank of the two.
+            block = previous
+            block["parts"] += [new_text, *following["parts"]]
+            block["last"] = following["last"]
+            previous_index = next(i for i, held in enumerate(blocks) if held is previous)
+            following_index = next(i for i, held in enumerate(blocks) if held is following)
+            if following_index < previous_index:
+                block["chunk"] = following["chunk"]
+                blocks[following_index] = block
+                del blocks[previous_index]
+            else:
+                del blocks[following_index]
+            for position, holder in block_at.items():
+                if holder is following:
+                    block_at[position] = block
+        if positioned:
+            block_at[(source_file, chunk_number)] = block
+
+    return [{**block["chunk"], 'Content': "".join(block["parts"])} if len(block["parts"]) > 1 else block["chunk"]
+            for block in blocks]
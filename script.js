@@ -18,6 +18,13 @@ document.addEventListener('DOMContentLoaded', () => {
     let isTyping = false;
     let animationFrameId;
 
+    const SESSIONS_PAGE_SIZE = 100;
+    // Per-session copy of the history already received, so revisiting a session
+    // only asks the server for messages after the ones we have.
+    const sessionHistoryCache = new Map();
+    // Sidebar pages keyed by cursor, reused when the server answers 304.
+    const sessionPageCache = new Map();
+
     sidebarToggleBtn.addEventListener('click', (e) => {
         e.stopPropagation();
         sidebar.classList.toggle('collapsed');
@@ -69,10 +76,34 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- Session Management ---
+    async function fetchSessionPage(cursor) {
+        const cached = sessionPageCache.get(cursor);
+        const params = new URLSearchParams({ limit: SESSIONS_PAGE_SIZE });
+        if (cursor) params.set('cursor', cursor);
+        const response = await fetch(`http://127.0.0.1:5001/get_sessions?${params}`, {
+            headers: cached ? { 'If-None-Match': cached.etag } : {}
+        });
+        if (response.status === 304 && cached) return cached.page;
+        if (!response.ok) throw new Error(`Server responded with status: ${response.status}`);
+        const page = await response.json();
+        sessionPageCache.set(cursor, { etag: response.headers.get('ETag'), page });
+        return page;
+    }
+
+    async function fetchAllSessions() {
+        const sessions = [];
+        let cursor = '';
+        do {
+            const page = await fetchSessionPage(cursor);
+            sessions.push(...page.sessions);
+            cursor = page.next_cursor;
+        } while (cursor);
+        return sessions;
+    }
+
     async function loadSessions() {
         try {
-            const response = await fetch('http://127.0.0.1:5001/get_sessions');
-            const sessions = await response.json();
+            const sessions = await fetchAllSessions();
             sidebarNav.innerHTML = '';
 
             if (sessions.length === 0) {
@@ -140,6 +171,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 method: 'DELETE'
             });
             if (response.ok) {
+                sessionHistoryCache.delete(sessionId);
                 if (sessionId === currentSessionId) {
                     messagesDisplay.innerHTML = '';
                     setInitialGreeting();
@@ -170,6 +202,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 method: 'POST'
             });
             if (response.ok) {
+                sessionHistoryCache.clear();
+                sessionPageCache.clear();
                 messagesDisplay.innerHTML = '';
                 setInitialGreeting();
                 userInput.value = '';
@@ -194,8 +228,15 @@ document.addEventListener('DOMContentLoaded', () => {
         messagesDisplay.innerHTML = '';
 
         try {
-            const response = await fetch(`http://127.0.0.1:5001/get_session_history/${sessionId}`);
+            const cached = sessionHistoryCache.get(sessionId) || { messages: [], nextIndex: 0, isLocked: false, etags: new Map() };
+            // An ETag only validates the URL it came from: the `since=0` ETag never matches the `since=nextIndex` response.
+            const url = `http://127.0.0.1:5001/get_session_history/${sessionId}?since=${cached.nextIndex}`;
+            const etag = cached.etags.get(url);
+            const response = await fetch(url, {
+                headers: etag ? { 'If-None-Match': etag } : {}
+            });
             if (response.status === 404) {
+                sessionHistoryCache.delete(sessionId);
                 currentSessionId = null;
                 localStorage.removeItem('currentSessionId');
                 messagesDisplay.innerHTML = '';
@@ -203,11 +244,22 @@ document.addEventListener('DOMContentLoaded', () => {
                 updateActiveSessionLink();
                 return;
             }
-            if (!response.ok) throw new Error(`Server responded with status: ${response.status}`);
+            if (response.status !== 304) {
+                if (!response.ok) throw new Error(`Server responded with status: ${response.status}`);
+                const data = await response.json();
+                cached.messages.push(...data.history);
+                // Compacted sessions start past 0, so the next request continues from the server's index.
+                cached.nextIndex = data.since + data.history.length;
+                cached.isLocked = data.is_locked;
+                cached.etags.clear();
+                const nextUrl = `http://127.0.0.1:5001/get_session_history/${sessionId}?since=${cached.nextIndex}`;
+                // An empty delta is exactly what the next visit asks for, so its ETag can be revalidated.
+                if (nextUrl === url) cached.etags.set(url, response.headers.get('ETag'));
+                sessionHistoryCache.set(sessionId, cached);
+            }
 
-            const data = await response.json();
-            const history = data.history;
-            const isLocked = data.is_locked;
+            const history = cached.messages;
+            const isLocked = cached.isLocked;
 
             updateInputState(isLocked);
 
@@ -342,6 +394,68 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    function parseSseFrame(frame) {
+        let eventName = 'message';
+        const dataLines = [];
+        frame.split('\n').forEach(line => {
+            if (line.startsWith('event:')) eventName = line.slice(6).trim();
+            else if (line.startsWith('data:')) dataLines.push(line.slice(5).trimStart());
+        });
+        return { eventName, data: dataLines.length ? JSON.parse(dataLines.join('\n')) : null };
+    }
+
+    async function renderStreamedReply(response, contentContainer) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let replyText = '';
+        let renderPending = false;
+
+        // Re-parsing markdown on every token is wasteful, so renders are batched per frame.
+        const scheduleRender = () => {
+            if (renderPending) return;
+            renderPending = true;
+            animationFrameId = requestAnimationFrame(() => {
+                renderPending = false;
+                contentContainer.innerHTML = marked.parse(replyText, { gfm: true, breaks: true, smartypants: false });
+                messagesWrapper.scrollTop = messagesWrapper.scrollHeight;
+            });
+        };
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const { eventName, data } = parseSseFrame(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+
+                if (eventName === 'token') {
+                    replyText += data.text;
+                    scheduleRender();
+                } else if (eventName === 'done') {
+                    cancelAnimationFrame(animationFrameId);
+                    contentContainer.innerHTML = marked.parse(data.reply, { gfm: true, breaks: true, smartypants: false });
+                    messagesWrapper.scrollTop = messagesWrapper.scrollHeight;
+                    return data.reply;
+                } else if (eventName === 'error') {
+                    throw new Error(data.error);
+                }
+            }
+        }
+        throw new Error('Stream ended unexpectedly');
+    }
+
+    function markHistoryStale(sessionId) {
+        const cached = sessionHistoryCache.get(sessionId);
+        if (!cached) return;
+        // The server may have stored more than this exchange (another tab, a coalesced retry), so nothing is
+        // counted locally: the next visit fetches whatever follows the last index the server reported.
+        cached.etags.clear();
+    }
+
     async function fetchBotResponse(userMessage, isFirstMessage) {
         const botMessageElement = appendMessage('', 'bot-message');
         const contentContainer = botMessageElement.querySelector('.message-content');
@@ -349,11 +463,20 @@ document.addEventListener('DOMContentLoaded', () => {
         messagesWrapper.scrollTop = messagesWrapper.scrollHeight;
 
         try {
-            const response = await fetch('http://127.0.0.1:5001/chat', {
+            const response = await fetch('http://127.0.0.1:5001/chat/stream', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
                 body: JSON.stringify({ message: userMessage, session_id: currentSessionId }),
             });
+
+            const contentType = response.headers.get('Content-Type') || '';
+            if (response.ok && contentType.includes('text/event-stream')) {
+                await renderStreamedReply(response, contentContainer);
+                markHistoryStale(currentSessionId);
+                if (isFirstMessage) await loadSessions();
+                return;
+            }
+
             const data = await response.json();
 
             if (response.status === 423) {
@@ -373,6 +496,7 @@ document.addEventListener('DOMContentLoaded', () => {
             } else {
                 contentContainer.innerHTML = '';
                 await typeWriter(contentContainer, data.reply);
+                markHistoryStale(currentSessionId);
 
                 if (isFirstMessage) await loadSessions();
             }
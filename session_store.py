@@ -0,0 +1,899 @@
+"""
+Chat session storage backends for app.py.
+
+InMemorySessionStore keeps sessions in the process. Its memory is bounded by
+an idle TTL, a cap on estimated resident bytes (least recently used sessions
+go first) and compaction of history already folded into the summary; evicted
+sessions can be archived to RavenDB and are restored from there on access.
+RavenDBSessionStore persists every session as a document in the ChatSessions
+collection so several worker processes can serve the same sessions and a
+restart loses nothing:
+
+- Reads go through an in-process cache; entries without pending writes are
+  reloaded once they are older than `cache_ttl_seconds`.
+- Writes are write-behind: they update the cache immediately and a background
+  thread flushes them every `flush_interval_seconds` in a single batch.
+- History is appended with a server-side patch (`History.push`), so a turn
+  never rewrites the whole document and concurrent appends cannot be lost.
+- Scalar fields (title, lock, summary) are written with optimistic
+  concurrency on a `Revision` counter. On a conflict the document is
+  reloaded, the local field changes are re-applied on top and retried.
+- Counters (the illegal count) changed through `increment` are sent as
+  server-side increments, so concurrent workers never lose one.
+- A write to a session that has dropped out of the cache loads it first.
+- Sessions pinned by a chat turn in flight are never evicted from the cache.
+- Listing pages through a static index instead of scanning every document.
+
+Both stores expose the same methods and hand out session dicts shaped like
+{"history", "title", "illegal_count", "is_locked", "conversation_summary",
+"summarized_count", "history_offset"}. `summarized_count` is how many leading
+messages are already folded into the summary and `history_offset` how many of
+those were compacted away: `history[0]` is message number `history_offset`.
+Callers must mutate sessions only through `update`, `increment` and `append_history`.
+A store may replace a session's dict (on reload or compaction), so a dict
+handed out earlier stays a consistent, possibly stale, snapshot.
+"""
+import atexit
+import logging
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from ravendb import AbstractIndexCreationTask, DeleteByQueryOperation, PatchCommandData, PatchRequest
+
+SESSION_COLLECTION_NAME = "ChatSessions"
+
+# Session dict keys and the document properties they are persisted as.
+SESSION_FIELDS = {
+    "title": "Title",
+    "illegal_count": "IllegalCount",
+    "is_locked": "IsLocked",
+    "conversation_summary": "ConversationSummary",
+    "summarized_count": "SummarizedCount",
+    "history_offset": "HistoryOffset",
+}
+
+SESSION_BASE_BYTES = 1200            # Estimated size of a session dict with empty history
+SESSION_MESSAGE_OVERHEAD_BYTES = 240  # Per history message: its dict, list slot and string header
+
+APPEND_HISTORY_SCRIPT = """
+this.History = this.History || [];
+for (var i = 0; i < args.messages.length; i++) {
+    this.History.push(args.messages[i]);
+}
+this.UpdatedAt = args.updatedAt;
+"""
+
+UPDATE_FIELDS_SCRIPT = """
+if ((this.Revision || 0) !== args.expectedRevision) {
+    throw 'RevisionConflict';
+}
+for (var field in args.fields) {
+    this[field] = args.fields[field];
+}
+this.Revision = args.expectedRevision + 1;
+this.UpdatedAt = args.updatedAt;
+"""
+
+INCREMENT_FIELDS_SCRIPT = """
+for (var field in args.increments) {
+    this[field] = (this[field] || 0) + args.increments[field];
+}
+this.UpdatedAt = args.updatedAt;
+"""
+
+
+def estimate_message_bytes(messages):
+    """Approximate resident bytes of history messages; counts characters, not encoded bytes."""
+    return sum(SESSION_MESSAGE_OVERHEAD_BYTES + len(message.get('content') or "") for message in messages)
+
+
+def estimate_session_bytes(session_data):
+    return (SESSION_BASE_BYTES + len(session_data.get('title') or "") + len(session_data.get('conversation_summary') or "")
+            + estimate_message_bytes(session_data['history']))
+
+
+def _resized_by(session_data, fields):
+    """Change in estimated bytes when `fields` are written over `session_data`."""
+    return sum(len(fields[field] or "") - len(session_data.get(field) or "")
+               for field in ("title", "conversation_summary") if field in fields)
+
+
+class ChatSessionDocument:
+    def __init__(self, title="New Chat", illegal_count=0, is_locked=False, conversation_summary="",
+                 summarized_count=0, history=None, created_at=None, updated_at=None, revision=0, history_offset=0):
+        self.Title = title
+        self.IllegalCount = illegal_count
+        self.IsLocked = is_locked
+        self.ConversationSummary = conversation_summary
+        self.SummarizedCount = summarized_count
+        self.HistoryOffset = history_offset
+        self.History = history or []
+        self.CreatedAt = created_at
+        self.UpdatedAt = updated_at
+        self.Revision = revision
+
+
+class ChatSessions_ByCreatedAt(AbstractIndexCreationTask):
+    """Index used to page through sessions for the sidebar in creation order."""
+
+    def __init__(self):
+        super().__init__()
+        self.map = (
+            f"from s in docs.{SESSION_COLLECTION_NAME} "
+            "select new { s.CreatedAt, s.Title, s.IsLocked }"
+        )
+
+
+class InMemorySessionStore:
+    """
+    Process-local session store with a bounded footprint.
+
+    Sessions are kept in least-recently-used order, so eviction only ever
+    looks at the front of the dict: sessions idle for longer than
+    `idle_ttl_seconds` are dropped when the store is next used, and while the
+    estimated resident bytes exceed `max_memory_bytes` the least recently used
+    session goes, unless it was used within `min_resident_seconds` (then every
+    session is, and the cap is exceeded rather than evicting a live chat).
+    Sessions pinned with `pin` (a chat turn is in flight) are never evicted.
+    Once a history holds more than `max_history_messages`, messages already
+    folded into the summary are compacted away. Without an `archive`, evicted
+    sessions are gone; with one they are saved there and restored on their
+    next access, including by a write. Archived sessions stay listed: their
+    title, lock and creation order are kept, a few hundred bytes each.
+    """
+
+    def __init__(self, idle_ttl_seconds=None, max_memory_bytes=None, max_history_messages=None, min_resident_seconds=60.0,
+                 archive=None, logger=None):
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.min_resident_seconds = min_resident_seconds
+        self.max_history_messages = max_history_messages
+        self.archive = archive
+        self.logger = logger or logging.getLogger(__name__)
+        self._sessions = OrderedDict()  # session_id -> session dict, least recently used first
+        self._last_used = {}  # session_id -> time.monotonic() of the last access
+        self._sizes = {}  # session_id -> estimated resident bytes
+        self._created_seq = {}  # session_id -> creation sequence number, used as the listing cursor
+        self._listed_seqs = []  # Creation sequence numbers of listed sessions, ascending, so a page is a bisect and a slice
+        self._listed_ids = []  # Session IDs in the same order as _listed_seqs
+        self._archived_rows = {}  # session_id -> (title, is_locked) of a listed session evicted to the archive
+        self._archiving = {}  # session_id -> evicted session dict still being written to the archive
+        self._pinned = {}  # session_id -> set of owners (chat turns in flight) keeping it resident
+        self._next_seq = 0
+        self.resident_bytes = 0
+        self.stats = {"idle_evictions": 0, "memory_evictions": 0, "compacted_messages": 0, "archived": 0, "restored": 0}
+        self._lock = threading.Lock()
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _add(self, session_id, session_data):
+        self._sessions[session_id] = session_data
+        self._last_used[session_id] = time.monotonic()
+        self._sizes[session_id] = estimate_session_bytes(session_data)
+        self.resident_bytes += self._sizes[session_id]
+        # A restored session keeps its place in the listing.
+        if self._archived_rows.pop(session_id, None) is None:
+            self._created_seq[session_id] = self._next_seq
+            self._listed_seqs.append(self._next_seq)
+            self._listed_ids.append(session_id)
+            self._next_seq += 1
+
+    def _remove(self, session_id, archived=False):
+        """Drops a resident session; an `archived` one keeps its listing row until it is restored or deleted."""
+        self._last_used.pop(session_id, None)
+        self.resident_bytes -= self._sizes.pop(session_id, 0)
+        session_data = self._sessions.pop(session_id, None)
+        if archived and session_data is not None:
+            self._archived_rows[session_id] = (session_data.get('title', 'New Chat'), session_data.get('is_locked', False))
+        else:
+            self._unlist(session_id)
+        return session_data
+
+    def _unlist(self, session_id):
+        self._archived_rows.pop(session_id, None)
+        seq = self._created_seq.pop(session_id, None)
+        if seq is not None:
+            index = bisect_left(self._listed_seqs, seq)
+            del self._listed_seqs[index]
+            del self._listed_ids[index]
+
+    def _touch(self, session_id):
+        self._sessions.move_to_end(session_id)
+        self._last_used[session_id] = time.monotonic()
+
+    def _resize(self, session_id, delta):
+        self._sizes[session_id] += delta
+        self.resident_bytes += delta
+
+    def _take_evictions(self):
+        """Detaches idle and over-budget sessions from the front of the LRU order; never the most recent one."""
+        evicted = []
+        skipped = set()
+        now = time.monotonic()
+        while len(self._sessions) > 1:
+            session_id = next(iter(self._sessions))
+            if session_id in self._pinned:
+                if session_id in skipped:
+                    break  # Only pinned sessions are left to look at
+                # In use by a turn in flight: as recent as a session gets.
+                skipped.add(session_id)
+                self._touch(session_id)
+                continue
+            idle_seconds = now - self._last_used[session_id]
+            if self.idle_ttl_seconds is not None and idle_seconds > self.idle_ttl_seconds:
+                reason = "idle"
+            elif (self.max_memory_bytes is not None and self.resident_bytes > self.max_memory_bytes
+                  and idle_seconds > self.min_resident_seconds):
+                reason = "memory"
+            else:
+                break
+            self.stats[f"{reason}_evictions"] += 1
+            session_data = self._remove(session_id, archived=self.archive is not None)
+            if self.archive is not None:
+                self._archiving[session_id] = session_data
+            evicted.append((session_id, session_data))
+        return evicted
+
+    def _compact(self, session_id):
+        """Drops summarized messages beyond `max_history_messages`, swapping in a new dict so readers keep a consistent view."""
+        session_data = self._sessions[session_id]
+        history = session_data['history']
+        if self.max_history_messages is None or len(history) <= self.max_history_messages:
+            return
+        offset = session_data.get('history_offset', 0)
+        drop = min(len(history) - self.max_history_messages, session_data.get('summarized_count', 0) - offset)
+        if drop <= 0:
+            return
+        self._sessions[session_id] = {**session_data, 'history': history[drop:], 'history_offset': offset + drop}
+        self._resize(session_id, -estimate_message_bytes(history[:drop]))
+        self.stats["compacted_messages"] += drop
+
+    def _finish(self, evicted):
+        """Archives sessions evicted under the lock; runs outside it because it talks to RavenDB."""
+        if not evicted:
+            return
+        self.logger.info(f"Evicted {len(evicted)} session(s); {len(self._sessions)} resident, "
+                         f"~{self.resident_bytes / 1_000_000:.1f} MB.")
+        if self.archive is None:
+            return
+        for session_id, session_data in evicted:
+            saved = self.archive.save(session_id, session_data)
+            if saved:
+                self.stats["archived"] += 1
+            with self._lock:
+                if self._archiving.get(session_id) is session_data:
+                    del self._archiving[session_id]
+                if not saved and session_id not in self._sessions:
+                    self._remove(session_id)  # Lost, so no longer listed
+
+    def create(self, session_id, session_data):
+        with self._lock:
+            self._add(session_id, session_data)
+            evicted = self._take_evictions()
+        self._finish(evicted)
+
+    def get(self, session_id):
+        with self._lock:
+            session_data = self._sessions.get(session_id)
+            if session_data is not None:
+                self._touch(session_id)
+            evicted = self._take_evictions()
+            pending_archive = self._archiving.get(session_id) if session_data is None else None
+        self._finish(evicted)
+        if session_data is not None or self.archive is None:
+            return session_data
+        return self._restore(session_id, pending_archive)
+
+    def _restore(self, session_id, session_data):
+        """Brings an evicted session back from the archive (or from an archive write still in flight)."""
+        if session_data is None:
+            session_data = self.archive.load(session_id)
+            if session_data is None:
+                return None
+        with self._lock:
+            current = self._sessions.get(session_id)
+            if current is not None:
+                return current
+            self._add(session_id, session_data)
+            self.stats["restored"] += 1
+            evicted = self._take_evictions()
+        self._finish(evicted)
+        return session_data
+
+    def _write(self, session_id, apply):
+        """
+        Runs `apply(session_data)` under the lock and returns its result,
+        restoring the session from the archive first if it was evicted.
+        Raises KeyError for a session that does not exist.
+        """
+        while True:
+            with self._lock:
+                session_data = self._sessions.get(session_id)
+                if session_data is not None:
+                    result = apply(session_data)
+                    self._touch(session_id)
+                    evicted = self._take_evictions()
+                    break
+                pending_archive = self._archiving.get(session_id)
+            if self.archive is None or self._restore(session_id, pending_archive) is None:
+                raise KeyError(session_id)
+        self._finish(evicted)
+        return result
+
+    def update(self, session_id, **fields):
+        def apply(session_data):
+            self._resize(session_id, _resized_by(session_data, fields))
+            session_data.update(fields)
+            if 'summarized_count' in fields:
+                self._compact(session_id)
+        self._write(session_id, apply)
+
+    def increment(self, session_id, field, amount=1):
+        """Adds `amount` to a counter field and returns its new value."""
+        def apply(session_data):
+            session_data[field] = session_data.get(field, 0) + amount
+            return session_data[field]
+        return self._write(session_id, apply)
+
+    def append_history(self, session_id, messages):
+        def apply(session_data):
+            session_data['history'].extend(messages)
+            self._resize(session_id, estimate_message_bytes(messages))
+            self._compact(session_id)
+        self._write(session_id, apply)
+
+    def pin(self, session_id, owner):
+        """Keeps a session resident until every owner that pinned it has called `unpin`."""
+        with self._lock:
+            self._pinned.setdefault(session_id, set()).add(owner)
+
+    def unpin(self, session_id, owner):
+        """Releases a pin taken by `owner`. Idempotent."""
+        with self._lock:
+            owners = self._pinned.get(session_id)
+            if owners is not None:
+                owners.discard(owner)
+                if not owners:
+                    del self._pinned[session_id]
+
+    def delete(self, session_id):
+        with self._lock:
+            existed = self._remove(session_id) is not None
+            self._archiving.pop(session_id, None)
+        if self.archive is not None:
+            existed = self.archive.delete(session_id) or existed
+        return existed
+
+    def clear(self):
+        with self._lock:
+            count = len(self._sessions)
+            self._sessions.clear()
+            self._last_used.clear()
+            self._sizes.clear()
+            self._created_seq.clear()
+            self._listed_seqs.clear()
+            self._listed_ids.clear()
+            self._archived_rows.clear()
+            self._archiving.clear()
+            self.resident_bytes = 0
+        if self.archive is not None:
+            self.archive.clear()
+        return count
+
+    def snapshot(self):
+        with self._lock:
+            return {**self.stats, "sessions": len(self._sessions), "resident_bytes": self.resident_bytes}
+
+    def list_sessions(self, after=None, limit=None):
+        """
+        Yields (session_id, title, is_locked, cursor) in creation order.
+
+        `after` is the cursor of the last session already seen; `limit` caps
+        how many sessions are yielded. Only the requested page is copied, so
+        its cost does not grow with the number of sessions.
+        """
+        with self._lock:
+            start = 0 if after is None else bisect_right(self._listed_seqs, after)
+            end = len(self._listed_seqs) if limit is None else start + limit
+            rows = [(session_id, self._listing_row(session_id), seq)
+                    for seq, session_id in zip(self._listed_seqs[start:end], self._listed_ids[start:end])]
+        for session_id, (title, is_locked), seq in rows:
+            yield session_id, title, is_locked, seq
+
+    def _listing_row(self, session_id):
+        session_data = self._sessions.get(session_id)
+        if session_data is None:
+            return self._archived_rows[session_id]
+        return session_data.get('title', 'New Chat'), session_data.get('is_locked', False)
+
+    def flush(self):
+        pass
+
+
+class _CachedSession:
+    def __init__(self, data, revision, persisted):
+        self.data = data
+        self.revision = revision
+        self.persisted = persisted
+        self.loaded_at = time.monotonic()
+        self.size = estimate_session_bytes(data)
+        self.created_at = None
+        self.pending_history = []
+        self.dirty_fields = set()
+        self.pending_increments = {}  # field -> amount not yet added on the server
+
+    @property
+    def has_pending_writes(self):
+        return not self.persisted or bool(self.pending_history) or bool(self.dirty_fields) or bool(self.pending_increments)
+
+
+class RavenDBSessionStore:
+    """Session store backed by the ChatSessions collection with a write-behind cache."""
+
+    def __init__(self, document_store, flush_interval_seconds=1.0, cache_ttl_seconds=5.0,
+                 max_cached_sessions=10000, max_cached_bytes=None, page_size=256, max_conflict_retries=3, logger=None):
+        self._store = document_store
+        self.logger = logger or logging.getLogger(__name__)
+        self.flush_interval_seconds = flush_interval_seconds
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.max_cached_sessions = max_cached_sessions
+        self.max_cached_bytes = max_cached_bytes
+        self.resident_bytes = 0
+        self.stats = {"evictions": 0}
+        self.page_size = page_size
+        self.max_conflict_retries = max_conflict_retries
+        self._cache = OrderedDict()  # session_id -> _CachedSession
+        self._pinned = {}  # session_id -> set of owners (chat turns in flight) keeping it cached
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+
+        try:
+            ChatSessions_ByCreatedAt().execute(self._store)
+        except Exception as e:
+            self.logger.error(f"Could not deploy the {SESSION_COLLECTION_NAME} index: {e}")
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="session-flusher", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def document_id(session_id):
+        return f"{SESSION_COLLECTION_NAME}/{session_id}"
+
+    @staticmethod
+    def _session_from_document(document):
+        session_data = {field: document.get(prop) for field, prop in SESSION_FIELDS.items()}
+        session_data['history'] = list(document.get('History') or [])
+        session_data['title'] = session_data['title'] or "New Chat"
+        session_data['illegal_count'] = session_data['illegal_count'] or 0
+        session_data['is_locked'] = bool(session_data['is_locked'])
+        session_data['conversation_summary'] = session_data['conversation_summary'] or ""
+        session_data['summarized_count'] = session_data['summarized_count'] or 0
+        session_data['history_offset'] = session_data['history_offset'] or 0
+        return session_data
+
+    def _load_document(self, session_id):
+        with self._store.open_session() as session:
+            return session.load(self.document_id(session_id), dict)
+
+    def _cached_from_document(self, document):
+        cached = _CachedSession(self._session_from_document(document), document.get('Revision') or 0, persisted=True)
+        cached.created_at = document.get('CreatedAt')
+        return cached
+
+    def _forget(self, session_id):
+        cached = self._cache.pop(session_id, None)
+        if cached is not None:
+            self.resident_bytes -= cached.size
+        return cached
+
+    def _remember(self, session_id, cached):
+        self._forget(session_id)
+        self._cache[session_id] = cached
+        self.resident_bytes += cached.size
+        now = time.monotonic()
+        # Clean entries past the TTL would be reloaded on their next read anyway; drop them from the LRU end.
+        while self._cache:
+            oldest_id, oldest = next(iter(self._cache.items()))
+            if (oldest is cached or oldest.has_pending_writes or oldest_id in self._pinned
+                    or now - oldest.loaded_at < self.cache_ttl_seconds):
+                break
+            self._forget(oldest_id)
+        while len(self._cache) > self.max_cached_sessions or (
+                self.max_cached_bytes is not None and self.resident_bytes > self.max_cached_bytes and len(self._cache) > 1):
+            # Only clean, unpinned entries can be dropped; dirty ones wait for the next flush.
+            evictable = next((sid for sid, entry in self._cache.items()
+                              if not entry.has_pending_writes and entry is not cached and sid not in self._pinned), None)
+            if evictable is None:
+                break
+            self._forget(evictable)
+            self.stats["evictions"] += 1
+
+    # --- Reads ---
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def get(self, session_id):
+        """Returns the cached session dict, reloading it from RavenDB when stale."""
+        with self._lock:
+            cached = self._cache.get(session_id)
+            if cached is not None and (cached.has_pending_writes or time.monotonic() - cached.loaded_at < self.cache_ttl_seconds):
+                self._cache.move_to_end(session_id)
+                return cached.data
+
+        try:
+            document = self._load_document(session_id)
+        except Exception as e:
+            self.logger.error(f"Failed to load session {session_id} from RavenDB: {e}")
+            return cached.data if cached is not None else None
+
+        with self._lock:
+            cached = self._cache.get(session_id)
+            if cached is not None and cached.has_pending_writes:
+                return cached.data
+            if document is None:
+                self._forget(session_id)
+                return None
+            refreshed = self._cached_from_document(document)
+            self._remember(session_id, refreshed)
+            return refreshed.data
+
+    def list_sessions(self, after=None, limit=None):
+        """
+        Yields (session_id, title, is_locked, cursor) in creation order.
+
+        Pages through the index with a keyset on CreatedAt, so fetching the
+        page after `after` costs the same no matter how deep it is.
+        """
+        listed_ids = set()
+        last_created_at = after
+        yielded = 0
+        try:
+            while limit is None or yielded < limit:
+                page_size = self.page_size if limit is None else min(self.page_size, limit - yielded)
+                rql = (
+                    f"from index '{ChatSessions_ByCreatedAt().index_name}' as s "
+                    + ("where s.CreatedAt > $after " if last_created_at is not None else "")
+                    + "order by s.CreatedAt as double "
+                    "select { Id: id(s), Title: s.Title, IsLocked: s.IsLocked, CreatedAt: s.CreatedAt }"
+                )
+                with self._store.open_session() as session:
+                    query = session.advanced.raw_query(rql, dict)
+                    if last_created_at is not None:
+                        query = query.add_parameter("after", last_created_at)
+                    page = list(query.take(page_size))
+                for row in page:
+                    session_id = row['Id'].split('/', 1)[1]
+                    listed_ids.add(session_id)
+                    last_created_at = row.get('CreatedAt')
+                    with self._lock:
+                        cached = self._cache.get(session_id)
+                    if cached is not None and (cached.has_pending_writes or time.monotonic() - cached.loaded_at < self.cache_ttl_seconds):
+                        yield session_id, cached.data['title'], cached.data['is_locked'], last_created_at
+                    else:
+                        yield session_id, row.get('Title') or "New Chat", bool(row.get('IsLocked')), last_created_at
+                    yielded += 1
+                if len(page) < page_size:
+                    break
+        except Exception as e:
+            self.logger.error(f"Failed to page through sessions in RavenDB: {e}")
+
+        # Sessions created moments ago may not be flushed or indexed yet.
+        with self._lock:
+            unlisted = sorted(
+                ((entry.created_at, sid, entry) for sid, entry in self._cache.items()
+                 if sid not in listed_ids and not entry.persisted and (after is None or entry.created_at > after)),
+                key=lambda item: item[0]
+            )
+        for created_at, session_id, cached in unlisted:
+            if limit is not None and yielded >= limit:
+                return
+            yielded += 1
+            yield session_id, cached.data['title'], cached.data['is_locked'], created_at
+
+    def __len__(self):
+        return sum(1 for _ in self.list_sessions())
+
+    # --- Writes (write-behind) ---
+    def create(self, session_id, session_data):
+        with self._lock:
+            cached = _CachedSession(session_data, revision=0, persisted=False)
+            cached.created_at = time.time()
+            self._remember(session_id, cached)
+
+    def _write(self, session_id, apply):
+        """
+        Runs apply(cached) under the lock and returns its result. A session that
+        has dropped out of the cache is loaded from RavenDB first; KeyError means
+        it no longer exists.
+        """
+        loaded = None
+        while True:
+            with self._lock:
+                cached = self._cache.get(session_id)
+                if cached is None and loaded is not None:
+                    self._remember(session_id, loaded)
+                    cached = loaded
+                if cached is not None:
+                    return apply(cached)
+            # Loaded outside the lock; if another write re-cached the session meanwhile, that entry wins.
+            document = self._load_document(session_id)
+            if document is None:
+                raise KeyError(session_id)
+            loaded = self._cached_from_document(document)
+
+    def update(self, session_id, **fields):
+        def apply(cached):
+            delta = _resized_by(cached.data, fields)
+            cached.size += delta
+            self.resident_bytes += delta
+            cached.data.update(fields)
+            cached.dirty_fields.update(fields)
+            for field in fields:
+                cached.pending_increments.pop(field, None)  # The absolute value already includes them
+        self._write(session_id, apply)
+
+    def increment(self, session_id, field, amount=1):
+        """Adds `amount` to a counter field and returns its new value; flushed as a server-side increment."""
+        def apply(cached):
+            cached.data[field] = (cached.data.get(field) or 0) + amount
+            if field not in cached.dirty_fields:  # Otherwise the pending absolute write carries it
+                cached.pending_increments[field] = cached.pending_increments.get(field, 0) + amount
+            return cached.data[field]
+        return self._write(session_id, apply)
+
+    def append_history(self, session_id, messages):
+        def apply(cached):
+            cached.data['history'].extend(messages)
+            cached.pending_history.extend(messages)
+            delta = estimate_message_bytes(messages)
+            cached.size += delta
+            self.resident_bytes += delta
+        self._write(session_id, apply)
+
+    def pin(self, session_id, owner):
+        """Keeps a session cached until every owner that pinned it has called `unpin`."""
+        with self._lock:
+            self._pinned.setdefault(session_id, set()).add(owner)
+
+    def unpin(self, session_id, owner):
+        """Releases a pin taken by `owner`. Idempotent."""
+        with self._lock:
+            owners = self._pinned.get(session_id)
+            if owners is not None:
+                owners.discard(owner)
+                if not owners:
+                    del self._pinned[session_id]
+
+    def delete(self, session_id):
+        with self._lock:
+            was_cached = self._forget(session_id) is not None
+        try:
+            with self._store.open_session() as session:
+                existed = session.load(self.document_id(session_id), dict) is not None
+                if existed:
+                    session.delete(self.document_id(session_id))
+                    session.save_changes()
+            return existed or was_cached
+        except Exception as e:
+            self.logger.error(f"Failed to delete session {session_id} from RavenDB: {e}")
+            return was_cached
+
+    def clear(self):
+        count = len(self)
+        with self._lock:
+            self._cache.clear()
+            self.resident_bytes = 0
+        try:
+            self._store.operations.send_async(DeleteByQueryOperation(f"from {SESSION_COLLECTION_NAME}")).wait_for_completion()
+        except Exception as e:
+            self.logger.error(f"Failed to clear sessions in RavenDB: {e}")
+        return count
+
+    def snapshot(self):
+        with self._lock:
+            return {**self.stats, "sessions": len(self._cache), "resident_bytes": self.resident_bytes}
+
+    # --- Flushing ---
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval_seconds):
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.error(f"Session flush failed: {e}", exc_info=True)
+
+    def _take_pending(self):
+        """Detaches pending writes from the cache so new writes can queue up during the flush."""
+        new_documents, history_appends, increments, field_updates = [], [], [], []
+        with self._lock:
+            for session_id, cached in self._cache.items():
+                if not cached.persisted:
+                    new_documents.append((session_id, cached, dict(cached.data), list(cached.data['history'])))
+                    cached.persisted = True
+                    cached.pending_history = []
+                    cached.dirty_fields = set()
+                    cached.pending_increments = {}
+                    continue
+                if cached.pending_history:
+                    history_appends.append((session_id, cached, cached.pending_history))
+                    cached.pending_history = []
+                if cached.pending_increments:
+                    increments.append((session_id, cached, cached.pending_increments))
+                    cached.pending_increments = {}
+                if cached.dirty_fields:
+                    fields = {SESSION_FIELDS[field]: cached.data[field] for field in cached.dirty_fields}
+                    field_updates.append((session_id, cached, fields))
+                    cached.dirty_fields = set()
+        return new_documents, history_appends, increments, field_updates
+
+    def flush(self):
+        """Writes every pending change to RavenDB."""
+        with self._flush_lock:
+            new_documents, history_appends, increments, field_updates = self._take_pending()
+            if not (new_documents or history_appends or increments or field_updates):
+                return
+            updated_at = time.time()
+
+            # New documents, history appends and increments never conflict, so they share one batch.
+            if new_documents or history_appends or increments:
+                try:
+                    with self._store.open_session() as session:
+                        for session_id, cached, data, history in new_documents:
+                            document = ChatSessionDocument(
+                                title=data['title'], illegal_count=data['illegal_count'], is_locked=data['is_locked'],
+                                conversation_summary=data['conversation_summary'],
+                                summarized_count=data.get('summarized_count', 0), history=history,
+                                history_offset=data.get('history_offset', 0),
+                                created_at=cached.created_at, updated_at=updated_at
+                            )
+                            session.store(document, self.document_id(session_id))
+                            session.advanced.get_metadata_for(document)["@collection"] = SESSION_COLLECTION_NAME
+                        for session_id, _, messages in history_appends:
+                            session.advanced.defer(PatchCommandData(
+                                self.document_id(session_id), None,
+                                PatchRequest(APPEND_HISTORY_SCRIPT, {"messages": messages, "updatedAt": updated_at})
+                            ))
+                        for session_id, _, amounts in increments:
+                            session.advanced.defer(PatchCommandData(
+                                self.document_id(session_id), None,
+                                PatchRequest(INCREMENT_FIELDS_SCRIPT, {
+                                    "increments": {SESSION_FIELDS[field]: amount for field, amount in amounts.items()},
+                                    "updatedAt": updated_at
+                                })
+                            ))
+                        session.save_changes()
+                except Exception as e:
+                    self.logger.error(f"Failed to flush session history to RavenDB, will retry: {e}")
+                    self._requeue(new_documents, history_appends, increments, field_updates)
+                    return
+
+            for session_id, cached, fields in field_updates:
+                self._flush_fields(session_id, cached, fields, updated_at)
+
+    def _flush_fields(self, session_id, cached, fields, updated_at):
+        for _ in range(self.max_conflict_retries + 1):
+            try:
+                with self._store.open_session() as session:
+                    session.advanced.defer(PatchCommandData(
+                        self.document_id(session_id), None,
+                        PatchRequest(UPDATE_FIELDS_SCRIPT, {
+                            "fields": fields, "expectedRevision": cached.revision, "updatedAt": updated_at
+                        })
+                    ))
+                    session.save_changes()
+                with self._lock:
+                    cached.revision += 1
+                return
+            except Exception as e:
+                if 'RevisionConflict' not in str(e):
+                    self.logger.error(f"Failed to flush fields of session {session_id}, will retry: {e}")
+                    with self._lock:
+                        cached.dirty_fields.update(field for field, prop in SESSION_FIELDS.items() if prop in fields)
+                    return
+                # Another writer changed the session: rebase on its state, keep our field values.
+                self.logger.warning(f"Concurrent update on session {session_id}; reloading and re-applying {sorted(fields)}.")
+                document = self._load_document(session_id)
+                if document is None:
+                    return
+                with self._lock:
+                    server_state = self._session_from_document(document)
+                    for field, prop in SESSION_FIELDS.items():
+                        if prop not in fields and field not in cached.dirty_fields:
+                            cached.data[field] = server_state[field]
+                            if field in cached.pending_increments:
+                                # Increments taken after this flush started are not on the server yet.
+                                cached.data[field] += cached.pending_increments[field]
+                    cached.revision = document.get('Revision') or 0
+        self.logger.error(f"Giving up on field update for session {session_id} after {self.max_conflict_retries} conflicts.")
+
+    def _requeue(self, new_documents, history_appends, increments, field_updates):
+        with self._lock:
+            for session_id, cached, _, _ in new_documents:
+                cached.persisted = False
+            for session_id, cached, messages in history_appends:
+                self._requeue_entry(session_id, cached).pending_history[:0] = messages
+            for session_id, cached, amounts in increments:
+                cached = self._requeue_entry(session_id, cached)
+                for field, amount in amounts.items():
+                    if field not in cached.dirty_fields:
+                        cached.pending_increments[field] = cached.pending_increments.get(field, 0) + amount
+            for session_id, cached, fields in field_updates:
+                cached.dirty_fields.update(field for field, prop in SESSION_FIELDS.items() if prop in fields)
+
+    def _requeue_entry(self, session_id, cached):
+        """The entry failed writes go back to; an entry evicted during the flush is cached again so they are not lost."""
+        current = self._cache.get(session_id)
+        if current is None:
+            self._remember(session_id, cached)
+            return cached
+        return current
+
+    def close(self):
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception as e:
+            self.logger.error(f"Final session flush failed: {e}")
+
+
+class RavenDBSessionArchive:
+    """
+    Keeps sessions evicted from an InMemorySessionStore as ChatSessions
+    documents, in the format RavenDBSessionStore reads, so they can be
+    restored later by this store or served by the RavenDB backend.
+    """
+
+    def __init__(self, document_store, logger=None):
+        self._store = document_store
+        self.logger = logger or logging.getLogger(__name__)
+
+    def save(self, session_id, session_data):
+        document = ChatSessionDocument(
+            title=session_data['title'], illegal_count=session_data['illegal_count'], is_locked=session_data['is_locked'],
+            conversation_summary=session_data['conversation_summary'],
+            summarized_count=session_data.get('summarized_count', 0), history=list(session_data['history']),
+            history_offset=session_data.get('history_offset', 0), created_at=time.time(), updated_at=time.time()
+        )
+        try:
+            with self._store.open_session() as session:
+                session.store(document, RavenDBSessionStore.document_id(session_id))
+                session.advanced.get_metadata_for(document)["@collection"] = SESSION_COLLECTION_NAME
+                session.save_changes()
+            return True
+        except Exception as e:
+            self.logger.error(f"Failed to archive session {session_id} to RavenDB; it is lost: {e}")
+            return False
+
+    def load(self, session_id):
+        try:
+            with self._store.open_session() as session:
+                document = session.load(RavenDBSessionStore.document_id(session_id), dict)
+        except Exception as e:
+            self.logger.error(f"Failed to load archived session {session_id} from RavenDB: {e}")
+            return None
+        return RavenDBSessionStore._session_from_document(document) if document is not None else None
+
+    def delete(self, session_id):
+        try:
+            with self._store.open_session() as session:
+                if session.load(RavenDBSessionStore.document_id(session_id), dict) is None:
+                    return False
+                session.delete(RavenDBSessionStore.document_id(session_id))
+                session.save_changes()
+            return True
+        except Exception as e:
+            self.logger.error(f"Failed to delete archived session {session_id} from RavenDB: {e}")
+            return False
+
+    def clear(self):
+        try:
+            self._store.operations.send_async(DeleteByQueryOperation(f"from {SESSION_COLLECTION_NAME}")).wait_for_completion()
+        except Exception as e:
+            self.logger.error(f"Failed to clear archived sessions in RavenDB: {e}")
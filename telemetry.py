@@ -0,0 +1,198 @@
+"""
+Request instrumentation for app.py: Prometheus metrics served at /metrics and
+an optional JSON-lines trace log with one record per chat request.
+
+Counters and histograms are updated where the work happens (pipeline stages,
+OpenAI token usage, upstream errors). Values that other components already
+count, such as the cache and circuit breaker snapshots, are registered as
+collected metrics and only read when /metrics is scraped.
+
+Disabled metrics cost one no-op method call: a disabled registry hands out a
+shared null metric. Traces exist only while a trace log is configured; the
+request being traced is found through the `current_trace` context variable.
+"""
+import bisect
+import contextvars
+import json
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)  # Seconds
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_sample(name, labelnames, label_values, value, extra_label=None):
+    pairs = [f'{label}="{_escape(label_value)}"' for label, label_value in zip(labelnames, label_values)]
+    if extra_label:
+        pairs.append(extra_label)
+    labels = "{" + ",".join(pairs) + "}" if pairs else ""
+    return f"{name}{labels} {value}"
+
+
+class _NullMetric:
+    def inc(self, label_values=(), amount=1):
+        pass
+
+    def observe(self, label_values, value):
+        pass
+
+
+NULL_METRIC = _NullMetric()
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values=(), amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [_format_sample(self.name, self.labelnames, label_values, value) for label_values, value in values]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [count per bucket..., count above the last bucket, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        index = bisect.bisect_left(self.buckets, value)  # Buckets are inclusive upper bounds
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        with self._lock:
+            snapshot = [(label_values, list(series)) for label_values, series in self._series.items()]
+        lines = []
+        for label_values, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                lines.append(_format_sample(f"{self.name}_bucket", self.labelnames, label_values, cumulative, f'le="{bound}"'))
+            lines.append(_format_sample(f"{self.name}_sum", self.labelnames, label_values, round(series[-1], 6)))
+            lines.append(_format_sample(f"{self.name}_count", self.labelnames, label_values, cumulative))
+        return lines
+
+
+class CollectedMetric:
+    """Metric whose samples `collect()` returns at scrape time as [(label_values, value)]."""
+
+    def __init__(self, kind, name, help_text, labelnames, collect):
+        self.kind = kind
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def render(self):
+        return [_format_sample(self.name, self.labelnames, label_values, value) for label_values, value in self.collect()]
+
+
+class MetricsRegistry:
+    def __init__(self, enabled=True, logger=None):
+        self.enabled = enabled
+        self.logger = logger
+        self._metrics = []
+
+    def _register(self, metric):
+        if not self.enabled:
+            return NULL_METRIC
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def collected(self, kind, name, help_text, labelnames, collect):
+        self._register(CollectedMetric(kind, name, help_text, labelnames, collect))
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.render()
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Could not collect metric {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+class RequestTrace:
+    """Stage spans, token counts and attributes of one chat request; stages may report from other threads."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.attributes = {}
+        self.spans = []
+        self.tokens = {}
+        self.deferred = False  # Set by streaming endpoints, which write the trace when the stream ends
+        self._lock = threading.Lock()
+
+    def add_span(self, stage_name, duration_seconds):
+        start_ms = (time.perf_counter() - duration_seconds - self._start) * 1000
+        with self._lock:
+            self.spans.append({"stage": stage_name, "start_ms": round(start_ms, 1), "duration_ms": round(duration_seconds * 1000, 1)})
+
+    def add_tokens(self, key, count):
+        with self._lock:
+            self.tokens[key] = self.tokens.get(key, 0) + count
+
+    def to_record(self, status):
+        with self._lock:
+            return {
+                "timestamp": round(self.started_at, 3),
+                "endpoint": self.endpoint,
+                "status": status,
+                "duration_ms": round((time.perf_counter() - self._start) * 1000, 1),
+                **self.attributes,
+                "spans": sorted(self.spans, key=lambda span: span["start_ms"]),
+                "tokens": dict(self.tokens)
+            }
+
+
+class TraceLog:
+    """Appends one JSON line per finished request trace; line-buffered so `tail -f` sees each request."""
+
+    def __init__(self, path):
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+
+    def write(self, trace, status):
+        line = json.dumps(trace.to_record(status), ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
@@ -0,0 +1,156 @@
+"""
+In-process vector index over the Context chunks.
+
+app.py searches it when RavenDB is unreachable or a query fails, and can
+optionally put it in front of RavenDB as a low-latency first tier.
+rag_chunker_script.py builds it from the collection after a sync, writing
+one directory:
+
+- meta.json: count, dimensions, dtype and the embedding model_id
+- vectors.bin: row-major unit vectors as float16, or as int8 with a
+  per-row scale (symmetric quantization, max |value| maps to 127)
+- scales.bin: float32 row scales (int8 only)
+- chunks.jsonl: one JSON object per chunk (Id, Title, Content, SourceFile, ChunkNumber)
+- offsets.bin: uint64 byte offset of every chunks.jsonl line, plus the end
+
+Every file is memory-mapped, so opening an index is nearly free and the OS
+pages data in on demand. Search is exact brute force over the quantized
+vectors: rows are scanned in blocks of about SEARCH_BLOCK_BYTES, each block
+is upcast to float32 for one BLAS matrix-vector product, and a running top-k
+is kept with argpartition, so working memory is one block whatever the size.
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+SUPPORTED_DTYPES = {"float16": np.float16, "int8": np.int8}
+SEARCH_BLOCK_BYTES = 512 * 1024  # float32 working set per scanned block; small enough to stay in L2 cache
+INT8_MAX = 127
+
+
+def _unit_rows(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class VectorIndexWriter:
+    """
+    Streams vectors and chunks into an index directory.
+
+    Files are written under temporary names and moved into place by close(),
+    meta.json last, so a reader never sees a half-written index.
+    """
+
+    def __init__(self, directory, dtype="int8", model_id="", dimensions=None):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported vector index dtype '{dtype}'; expected one of {', '.join(SUPPORTED_DTYPES)}.")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.dtype = dtype
+        self.model_id = model_id
+        self.dimensions = dimensions
+        self.count = 0
+        self._chunk_bytes = 0
+        self._files = {name: open(self.directory / f"{name}.tmp", "wb")
+                       for name in ("vectors.bin", "scales.bin", "chunks.jsonl", "offsets.bin")}
+
+    def add(self, vector, chunk):
+        self.add_batch([vector], [chunk])
+
+    def add_batch(self, vectors, chunks):
+        """Appends unit-normalized vectors and their chunk dicts."""
+        rows = _unit_rows(vectors)
+        if self.dimensions is None:
+            self.dimensions = rows.shape[1]
+        if rows.shape[1] != self.dimensions:
+            raise ValueError(f"Expected {self.dimensions}-dimensional vectors, got {rows.shape[1]}.")
+        if self.dtype == "int8":
+            scales = np.abs(rows).max(axis=1) / INT8_MAX
+            scales[scales == 0] = 1.0
+            self._files["scales.bin"].write(scales.astype(np.float32).tobytes())
+            rows = np.round(rows / scales[:, None]).astype(np.int8)
+        else:
+            rows = rows.astype(np.float16)
+        self._files["vectors.bin"].write(rows.tobytes())
+
+        lines = [(json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8") for chunk in chunks]
+        offsets = self._chunk_bytes + np.cumsum([0] + [len(line) for line in lines[:-1]], dtype=np.uint64)
+        self._files["offsets.bin"].write(offsets.astype(np.uint64).tobytes())
+        self._files["chunks.jsonl"].write(b"".join(lines))
+        self._chunk_bytes += sum(len(line) for line in lines)
+        self.count += len(lines)
+
+    def close(self):
+        self._files["offsets.bin"].write(np.uint64(self._chunk_bytes).tobytes())
+        for name, f in self._files.items():
+            f.close()
+            os.replace(self.directory / f"{name}.tmp", self.directory / name)
+        meta = {"count": self.count, "dimensions": self.dimensions or 0, "dtype": self.dtype, "model_id": self.model_id}
+        (self.directory / "meta.json.tmp").write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(self.directory / "meta.json.tmp", self.directory / "meta.json")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            for name, f in self._files.items():
+                f.close()
+                (self.directory / f"{name}.tmp").unlink(missing_ok=True)
+        return False
+
+
+class LocalVectorIndex:
+    """Read-only, memory-mapped index written by VectorIndexWriter; safe to share between threads."""
+
+    def __init__(self, directory):
+        directory = Path(directory)
+        meta = json.loads((directory / "meta.json").read_text(encoding="utf-8"))
+        self.count = meta["count"]
+        self.dimensions = meta["dimensions"]
+        self.dtype = meta["dtype"]
+        self.model_id = meta["model_id"]
+        if self.count:
+            self._vectors = np.memmap(directory / "vectors.bin", dtype=SUPPORTED_DTYPES[self.dtype], mode="r",
+                                      shape=(self.count, self.dimensions))
+            self._scales = np.memmap(directory / "scales.bin", dtype=np.float32, mode="r",
+                                     shape=(self.count,)) if self.dtype == "int8" else None
+            self._offsets = np.memmap(directory / "offsets.bin", dtype=np.uint64, mode="r", shape=(self.count + 1,))
+            self._chunks = np.memmap(directory / "chunks.jsonl", dtype=np.uint8, mode="r")
+        self.block_rows = max(1, SEARCH_BLOCK_BYTES // (4 * max(self.dimensions, 1)))
+
+    def search(self, query_vector, k, min_similarity=None):
+        """Returns up to k (row, cosine similarity) pairs, best first."""
+        if not self.count or k <= 0:
+            return []
+        query = _unit_rows(query_vector)[0]
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, self.count, self.block_rows):
+            scores = self._vectors[start:start + self.block_rows].astype(np.float32) @ query
+            if self._scales is not None:
+                scores *= self._scales[start:start + self.block_rows]
+            top = np.argpartition(scores, -k)[-k:] if len(scores) > k else np.arange(len(scores))
+            best_rows = np.concatenate([best_rows, top + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            if len(best_scores) > k:
+                keep = np.argpartition(best_scores, -k)[-k:]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+        order = np.argsort(-best_scores, kind="stable")
+        results = [(int(best_rows[i]), float(best_scores[i])) for i in order]
+        if min_similarity is not None:
+            results = [(row, score) for row, score in results if score >= min_similarity]
+        return results
+
+    def get_chunk(self, row):
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        return json.loads(bytes(self._chunks[start:end]))
+
+    def search_chunks(self, query_vector, k, min_similarity=None):
+        """Returns up to k chunk dicts shaped like the RavenDB projection, best first."""
+        return [self.get_chunk(row) for row, _ in self.search(query_vector, k, min_similarity)]